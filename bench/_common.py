@@ -0,0 +1,24 @@
+# bench/_common.py
+"""benchmark 共用：找到 client 的模組、登入一個 benchmark 用的玩家帳號。"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "client"))
+
+from network import Channel, connect_to_server, recv_json, send_json  # noqa: E402
+
+USERNAME = "bench"
+PASSWORD = "bench"
+
+
+def login(host: str, port: int, binary: bool = True) -> Channel:
+    """連上 lobby 並用 bench 帳號登入（帳號不存在就先註冊）。"""
+    ch = connect_to_server(host, port, binary=binary)
+    account = {"role": "player", "username": USERNAME, "password": PASSWORD}
+    send_json(ch, {"role": "system", "action": "register", "payload": account})
+    recv_json(ch)  # 已經註冊過會回錯誤，不用管
+    send_json(ch, {"role": "system", "action": "login", "payload": account})
+    resp = recv_json(ch)
+    if not resp or resp.get("status") != "ok":
+        raise SystemExit(f"login failed: {resp}")
+    return ch
@@ -0,0 +1,89 @@
+# bench/bench_parallel_download.py
+"""
+平行分段下載的 benchmark：同一個檔案用 1 條連線（download_game）和 N 條連線（download_ticket + download_range）
+各下載一次，比較 throughput；--delay 會在中間加一個延遲 proxy（bench/delay_proxy.py）模擬遠端的 server。
+
+    python bench/seed_big_game.py --size-mb 100
+    cd server && python lobby_server.py
+    python bench/bench_parallel_download.py --connections 1,2,4,8
+    python bench/bench_parallel_download.py --connections 1,2,4,8 --delay 0.02   # 單程 20ms
+
+輸出檔預設寫到 /dev/shm（沒有的話用系統暫存目錄），避免量到磁碟速度。
+"""
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+import delay_proxy
+from _common import login, recv_json, send_json
+from network import PIECE_SIZE, download_ranges
+
+PROXY_PORT = 7373  # 有 --delay 時 lobby 的 proxy；資料通道的 proxy 用下一個 port
+
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7070)
+    parser.add_argument("--game", default="big")
+    parser.add_argument("--connections", default="1,2,4,8", help="逗號分隔，1 = 單一連線的 download_game")
+    parser.add_argument("--delay", type=float, default=0.0, help="單程延遲（秒）")
+    parser.add_argument("--window", type=int, default=1 << 20, help="proxy 每條連線在途資料上限（bytes）")
+    args = parser.parse_args()
+
+    host, port = args.host, args.port
+    transfer_port = None
+    if args.delay:
+        ch = login(host, port)
+        send_json(ch, {"role": "player", "action": "download_ticket", "payload": {"game_name": args.game}})
+        real_transfer_port = (recv_json(ch) or {}).get("transfer_port")
+        ch.close()
+        delay_proxy.start(PROXY_PORT, (host, port), args.delay, args.window)
+        if real_transfer_port:
+            delay_proxy.start(PROXY_PORT + 1, (host, real_transfer_port), args.delay, args.window)
+            transfer_port = PROXY_PORT + 1
+        host, port = "127.0.0.1", PROXY_PORT
+
+    ch = login(host, port)
+    out = os.path.join("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir(), "bench_parallel.out")
+    for n in (int(x) for x in args.connections.split(",")):
+        start = time.perf_counter()
+        if n == 1:
+            send_json(ch, {"role": "player", "action": "download_game", "payload": {"game_name": args.game}})
+            header = recv_json(ch)
+            if not header or header.get("status") != "ok":
+                raise SystemExit(f"download_game failed: {header}")
+            size, sha256 = header["archive_size"], header["sha256"]
+            with open(out, "wb") as f:
+                ch.recv_file(f, header["length"], header.get("stream"))
+        else:
+            send_json(ch, {"role": "player", "action": "download_ticket", "payload": {"game_name": args.game}})
+            ticket = recv_json(ch)
+            if not ticket or ticket.get("status") != "ok":
+                raise SystemExit(f"download_ticket failed: {ticket}")
+            size, sha256 = ticket["archive_size"], ticket["sha256"]
+            with open(out, "wb") as f:
+                f.truncate(size)
+            ranges = [(off, min(PIECE_SIZE, size - off)) for off in range(0, size, PIECE_SIZE)]
+            download_ranges(ch, ticket["ticket"], out, ranges, n,
+                            transfer_port=transfer_port if args.delay else ticket.get("transfer_port"))
+        elapsed = time.perf_counter() - start
+        ok = _sha256(out) == sha256
+        print(f"delay {args.delay * 1000:3.0f}ms  connections={n}: {size / elapsed / 1e6:6.1f} MB/s  sha256 {'ok' if ok else 'MISMATCH'}",
+              flush=True)
+    ch.close()
+    os.remove(out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# bench/bench_sendfile.py
+"""
+下載送檔方式的 benchmark（socket.sendfile vs 每次讀 4KB 再 sendall 的迴圈）。
+
+local：不用 server，在 loopback 上直接比兩種送法，收的那邊都用 client 的 Channel.recv_file
+    python bench/bench_sendfile.py local --size-mb 200
+server：對正在執行的 lobby server 下載 bench/seed_big_game.py 放進去的遊戲，line / binary 兩種模式各跑幾次取最快
+    python bench/seed_big_game.py --size-mb 200
+    cd server && python lobby_server.py          # 或 lobby_async.py
+    python bench/bench_sendfile.py server --reps 8
+  要比較改之前的 server，checkout 舊的 commit 再跑一次 server 模式。
+
+輸出檔預設寫到 /dev/shm（沒有的話用系統暫存目錄），避免量到磁碟速度。
+"""
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+from _common import Channel, login, recv_json, send_json
+
+CHUNK = 4096  # 舊版 player_download_game 一次讀的大小
+
+
+def _out_dir() -> str:
+    return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def send_chunked(conn: socket.socket, path: str):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK)
+            if not chunk:
+                break
+            conn.sendall(chunk)
+
+
+def send_sendfile(conn: socket.socket, path: str):
+    with open(path, "rb") as f:
+        conn.sendfile(f)
+
+
+def run_local(args):
+    out = os.path.join(_out_dir(), "bench_sendfile.out")
+    src = os.path.join(_out_dir(), "bench_sendfile.src")
+    size = args.size_mb * 1024 * 1024
+    with open(src, "wb") as f:
+        for _ in range(args.size_mb):
+            f.write(os.urandom(1024 * 1024))
+
+    srv = socket.create_server(("127.0.0.1", 0))
+    port = srv.getsockname()[1]
+    try:
+        for name, send in (("chunked 4KB", send_chunked), ("sendfile", send_sendfile)):
+            best = 0.0
+            for _ in range(args.reps):
+                sender = threading.Thread(target=lambda: _serve_once(srv, send, src))
+                sender.start()
+                ch = Channel(socket.create_connection(("127.0.0.1", port)))
+                start = time.perf_counter()
+                with open(out, "wb") as f:
+                    ch.recv_file(f, size)
+                elapsed = time.perf_counter() - start
+                sender.join()
+                ch.close()
+                best = max(best, size / elapsed / 1e6)
+            print(f"{name:12s} {best:7.0f} MB/s")
+    finally:
+        srv.close()
+        for p in (src, out):
+            os.remove(p)
+
+
+def _serve_once(srv: socket.socket, send, path: str):
+    conn, _ = srv.accept()
+    with conn:
+        send(conn, path)
+
+
+def run_server(args):
+    out = os.path.join(_out_dir(), "bench_sendfile.out")
+    for mode in ("line", "binary"):
+        ch = login(args.host, args.port, binary=(mode == "binary"))
+        best = 0.0
+        size = 0
+        for _ in range(args.reps):
+            start = time.perf_counter()
+            send_json(ch, {"role": "player", "action": "download_game", "payload": {"game_name": args.game}})
+            header = recv_json(ch)
+            if not header or header.get("status") != "ok":
+                raise SystemExit(f"download_game failed: {header}")
+            size = header["length"]
+            with open(out, "wb") as f:
+                ch.recv_file(f, size, header.get("stream"))
+            best = max(best, size / (time.perf_counter() - start) / 1e6)
+        ch.close()
+        print(f"{mode:6s} {best:7.0f} MB/s ({size >> 20} MB)")
+    os.remove(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    local = sub.add_parser("local")
+    local.add_argument("--size-mb", type=int, default=200)
+    local.add_argument("--reps", type=int, default=5)
+    server = sub.add_parser("server")
+    server.add_argument("--host", default="127.0.0.1")
+    server.add_argument("--port", type=int, default=7070)
+    server.add_argument("--game", default="big")
+    server.add_argument("--reps", type=int, default=8)
+    args = parser.parse_args()
+    if args.cmd == "local":
+        run_local(args)
+    else:
+        run_server(args)
+
+
+if __name__ == "__main__":
+    main()
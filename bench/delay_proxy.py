@@ -0,0 +1,80 @@
+# bench/delay_proxy.py
+"""
+模擬高延遲網路的 TCP proxy（沒有 netem 的環境用）：每個方向的資料晚 delay 秒才轉送，
+每條連線在途的資料最多 window bytes，像 TCP window 一樣限制單一連線的 throughput（約 window / RTT）。
+"""
+import collections
+import socket
+import threading
+import time
+
+
+def _pipe(src: socket.socket, dst: socket.socket, delay: float, window: int):
+    pending = collections.deque()  # (送出時間, data)；空的 data 代表 EOF
+    cv = threading.Condition()
+    inflight = [0]
+
+    def reader():
+        while True:
+            with cv:
+                while inflight[0] >= window:
+                    cv.wait()
+            try:
+                data = src.recv(65536)
+            except OSError:
+                data = b""
+            with cv:
+                pending.append((time.monotonic() + delay, data))
+                inflight[0] += len(data)
+                cv.notify_all()
+            if not data:
+                return
+
+    def writer():
+        while True:
+            with cv:
+                while not pending:
+                    cv.wait()
+                due, data = pending.popleft()
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            if not data:
+                try:
+                    dst.shutdown(socket.SHUT_WR)
+                except OSError:
+                    pass
+                return
+            try:
+                dst.sendall(data)
+            except OSError:
+                return
+            with cv:
+                inflight[0] -= len(data)
+                cv.notify_all()
+
+    threading.Thread(target=reader, daemon=True).start()
+    threading.Thread(target=writer, daemon=True).start()
+
+
+def start(listen_port: int, target, delay: float = 0.02, window: int = 1 << 20) -> socket.socket:
+    """在 127.0.0.1:listen_port 開 proxy，轉到 target (host, port)；回傳 listening socket。"""
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.bind(("127.0.0.1", listen_port))
+    srv.listen(64)
+
+    def accept_loop():
+        while True:
+            try:
+                client, _ = srv.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(target)
+            for s in (client, upstream):
+                s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _pipe(client, upstream, delay, window)
+            _pipe(upstream, client, delay, window)
+
+    threading.Thread(target=accept_loop, name="delay-proxy", daemon=True).start()
+    return srv
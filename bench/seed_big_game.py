@@ -0,0 +1,51 @@
+# bench/seed_big_game.py
+"""
+在 server 的商城裡放一個很大的假遊戲，給下載相關的 benchmark 用：
+server/uploaded_games/<name>_1.zip（不壓縮，裡面是亂數資料）+ 商城資料裡的一筆。
+
+在 repo 根目錄執行（會動到 server/data，請用測試用的資料）：
+    python bench/seed_big_game.py --size-mb 200
+"""
+import argparse
+import os
+import sys
+import zipfile
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent / "server"
+sys.path.insert(0, str(SERVER_DIR))
+
+import db_server  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--name", default="big")
+    parser.add_argument("--size-mb", type=int, default=200)
+    args = parser.parse_args()
+
+    upload_dir = SERVER_DIR / "uploaded_games"
+    upload_dir.mkdir(exist_ok=True)
+    zip_path = upload_dir / f"{args.name}_1.zip"
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_STORED) as z:
+        z.writestr("game_server.py", "print('benchmark')\n")
+        z.writestr("game_client.py", "print('benchmark')\n")
+        with z.open("blob.bin", "w", force_zip64=True) as f:
+            for _ in range(args.size_mb):
+                f.write(os.urandom(1024 * 1024))
+
+    games = db_server.load_games_for_update()
+    games[args.name] = {
+        "version": "1",
+        "developer": "bench",
+        "game_type": "CLI",
+        "description": "benchmark archive",
+        "min_players": 2,
+        "max_players": 2,
+    }
+    db_server.save_games(games)
+    print(f"{zip_path} ({zip_path.stat().st_size >> 20} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ from pathlib import Path
 import shutil
 import tempfile
 
-from network import send_json, recv_json
+from network import send_json, recv_json, upload_archive
 
 SERVER_HOST = "140.113.17.11"  
 SERVER_PORT = 5000
@@ -12,6 +12,34 @@ SERVER_PORT = 5000
 sys.path.append(os.path.dirname(__file__))
 
 ###開發者
+def _send_archive(sock, msg: dict, archive_path: Path):
+    """
+    送 upload_game / update_game 請求和 zip 檔，回傳 server 的回覆（沒有回覆是 None）。
+    先拿上傳票把檔案傳到資料通道，lobby 連線上只送帶 upload_ticket 的請求；
+    server 沒有資料通道（或傳檔失敗）就照舊把檔案接在請求後面送。
+    """
+    payload = msg["payload"]
+    send_json(sock, {
+        "role": "developer",
+        "action": "upload_ticket",
+        "payload": {"developer": payload["developer"], "archive_size": payload["archive_size"]},
+    })
+    ticket = recv_json(sock)
+    if ticket is None:
+        return None
+    if ticket.get("status") == "ok":
+        resp = upload_archive(sock, ticket, archive_path)
+        if resp is not None and resp.get("status") == "ok":
+            send_json(sock, {**msg, "payload": {**payload, "upload_ticket": ticket["ticket"]}})
+            return recv_json(sock)
+        print(">> upload to transfer port failed, sending through the lobby connection")
+
+    send_json(sock, msg)
+    with archive_path.open("rb") as f:
+        sock.sendfile(f)
+    return recv_json(sock)
+
+
 def upload_game(sock, developer: str):
     print("上傳新遊戲")
     folder = input("遊戲資料夾: ").strip()
@@ -65,33 +93,23 @@ def upload_game(sock, developer: str):
         print(f"failed to create zip:", e)
         return
 
-    # step 2: send upload_game request
-    send_json(
-        sock,
-        {
-            "role": "developer",
-            "action": "upload_game",
-            "payload": {
-                "developer": developer,
-                "game_name": game_name,
-                "version": version,
-                "description": description,
-                "type": game_type,
-                "archive_size": archive_size,
-                "min_players": min_players_int,
-                "max_players": max_players_int,
-            },
+    # step 2: send upload_game request and the zip file
+    msg = {
+        "role": "developer",
+        "action": "upload_game",
+        "payload": {
+            "developer": developer,
+            "game_name": game_name,
+            "version": version,
+            "description": description,
+            "type": game_type,
+            "archive_size": archive_size,
+            "min_players": min_players_int,
+            "max_players": max_players_int,
         },
-    )
-
-    # step 3: send the zip file
+    }
     try:
-        with archive_path.open("rb") as f:
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                sock.sendall(chunk)
+        resp = _send_archive(sock, msg, archive_path)
     except Exception as e:
         print(f"failed to send file:", e)
         return
@@ -101,8 +119,7 @@ def upload_game(sock, developer: str):
         except Exception:
             pass
 
-    # step 4: receive response
-    resp = recv_json(sock)
+    # step 3: receive response
     if resp is None:
         print("no response from server")
         return
@@ -180,23 +197,10 @@ def update_game(sock, developer: str):
     if max_players_int is not None:
         payload["max_players"] = max_players_int
 
-    send_json(
-        sock,
-        {
-            "role": "developer",
-            "action": "update_game",
-            "payload": payload,
-        },
-    )
-
-    # send file
+    # send update_game request and file
     try:
-        with archive_path.open("rb") as f:
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                sock.sendall(chunk)
+        resp = _send_archive(sock, {"role": "developer", "action": "update_game", "payload": payload},
+                             archive_path)
     except Exception as e:
         print("failed to send file:", e)
         return
@@ -206,7 +210,6 @@ def update_game(sock, developer: str):
         except Exception:
             pass
 
-    resp = recv_json(sock)
     if resp is None:
         print("no response from server")
         return
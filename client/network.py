@@ -1,56 +1,567 @@
+import itertools
 import json
+import os
+import queue
 import socket
-from typing import Any, Dict, Optional
-
-#每個socket一個buffer，避免recv_json把多餘bytes丟掉
-_sock_buf: Dict[int, bytearray] = {}
+import struct
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, List, Optional
 
 class ServerDisconnected(Exception):
     pass
 
-def connect_to_server(host: str, port: int):
+
+# binary framing（跟 server/framing.py 一樣）：header = type, flags, stream, length
+HEADER = struct.Struct("!BBHI")
+FRAME_JSON = 1
+FRAME_DATA = 2
+FLAG_ZLIB = 0x01
+DATA_CHUNK = 256 * 1024
+DOWNLOAD_BUFFER = 1024 * 1024  # recv_file 一次 recv_into 的大小
+
+
+class Reply(Future):
+    """
+    Channel.call() 回傳的 Future。
+    沒有背景 listener 在讀連線時，result() 會自己讀到這個回覆出現為止（中間別的回覆會先存起來）。
+    """
+
+    def __init__(self, ch: "Channel"):
+        super().__init__()
+        self._ch = ch
+
+    def result(self, timeout=None):
+        if not self.done():
+            self._ch._pump_until(self)
+        return super().result(timeout)
+
+
+class Channel:
+    """
+    一條連到 server 的連線：socket + 自己的收訊 buffer。
+    buffer 用 offset 記錄讀到哪裡（_buf[_start:_end] 是還沒讀的資料），
+    讀完一筆不會把剩下的 bytes 複製一份；下載檔案時直接 recv_into 呼叫端的 buffer。
+    """
+
+    def __init__(self, sock: socket.socket, buffer_size: int = 64 * 1024):
+        self.sock = sock
+        self._buf = bytearray(buffer_size)
+        self._start = 0
+        self._end = 0
+        self._scanned = 0  # _buf[_start:_scanned] 已經確定沒有換行
+        # 訂閱房間事件期間，由 EventListener thread 負責讀這條連線
+        self.listener: Optional["EventListener"] = None
+        # call() 送出、還沒收到回覆的請求：request_id -> Reply
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Reply] = {}
+        self._unmatched: deque = deque()  # 等 Reply 時讀到的一般回覆，留給 recv_json
+        # hello 協商的結果：server 會把大訊息壓縮後送來、改用 binary framing（見 server/framing.py）
+        self.compression: Optional[str] = None
+        self.binary = False
+        self.bytes_saved = 0  # 壓縮省下的接收量
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+    def sendall(self, data):
+        self.sock.sendall(data)
+
+    def sendfile(self, f) -> int:
+        """
+        從目前位置把檔案送完（Linux 上走 os.sendfile，不經過 Python 的 buffer）；
+        binary framing 時切成 DATA frame，每個 frame 的內容一樣用 sendfile 送。
+        """
+        if not self.binary:
+            return self.sock.sendfile(f)
+        offset = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        sent = 0
+        while offset < size:
+            count = min(DATA_CHUNK, size - offset)
+            self.sock.sendall(HEADER.pack(FRAME_DATA, 0, 0, count))
+            self.sock.sendfile(f, offset, count)
+            offset += count
+            sent += count
+        return sent
+
+    def send_json(self, obj: Dict[str, Any]):
+        body = json.dumps(obj).encode("utf-8")
+        if self.binary:
+            self.sock.sendall(HEADER.pack(FRAME_JSON, 0, 0, len(body)) + body)
+        else:
+            self.sock.sendall(body + b"\n")
+
+    def _fill(self) -> int:
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+        elif self._end == len(self._buf):
+            pending = self._end - self._start
+            if self._start > 0:
+                # 把還沒讀的資料搬到開頭（一筆訊息只會搬一次）
+                self._buf[:pending] = self._buf[self._start:self._end]
+                self._scanned -= self._start
+                self._start, self._end = 0, pending
+            else:
+                self._buf.extend(bytes(len(self._buf)))
+        n = self.sock.recv_into(memoryview(self._buf)[self._end:])
+        self._end += n
+        return n
+
+    def _read_line(self) -> Optional[bytes]:
+        while True:
+            i = self._buf.find(b"\n", max(self._scanned, self._start), self._end)
+            if i >= 0:
+                line = bytes(self._buf[self._start:i])
+                self._start = self._scanned = i + 1
+                return line
+            self._scanned = self._end
+            if self._fill() == 0:
+                return None
+
+    def _ensure(self, n: int) -> bool:
+        while self._end - self._start < n:
+            if self._fill() == 0:
+                return False
+        return True
+
+    def _read_header(self):
+        if not self._ensure(HEADER.size):
+            return None
+        header = HEADER.unpack_from(self._buf, self._start)
+        self._start = self._scanned = self._start + HEADER.size
+        return header
+
+    def _decode_frame(self, flags: int, body: bytes) -> Optional[Dict[str, Any]]:
+        try:
+            if flags & FLAG_ZLIB:
+                raw = zlib.decompress(body)
+                self.bytes_saved += len(raw) - len(body)
+                body = raw
+            return json.loads(body)
+        except (ValueError, zlib.error):
+            return None
+
+    def _read_binary_json(self) -> Optional[Dict[str, Any]]:
+        while True:
+            header = self._read_header()
+            if header is None:
+                return None
+            ftype, flags, _stream, length = header
+            body = self.recv_exact(length)
+            if body is None:
+                return None
+            # 沒有在收檔時出現的 DATA frame（例如下載中途放棄）直接丟掉
+            if ftype == FRAME_JSON:
+                return self._decode_frame(flags, body)
+
+    def read_json(self) -> Optional[Dict[str, Any]]:
+        """讀下一筆 JSON（包含事件，壓縮過的會先解開）；連線關閉或格式錯誤回傳 None。"""
+        if self.binary:
+            return self._read_binary_json()
+        line = self._read_line()
+        if line is None:
+            return None
+        try:
+            msg = json.loads(line)
+            if isinstance(msg, dict) and msg.get("type") == "zlib":
+                size = int(msg["size"])
+                body = self.recv_exact(size)
+                if body is None:
+                    return None
+                line = zlib.decompress(body)
+                self.bytes_saved += len(line) - size
+                msg = json.loads(line)
+            return msg
+        except (UnicodeDecodeError, json.JSONDecodeError, KeyError, ValueError, zlib.error):
+            return None
+
+    def hello(self, binary: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        連線後先跟 server 協商壓縮和 framing；舊版 server 不認得 hello 就維持原本的文字模式。
+        hello 的回覆還是舊格式，收到之後雙方才切換。
+        """
+        payload = {"compression": ["zlib"], "framing": ["binary"] if binary else ["line"]}
+        self.send_json({"role": "system", "action": "hello", "payload": payload})
+        resp = self.recv_json()
+        if resp is not None and resp.get("status") == "ok":
+            self.compression = resp.get("compression")
+            self.binary = resp.get("framing") == "binary"
+        return resp
+
+    def recv_json(self) -> Optional[Dict[str, Any]]:
+        if self._unmatched:
+            return self._unmatched.popleft()
+
+        listener = self.listener
+        if listener is not None:
+            msg = listener.responses.get()
+            if listener.stopping or msg is None:
+                listener.join()
+                self.listener = None
+            return msg
+
+        while True:
+            msg = self.read_json()
+            # 沒有在訂閱時收到的遲到事件直接略過；call() 的回覆交給對應的 Reply
+            if not _is_event(msg) and not self._route(msg):
+                return msg
+
+    # ---------- request_id / pipelining ----------
+
+    def call(self, role: str, action: str, payload: Dict[str, Any]) -> Reply:
+        """
+        送出一個帶 request_id 的請求，不等回覆就回傳 Reply（Future）。
+        可以連續送很多個再一起拿結果；server 可能不照順序回覆，靠 request_id 對應。
+        """
+        request_id = next(self._ids)
+        reply = Reply(self)
+        self._pending[request_id] = reply
+        self.send_json({"role": role, "action": action, "payload": payload, "request_id": request_id})
+        return reply
+
+    def _route(self, msg) -> bool:
+        """msg 是某個 call() 的回覆就交給它的 Reply，回傳 True。"""
+        if not isinstance(msg, dict) or "request_id" not in msg:
+            return False
+        reply = self._pending.pop(msg["request_id"], None)
+        if reply is None:
+            return False
+        reply.set_result(msg)
+        return True
+
+    def _fail_pending(self):
+        pending, self._pending = self._pending, {}
+        for reply in pending.values():
+            reply.set_exception(ServerDisconnected("connection closed before reply"))
+
+    def _pump_until(self, reply: Reply):
+        # 有 listener 的時候由它負責分派，Future.result() 直接等就好
+        while not reply.done() and self.listener is None:
+            msg = self.read_json()
+            if msg is None:
+                self._fail_pending()
+                return
+            if _is_event(msg) or self._route(msg):
+                continue
+            self._unmatched.append(msg)
+
+    def recv_exact_into(self, view: memoryview) -> int:
+        """把 view 收滿，回傳收到幾 bytes（比 len(view) 少代表連線中途關了）。"""
+        got = min(len(view), self._end - self._start)
+        if got:
+            view[:got] = self._buf[self._start:self._start + got]
+            self._start += got
+        while got < len(view):
+            n = self.sock.recv_into(view[got:])
+            if n == 0:
+                break
+            got += n
+        return got
+
+    def recv_exact(self, n: int) -> Optional[bytes]:
+        data = bytearray(n)
+        if self.recv_exact_into(memoryview(data)) < n:
+            return None
+        return bytes(data)
+
+    def recv_file(self, f, n: int, stream: Optional[int] = None, hasher=None) -> int:
+        """
+        收 n bytes 的檔案內容直接寫進 f：每次 recv_into 一塊預先配置好的 DOWNLOAD_BUFFER，
+        再把同一塊 memoryview 寫進檔案，中間不產生 bytes 物件。回傳寫了幾 bytes。
+        hasher（hashlib 物件）有給的話邊收邊算 hash。
+        """
+        with memoryview(bytearray(DOWNLOAD_BUFFER)) as view:
+            for chunk in self.iter_chunks(n, stream, view):
+                f.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+        return n
+
+    def iter_chunks(self, n: int, stream: Optional[int] = None,
+                    into: Optional[memoryview] = None) -> Iterator[memoryview]:
+        """
+        收 n bytes 的檔案內容，一塊一塊 yield memoryview（下一次迭代前要用完）。
+        into 是要 recv_into 的 buffer，沒給就用連線自己的收訊 buffer。
+        binary framing 時內容是 stream 的 DATA frame，中間插進來的 JSON 訊息照 _pump_until 的規則處理。
+        連線中途關掉就丟 ServerDisconnected。
+        """
+        if not self.binary:
+            yield from self._iter_raw(n, into)
+            return
+        remaining = n
+        while remaining > 0:
+            header = self._read_header()
+            if header is None:
+                raise ServerDisconnected("connection closed while receiving data")
+            ftype, flags, frame_stream, length = header
+            if ftype == FRAME_DATA and (stream is None or frame_stream == stream):
+                if length > remaining:
+                    raise ServerDisconnected("unexpected data frame from server")
+                yield from self._iter_raw(length, into)
+                remaining -= length
+                continue
+            body = self.recv_exact(length)
+            if body is None:
+                raise ServerDisconnected("connection closed while receiving data")
+            if ftype != FRAME_JSON:
+                continue
+            msg = self._decode_frame(flags, body)
+            if msg is not None and not _is_event(msg) and not self._route(msg):
+                self._unmatched.append(msg)
+
+    def _iter_raw(self, n: int, into: Optional[memoryview] = None) -> Iterator[memoryview]:
+        remaining = n
+        if self._start < self._end:
+            take = min(remaining, self._end - self._start)
+            with memoryview(self._buf)[self._start:self._start + take] as chunk:
+                yield chunk
+            self._start += take
+            remaining -= take
+        if remaining == 0:
+            return
+        self._start = self._end = self._scanned = 0
+        with memoryview(into if into is not None else self._buf) as view:
+            while remaining > 0:
+                got = self.sock.recv_into(view, min(remaining, len(view)))
+                if got == 0:
+                    raise ServerDisconnected("connection closed while receiving data")
+                remaining -= got
+                with view[:got] as chunk:
+                    yield chunk
+
+
+def connect_to_server(host: str, port: int, negotiate: bool = True, binary: bool = True) -> Channel:
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     s.connect((host, port))
-    return s
+    ch = Channel(s)
+    if negotiate:
+        ch.hello(binary)
+    return ch
+
+def send_json(ch: Channel, obj: Dict[str, Any]):
+    ch.send_json(obj)
 
-def _get_buf(sock: socket.socket) -> bytearray:
-    key = sock.fileno()
-    if key not in _sock_buf:
-        _sock_buf[key] = bytearray()
-    return _sock_buf[key]
+def _is_event(msg) -> bool:
+    return isinstance(msg, dict) and msg.get("type") == "event"
 
-def send_json(sock: socket.socket, obj: Dict[str, Any]):
-    data = json.dumps(obj).encode("utf-8") + b"\n"
-    sock.sendall(data)
+def recv_json(ch: Channel) -> Optional[Dict[str, Any]]:
+    return ch.recv_json()
 
-def recv_json(sock: socket.socket) -> Optional[Dict[str, Any]]:
-    buf = _get_buf(sock)
+def recv_exact(ch: Channel, n: int) -> Optional[bytes]:
+    return ch.recv_exact(n)
 
-    while b"\n" not in buf:
-        chunk = sock.recv(4096)
-        if not chunk:
+def call(ch: Channel, role: str, action: str, payload: Dict[str, Any]) -> Reply:
+    return ch.call(role, action, payload)
+
+BATCH_MAX = 100  # 跟 server 的 lobby_server.BATCH_MAX 一樣
+
+def batch(ch: Channel, role: str, requests: List[tuple]) -> Optional[List[Dict[str, Any]]]:
+    """
+    把多個唯讀請求 [(action, payload), ...] 包成 batch 送出，回傳每個請求的回覆（順序相同）。
+    超過 BATCH_MAX 個就分成幾批一起 pipeline 出去；server 沒回應回傳 None。
+    """
+    replies = [
+        ch.call(role, "batch", {"requests": [
+            {"action": action, "payload": payload}
+            for action, payload in requests[i:i + BATCH_MAX]
+        ]})
+        for i in range(0, len(requests), BATCH_MAX)
+    ]
+    results = []
+    for reply in replies:
+        try:
+            resp = reply.result()
+        except ServerDisconnected:
+            return None
+        if resp.get("status") != "ok":
             return None
-        buf.extend(chunk)
+        results.extend(resp.get("results", []))
+    return results
 
-    line, rest = buf.split(b"\n", 1)
-    # 把剩下的 bytes 留回 buffer（這就是修 bug 的關鍵）
-    _sock_buf[sock.fileno()] = bytearray(rest)
 
+# 平行下載（download_ranges）：最多開幾條連線、一段多大
+DOWNLOAD_CONNECTIONS = int(os.environ.get("GAME_STORE_DOWNLOAD_CONNECTIONS", "4"))
+PIECE_SIZE = 8 * 1024 * 1024
+
+def download_ranges(ch: Channel, ticket: str, path, ranges: List[tuple],
+                    connections: int = DOWNLOAD_CONNECTIONS,
+                    on_done: Optional[Callable[[int, int], None]] = None,
+                    transfer_port: Optional[int] = None):
+    """
+    另外開最多 connections 條連線到 ch 連著的 server，帶著下載票（player / download_ticket 拿到的）
+    用 system / download_range 平行下載 ranges = [(offset, length), ...]；
+    有 transfer_port（票的回覆裡有）就連到 server 的資料通道（見 server/transfer_server.py），
+    不佔 lobby 的連線，ch 只用來知道 server 的位址。
+    收到的內容直接寫進 path（要先配置好大小）的對應位置（os.pwrite，沒有的平台用 seek + write）。
+    每一段寫完呼叫 on_done(offset, length)（從不同 thread 呼叫）。
+    任何一段失敗就丟 ServerDisconnected；完成的段都已經呼叫過 on_done，之後只要重抓剩下的。
+    """
+    host, port = ch.sock.getpeername()[:2]
+    todo: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+    for r in ranges:
+        todo.put(r)
+    errors: List[Exception] = []
+
+    def worker():
+        try:
+            if transfer_port:
+                data = connect_to_server(host, transfer_port, negotiate=False)  # 資料通道不做 hello
+            else:
+                data = connect_to_server(host, port)
+        except OSError as e:
+            errors.append(ServerDisconnected(f"cannot open download connection: {e}"))
+            return
+        try:
+            with open(path, "r+b", buffering=0) as f, memoryview(bytearray(DOWNLOAD_BUFFER)) as view:
+                while not errors:
+                    try:
+                        offset, length = todo.get_nowait()
+                    except queue.Empty:
+                        return
+                    data.send_json({
+                        "role": "system",
+                        "action": "download_range",
+                        "payload": {"ticket": ticket, "offset": offset, "length": length},
+                    })
+                    header = data.recv_json()
+                    if header is None:
+                        raise ServerDisconnected("connection closed by server")
+                    if header.get("status") != "ok":
+                        raise ServerDisconnected(header.get("message"))
+                    pos = offset
+                    for chunk in data.iter_chunks(header["length"], header.get("stream"), view):
+                        if hasattr(os, "pwrite"):
+                            os.pwrite(f.fileno(), chunk, pos)
+                        else:
+                            f.seek(pos)
+                            f.write(chunk)
+                        pos += len(chunk)
+                    if on_done is not None:
+                        on_done(offset, length)
+        except ServerDisconnected as e:
+            errors.append(e)
+        except OSError as e:
+            errors.append(ServerDisconnected(str(e)))
+        finally:
+            data.close()
+
+    threads = [
+        threading.Thread(target=worker, name=f"download-{i}", daemon=True)
+        for i in range(max(1, min(connections, len(ranges))))
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+
+
+def upload_archive(ch: Channel, ticket: Dict[str, Any], path) -> Optional[Dict[str, Any]]:
+    """
+    把 path 傳到 ch 連著的 server 的資料通道（ticket 是 developer / upload_ticket 的回覆），
+    回傳 server 的回覆（失敗回 None）；之後 upload_game / update_game 帶 upload_ticket 就好。
+    """
+    host = ch.sock.getpeername()[0]
+    try:
+        data = connect_to_server(host, ticket["transfer_port"], negotiate=False)
+    except OSError:
+        return None
     try:
-        return json.loads(line.decode("utf-8"))
-    except json.JSONDecodeError:
+        data.send_json({"action": "upload", "payload": {"ticket": ticket["ticket"]}})
+        with open(path, "rb") as f:
+            data.sendfile(f)
+        return data.recv_json()
+    except (OSError, ServerDisconnected):
         return None
+    finally:
+        data.close()
 
-def recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
-    buf = _get_buf(sock)
 
-    while len(buf) < n:
-        chunk = sock.recv(4096)
-        if not chunk:
-            return None
-        buf.extend(chunk)
+class EventListener(threading.Thread):
+    """
+    訂閱房間事件期間在背景讀 socket：
+    事件交給對應 topic 的 handler，其他訊息（一般回覆）放進 responses 給 recv_json 拿。
+    """
+
+    def __init__(self, ch: Channel):
+        super().__init__(daemon=True)
+        self.ch = ch
+        self.responses: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+        self.handlers: Dict[tuple, Callable[[Dict[str, Any]], None]] = {}
+        self.stopping = False
+
+    def run(self):
+        while True:
+            try:
+                msg = self.ch.read_json()
+            except OSError:
+                msg = None
+            if msg is None:
+                self.ch._fail_pending()
+                self.responses.put(None)
+                return
+            if _is_event(msg):
+                self._dispatch(msg)
+                continue
+            if self.ch._route(msg):
+                continue
+            self.responses.put(msg)
+            if self.stopping:
+                return
+
+    def _dispatch(self, event: Dict[str, Any]):
+        # 有訂閱單一房間時只顯示那個房間的事件，否則交給遊戲大廳的 handler
+        handlers = dict(self.handlers)  # 主 thread 可能同時在改
+        handler = handlers.get(("room", event.get("room_id")))
+        if handler is None and not any(t[0] == "room" for t in handlers):
+            handler = handlers.get(("game", event.get("game_name")))
+            if handler is None and event.get("event") == "resync" and handlers:
+                handler = next(iter(handlers.values()))
+        if handler is None:
+            return
+        try:
+            handler(event)
+        except Exception as e:
+            print("failed to handle event:", e)
+
+
+def _topic(payload: Dict[str, Any]) -> tuple:
+    if payload.get("room_id") is not None:
+        return ("room", int(payload["room_id"]))
+    return ("game", payload.get("game_name"))
+
+def subscribe(ch: Channel, payload: Dict[str, Any],
+              on_event: Callable[[Dict[str, Any]], None]) -> Optional[Dict[str, Any]]:
+    """訂閱房間事件（payload 給 room_id 或 game_name），之後事件會在背景交給 on_event。"""
+    send_json(ch, {"role": "player", "action": "subscribe", "payload": payload})
+    resp = recv_json(ch)
+    if resp is None or resp.get("status") != "ok":
+        return resp
+
+    listener = ch.listener
+    if listener is None:
+        listener = EventListener(ch)
+        listener.handlers[_topic(payload)] = on_event
+        ch.listener = listener
+        listener.start()
+    else:
+        listener.handlers[_topic(payload)] = on_event
+    return resp
 
-    data = bytes(buf[:n])
-    # 把多出來的 bytes 留回 buffer
-    _sock_buf[sock.fileno()] = buf[n:]
-    return data
+def unsubscribe(ch: Channel, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    listener = ch.listener
+    if listener is not None:
+        listener.handlers.pop(_topic(payload), None)
+        if not listener.handlers:
+            # server 在回覆最後一個 unsubscribe 之前就會停止推送，
+            # 所以 listener 把這個回覆交出去之後就可以結束
+            listener.stopping = True
+    send_json(ch, {"role": "player", "action": "unsubscribe", "payload": payload})
+    return recv_json(ch)
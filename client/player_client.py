@@ -1,10 +1,22 @@
+import hashlib
 import json
 import os, sys
 from pathlib import Path
 import shutil
 import subprocess
-
-from network import send_json, recv_json, recv_exact
+import threading
+
+from network import (
+    DOWNLOAD_CONNECTIONS,
+    PIECE_SIZE,
+    ServerDisconnected,
+    batch,
+    download_ranges,
+    send_json,
+    recv_json,
+    subscribe,
+    unsubscribe,
+)
 
 sys.path.append(os.path.dirname(__file__))
 
@@ -69,17 +81,7 @@ def list_rooms_client(sock, game_name: str | None = None):
         return
 
     for r in rooms:
-        room_id = r.get("id")
-        gname = r.get("game_name")
-        host = r.get("host")
-        players = r.get("players", [])
-        status = r.get("status")
-        min_p = r.get("min_players", "?")
-        max_p = r.get("max_players", "?")
-        print(
-            f"- Room {room_id}: {gname} | host={host} | "
-            f"players={len(players)}/{max_p} (min {min_p}) | status={status}"
-        )
+        _print_room_line(r)
 
 
 def join_room_client(sock, username: str, game_name: str):
@@ -110,8 +112,54 @@ def join_room_client(sock, username: str, game_name: str):
     return None
 
 
+def _print_room_line(r: dict):
+    players = r.get("players", [])
+    print(
+        f"- Room {r.get('id')}: {r.get('game_name')} | host={r.get('host')} | "
+        f"players={len(players)}/{r.get('max_players', '?')} (min {r.get('min_players', '?')}) | "
+        f"status={r.get('status')}"
+    )
+
+
+def render_room_event(event: dict):
+    """訂閱的房間有變動時由背景 thread 呼叫，直接印出來。"""
+    kind = event.get("event")
+    room_id = event.get("room_id")
+    room = event.get("room") or {}
+    who = event.get("username", "?")
+    players = room.get("players", [])
+    count = f"{len(players)}/{room.get('max_players', '?')}"
+
+    if kind == "player_joined":
+        text = f"{who} 加入了房間 {room_id}（{count}）"
+    elif kind == "player_left":
+        text = f"{who} 離開了房間 {room_id}（{count}，房主：{room.get('host')}）"
+    elif kind == "room_started":
+        text = f"房間 {room_id} 開始遊戲了"
+    elif kind == "room_closed":
+        text = f"房間 {room_id} 已關閉"
+    elif kind == "resync":
+        text = "房間變動太多，請重新查看列表"
+    else:
+        ready = room.get("ready_players", [])
+        text = (
+            f"房間 {room_id}：host={room.get('host')} players={count} "
+            f"ready={', '.join(ready) or '-'} status={room.get('status')}"
+        )
+    print(f"\n[即時] {text}")
+
+
 def room_menu(sock, username: str, game_name: str, room_id: int, is_host: bool):
     """進入房間之後的選單：只處理房內操作"""
+    # 訂閱這個房間，有人加入 / 離開 / 準備時會直接顯示
+    subscribe(sock, {"room_id": room_id}, render_room_event)
+    try:
+        _room_menu_loop(sock, username, game_name, room_id, is_host)
+    finally:
+        unsubscribe(sock, {"room_id": room_id})
+
+
+def _room_menu_loop(sock, username: str, game_name: str, room_id: int, is_host: bool):
     while True:
         print(f"\n=== Room {room_id} ({game_name}) - Player: {username} ===")
         print("1. 查看房間玩家")
@@ -310,16 +358,52 @@ def start_game_client(sock, username: str, game_name: str, current_room_id: int)
 
 
 
-def _download_game_core(sock, username: str, game_name: str) -> bool:
-    # 要求 server 準備這個遊戲
+PARALLEL_MIN = 16 * 1024 * 1024  # 比這個小的檔案用一條連線下載就好
+
+
+def _load_partial(partial_path: Path, info_path: Path) -> dict:
+    """
+    上次沒下載完的檔案：回傳 .json 裡記的內容（sha256、平行下載時完成的段 done），
+    加上 have = 檔案現在的大小；沒有就回傳 {}。
+    """
+    if not partial_path.exists() or not info_path.exists():
+        return {}
+    try:
+        with info_path.open("r", encoding="utf-8") as f:
+            info = json.load(f)
+    except Exception:
+        return {}
+    if not isinstance(info, dict):
+        return {}
+    info["have"] = partial_path.stat().st_size
+    return info
+
+
+def _write_partial_info(info_path: Path, info: dict):
+    with info_path.open("w", encoding="utf-8") as f:
+        json.dump(info, f)
+
+
+def _file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _receive_single(sock, game_name: str, partial_path: Path, info_path: Path, partial: dict):
+    """在 lobby 連線上用 download_game 收檔（可以從 .partial 接著收）；成功回傳 header，失敗回傳 None。"""
+    # 要求 server 準備這個遊戲；平行下載留下的 .partial 中間可能有洞，只能從頭來
+    payload = {"game_name": game_name}
+    if partial.get("have") and partial.get("sha256") and "done" not in partial:
+        payload.update(offset=partial["have"], sha256=partial["sha256"])
     send_json(
         sock,
         {
             "role": "player",
             "action": "download_game",
-            "payload": {
-                "game_name": game_name,
-            },
+            "payload": payload,
         },
     )
 
@@ -327,44 +411,121 @@ def _download_game_core(sock, username: str, game_name: str) -> bool:
     header = recv_json(sock)
     if header is None:
         print("no response from server")
-        return False
+        return None
 
     if header.get("status") != "ok":
         print(">>", header.get("message"))
-        return False
-
-    archive_size = header.get("archive_size")
-    version = str(header.get("version", "0"))
+        return None
 
     try:
-        archive_size = int(archive_size)
+        archive_size = int(header.get("archive_size"))
+        offset = int(header.get("offset", 0))
+        length = int(header.get("length", archive_size - offset))
     except Exception:
         print("invalid archive_size from server")
-        return False
+        return None
+    sha256 = header.get("sha256")
 
-    # 準備 downloads/<username>/ 資料夾
-    project_root = Path(__file__).resolve().parent.parent
-    downloads_root = project_root / "downloads" / username
-    downloads_root.mkdir(parents=True, exist_ok=True)
+    try:
+        _write_partial_info(info_path, {"version": str(header.get("version", "0")), "sha256": sha256})
+    except Exception as e:
+        print("failed to write download info:", e)
+        return None
 
-    zip_path = downloads_root / f"{game_name}_{version}.zip"
-    extract_dir = downloads_root / game_name
+    if offset:
+        print(f">> resuming download from {offset} / {archive_size} bytes")
 
-    # 收 zip 檔
-    remaining = archive_size
+    # 收 zip 檔（recv_into 同一塊 buffer 後直接寫進檔案，邊收邊算 sha256）
+    hasher = hashlib.sha256()
     try:
-        with zip_path.open("wb") as f:
-            while remaining > 0:
-                to_read = min(4096, remaining) 
-                chunk = recv_exact(sock, to_read) 
-                if not chunk:
-                    print("connection closed while downloading")
-                    return False
-                f.write(chunk)
-                remaining -= len(chunk)
+        with partial_path.open("r+b" if offset else "wb") as f:
+            # 已經有的部分先算進 hash，讀完剛好停在 offset
+            while f.tell() < offset:
+                block = f.read(min(1024 * 1024, offset - f.tell()))
+                if not block:
+                    raise ValueError("partial file is shorter than expected")
+                hasher.update(block)
+            f.truncate(offset)
+            sock.recv_file(f, length, header.get("stream"), hasher)
+    except ServerDisconnected:
+        print("connection closed while downloading (download again to resume)")
+        return None
     except Exception as e:
         print("failed to receive file:", e)
-        return False
+        return None
+
+    if sha256 and hasher.hexdigest() != sha256:
+        print("downloaded file is corrupted (sha256 mismatch), please download again")
+        partial_path.unlink(missing_ok=True)
+        info_path.unlink(missing_ok=True)
+        return None
+    return header
+
+
+def _receive_parallel(sock, ticket: dict, partial_path: Path, info_path: Path, partial: dict,
+                      on_progress=None):
+    """
+    用下載票另外開 DOWNLOAD_CONNECTIONS 條連線（票裡有 transfer_port 就連資料通道），
+    每條抓不同的 PIECE_SIZE 段寫進預先配置好的 .partial；.json 記著哪幾段收完了（done），
+    斷掉之後再下載只抓剩下的。on_progress(收完的段數, 總段數) 每收完一段呼叫一次。
+    成功回傳 ticket，失敗回傳 None。
+    """
+    size, sha256 = ticket["archive_size"], ticket["sha256"]
+    pieces = (size + PIECE_SIZE - 1) // PIECE_SIZE
+    done = set()
+    if partial.get("sha256") == sha256:
+        if "done" not in partial:
+            done = set(range(partial.get("have", 0) // PIECE_SIZE))  # 單一連線留下的：前面完整的段
+        elif partial.get("piece_size") == PIECE_SIZE:
+            done = set(partial["done"])
+    info = {"version": str(ticket.get("version", "0")), "sha256": sha256, "piece_size": PIECE_SIZE}
+    lock = threading.Lock()
+
+    def on_done(offset: int, length: int):
+        with lock:
+            done.add(offset // PIECE_SIZE)
+            _write_partial_info(info_path, {**info, "done": sorted(done)})
+            if on_progress is not None:
+                on_progress(len(done), pieces)
+
+    try:
+        with partial_path.open("r+b" if partial_path.exists() else "wb") as f:
+            f.truncate(size)
+            if hasattr(os, "posix_fallocate") and size:
+                os.posix_fallocate(f.fileno(), 0, size)
+        _write_partial_info(info_path, {**info, "done": sorted(done)})
+    except Exception as e:
+        print("failed to prepare download file:", e)
+        return None
+
+    todo = [(i * PIECE_SIZE, min(PIECE_SIZE, size - i * PIECE_SIZE)) for i in range(pieces) if i not in done]
+    if done:
+        print(f">> resuming download: {pieces - len(todo)} / {pieces} pieces already received")
+    if on_progress is not None:
+        on_progress(len(done), pieces)
+    try:
+        download_ranges(sock, ticket["ticket"], partial_path, todo, DOWNLOAD_CONNECTIONS, on_done,
+                        ticket.get("transfer_port"))
+    except ServerDisconnected as e:
+        print(f"download interrupted ({e}), download again to resume")
+        return None
+
+    if _file_sha256(partial_path) != sha256:
+        print("downloaded file is corrupted (sha256 mismatch), please download again")
+        partial_path.unlink(missing_ok=True)
+        info_path.unlink(missing_ok=True)
+        return None
+    return ticket
+
+
+def _install_download(downloads_root: Path, game_name: str, header: dict,
+                      partial_path: Path, info_path: Path) -> bool:
+    """下載完的 .partial 改名成 <game>_<version>.zip，解壓到 downloads/<username>/<game>，記下版本。"""
+    version = str(header.get("version", "0"))
+    zip_path = downloads_root / f"{game_name}_{version}.zip"
+    extract_dir = downloads_root / game_name
+    os.replace(partial_path, zip_path)
+    info_path.unlink(missing_ok=True)
 
     # 解壓縮
     try:
@@ -391,6 +552,219 @@ def _download_game_core(sock, username: str, game_name: str) -> bool:
     return True
 
 
+class _BackgroundDownload(threading.Thread):
+    """
+    在背景下載一款遊戲：檔案從資料通道收（見 server/transfer_server.py），
+    這段時間 lobby 連線照常使用，玩家可以繼續逛商城、待在房間裡。
+    """
+
+    def __init__(self, sock, downloads_root: Path, game_name: str, ticket: dict,
+                 partial_path: Path, info_path: Path, partial: dict):
+        super().__init__(name=f"download-{game_name}", daemon=True)
+        self.sock = sock
+        self.downloads_root = downloads_root
+        self.game_name = game_name
+        self.ticket = ticket
+        self.partial_path = partial_path
+        self.info_path = info_path
+        self.partial = partial
+        self.progress = (0, 1)  # (收完的段數, 總段數)
+        self.ok = None  # 結束之後是 True / False
+
+    def _on_progress(self, done: int, pieces: int):
+        self.progress = (done, max(pieces, 1))
+
+    def run(self):
+        self.ok = False
+        try:
+            header = _receive_parallel(self.sock, self.ticket, self.partial_path, self.info_path,
+                                       self.partial, self._on_progress)
+            self.ok = header is not None and _install_download(
+                self.downloads_root, self.game_name, header, self.partial_path, self.info_path)
+        except Exception as e:
+            print("background download failed:", e)
+        finally:
+            print(f"\n>> [背景下載] {self.game_name} {'完成' if self.ok else '失敗'}")
+
+    def status(self) -> str:
+        done, pieces = self.progress
+        return f"{self.game_name} {done * 100 // pieces}%"
+
+
+_background_downloads = {}  # game_name -> _BackgroundDownload
+_background_lock = threading.Lock()
+
+
+def _active_download(game_name: str):
+    with _background_lock:
+        download = _background_downloads.get(game_name)
+    return download if download is not None and download.is_alive() else None
+
+
+def _wait_background(game_name: str):
+    """這款遊戲正在背景下載就等它下載完（進大廳、更新之前不能跟它搶同一個資料夾）。"""
+    download = _active_download(game_name)
+    if download is not None:
+        print(f">> 等待 {game_name} 背景下載完成 ...")
+        download.join()
+
+
+def background_download_status() -> list:
+    with _background_lock:
+        downloads = list(_background_downloads.values())
+    return [d.status() for d in downloads if d.is_alive()]
+
+
+def _download_game_core(sock, username: str, game_name: str, background: bool = False) -> bool:
+    """
+    下載 / 更新成最新版本。background=True 時（server 有資料通道才行）開一個 thread 在背景下載，
+    馬上回傳 True，lobby 連線可以繼續用；server 不支援就跟一般下載一樣等它下載完。
+    """
+    active = _active_download(game_name)
+    if active is not None:
+        if background:
+            print(f">> {game_name} 已經在背景下載中")
+            return True
+        _wait_background(game_name)
+        return bool(active.ok)
+
+    # 準備 downloads/<username>/ 資料夾
+    project_root = Path(__file__).resolve().parent.parent
+    downloads_root = project_root / "downloads" / username
+    downloads_root.mkdir(parents=True, exist_ok=True)
+
+    # 下載中的檔案先存成 <game>.zip.partial，旁邊的 .json 記著它是哪個內容（sha256），
+    # 斷線之後再下載就從已經收到的地方接著收
+    partial_path = downloads_root / f"{game_name}.zip.partial"
+    info_path = downloads_root / f"{game_name}.zip.partial.json"
+    partial = _load_partial(partial_path, info_path)
+
+    # 先拿下載票：server 有資料通道就從那邊收檔，否則大檔案改用多條連線平行下載
+    ticket = None
+    send_json(sock, {"role": "player", "action": "download_ticket", "payload": {"game_name": game_name}})
+    resp = recv_json(sock)
+    if resp is None:
+        print("no response from server")
+        return False
+    if resp.get("status") == "ok":
+        if resp.get("transfer_port") or (
+            DOWNLOAD_CONNECTIONS > 1 and resp.get("archive_size", 0) >= PARALLEL_MIN
+        ):
+            ticket = resp
+    elif not str(resp.get("message", "")).startswith("unknown player action"):
+        print(">>", resp.get("message"))
+        return False
+    # 舊版 server 沒有 download_ticket：一樣用 download_game
+
+    if background:
+        if ticket is not None and ticket.get("transfer_port"):
+            download = _BackgroundDownload(sock, downloads_root, game_name, ticket,
+                                           partial_path, info_path, partial)
+            with _background_lock:
+                _background_downloads[game_name] = download
+            download.start()
+            print(f">> 開始在背景下載 {game_name} v{ticket.get('version')}"
+                  f"（{ticket.get('archive_size')} bytes），可以繼續使用選單")
+            return True
+        print(">> server 不支援背景下載，直接下載 ...")
+
+    if ticket is not None:
+        header = _receive_parallel(sock, ticket, partial_path, info_path, partial)
+    else:
+        header = _receive_single(sock, game_name, partial_path, info_path, partial)
+    if header is None:
+        return False
+    return _install_download(downloads_root, game_name, header, partial_path, info_path)
+
+
+DELTA_INFO = ".delta.json"  # 跟 server/game_manifest.py 一樣
+
+
+def _local_file_matches(path: Path, size: int, sha256: str) -> bool:
+    try:
+        return path.stat().st_size == size and _file_sha256(path) == sha256
+    except OSError:
+        return False
+
+
+def _update_game_delta(sock, username: str, game_name: str, local_version: str) -> bool:
+    """
+    從本機的 local_version 更新到最新版：只下載有變的檔案（delta 包）直接套用在
+    downloads/<username>/<game> 上。server 做不出 delta、下載失敗、或本機沒改的檔案跟
+    新版本的 manifest 對不上都回傳 False（還沒動到本機檔案），呼叫端改下載完整的遊戲。
+    """
+    project_root = Path(__file__).resolve().parent.parent
+    downloads_root = project_root / "downloads" / username
+    game_dir = downloads_root / game_name
+    delta_path = downloads_root / f"{game_name}.delta.zip"
+
+    send_json(sock, {
+        "role": "player",
+        "action": "download_delta",
+        "payload": {"game_name": game_name, "from_version": local_version},
+    })
+    header = recv_json(sock)
+    if header is None:
+        print("no response from server")
+        return False
+    if header.get("status") != "ok":
+        print(">>", header.get("message"))
+        return False
+
+    hasher = hashlib.sha256()
+    try:
+        with delta_path.open("wb") as f:
+            sock.recv_file(f, int(header["length"]), header.get("stream"), hasher)
+    except ServerDisconnected:
+        print("connection closed while downloading update")
+        return False
+    except Exception as e:
+        print("failed to receive update:", e)
+        return False
+
+    try:
+        import zipfile
+
+        if hasher.hexdigest() != header.get("sha256"):
+            print("downloaded update is corrupted (sha256 mismatch)")
+            return False
+        with zipfile.ZipFile(delta_path, "r") as z:
+            info = json.loads(z.read(DELTA_INFO))
+            changed = [name for name in z.namelist() if name != DELTA_INFO]
+            root = game_dir.resolve()
+            targets = {p: (game_dir / p).resolve() for p in list(info["files"]) + info["deleted"]}
+            if any(root not in t.parents for t in targets.values()):
+                print("update contains invalid paths")
+                return False
+            # 沒有放在 delta 裡的檔案，本機的要跟新版本一模一樣才能只套用差異
+            for path, (size, sha256) in info["files"].items():
+                if path not in changed and not _local_file_matches(targets[path], size, sha256):
+                    print(f"local file {path} does not match v{header.get('version')}")
+                    return False
+            # 開始改本機的檔案
+            z.extractall(game_dir, members=changed)
+        for path in info["deleted"]:
+            targets[path].unlink(missing_ok=True)
+    except Exception as e:
+        print("failed to apply update:", e)
+        return False
+    finally:
+        delta_path.unlink(missing_ok=True)
+
+    version = str(header.get("version", "0"))
+    try:
+        with (game_dir / "metadata.json").open("w", encoding="utf-8") as f:
+            json.dump({"version": version}, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        print("failed to write metadata:", e)
+        return False
+
+    print(f">> updated {game_name} v{local_version} -> v{version} "
+          f"({len(changed)} files changed, {len(info['deleted'])} deleted, "
+          f"{header.get('archive_size')} bytes downloaded)")
+    return True
+
+
 def download_game(sock, username: str):
     print("=== 下載遊戲 ===")
     game_name = input("game name to download: ").strip()
@@ -406,6 +780,7 @@ def ensure_game_ready(sock, username: str, game_name: str, server_info: dict) ->
     downloads_root = project_root / "downloads" / username
     game_dir = downloads_root / game_name
     meta_path = game_dir / "metadata.json"
+    _wait_background(game_name)
 
     server_version = str(server_info.get("version", "0"))
 
@@ -439,6 +814,11 @@ def ensure_game_ready(sock, username: str, game_name: str, server_info: dict) ->
     print(f"{game_name} 本機版本：{local_version or '未知'}，伺服器最新版本：v{server_version}")
     ans = input("要更新到最新版本嗎？(y/n): ").strip().lower()
     if ans == "y":
+        # 先試著只下載有變的檔案，不行再下載完整的遊戲
+        if local_version and _update_game_delta(sock, username, game_name, local_version):
+            return True
+        if local_version:
+            print("改為下載完整的遊戲 ...")
         ok = _download_game_core(sock, username, game_name)
         return ok
     else:
@@ -472,15 +852,86 @@ def show_game_ratings(sock, game_name: str):
         return
 
     print(f"平均評分：{avg:.2f} / 5（共 {count} 筆）")
+    histogram = resp.get("histogram") or {}
+    if histogram:
+        dist = "  ".join(f"{s}★ x{histogram.get(str(s), 0)}" for s in range(5, 0, -1))
+        print(f"分數分布：{dist}")
     print("最近幾則評論：")
     for r in ratings:
-        player = r.get("player", "?")
-        score = r.get("score", "?")
-        comment = r.get("comment", "")
-        ts = r.get("timestamp", "")
-        print(f"- [{score}/5] {player} @ {ts}")
-        if comment:
-            print(f"  {comment}")
+        _print_rating(r)
+
+    if count > len(ratings):
+        ans = input("要瀏覽全部評論嗎？(y/n): ").strip().lower()
+        if ans == "y":
+            browse_game_ratings(sock, game_name)
+
+
+def _rating_line(resp) -> str:
+    if not resp or resp.get("status") != "ok" or not resp.get("count") or resp.get("avg_score") is None:
+        return "(尚無評價)"
+    return f"{resp['avg_score']:.1f} / 5（{resp['count']} 筆）"
+
+
+def _print_rating(r: dict):
+    player = r.get("player", "?")
+    score = r.get("score", "?")
+    comment = r.get("comment", "")
+    ts = r.get("timestamp", "")
+    print(f"- [{score}/5] {player} @ {ts}")
+    if comment:
+        print(f"  {comment}")
+
+
+RATING_ORDERS = {
+    "1": ("newest", "最新"),
+    "2": ("oldest", "最舊"),
+    "3": ("highest", "評分最高"),
+    "4": ("lowest", "評分最低"),
+}
+
+
+def browse_game_ratings(sock, game_name: str, page_size: int = 10):
+    """用 cursor 一頁一頁往後看評論。"""
+    print("排序方式：" + "  ".join(f"{k}. {label}" for k, (_, label) in RATING_ORDERS.items()))
+    sel = input("請選擇（預設 1）: ").strip() or "1"
+    if sel not in RATING_ORDERS:
+        print("輸入錯誤，請重新選擇。")
+        return
+    order, label = RATING_ORDERS[sel]
+
+    cursor = None
+    page = 1
+    while True:
+        payload = {"game_name": game_name, "order": order, "limit": page_size}
+        if cursor:
+            payload["cursor"] = cursor
+        send_json(sock, {
+            "role": "player",
+            "action": "get_game_ratings_page",
+            "payload": payload,
+        })
+        resp = recv_json(sock)
+        if resp is None:
+            print("no response from server")
+            return
+        if resp.get("status") != "ok":
+            print(">>", resp.get("message"))
+            return
+
+        print(f"\n=== {game_name} 評論（{label}，第 {page} 頁）===")
+        ratings = resp.get("ratings", [])
+        if not ratings:
+            print("(沒有更多評論)")
+        for r in ratings:
+            _print_rating(r)
+
+        cursor = resp.get("next_cursor")
+        if not cursor:
+            print("(已經是最後一頁)")
+            return
+        if input("輸入 n 看下一頁（直接 Enter 結束）: ").strip().lower() != "n":
+            return
+        page += 1
 
 def view_and_rate_from_history(sock, username: str):
     # 先向 server 要遊玩紀錄
@@ -507,9 +958,12 @@ def view_and_rate_from_history(sock, username: str):
 
     print("\n=== 我的遊玩紀錄 ===")
     game_names = list(history.keys())
+    ratings = batch(sock, "player", [
+        ("get_game_ratings", {"game_name": name}) for name in game_names
+    ]) or [None] * len(game_names)
     for idx, name in enumerate(game_names, start=1):
         count = history[name]
-        print(f"{idx}. {name}（玩過 {count} 次）")
+        print(f"{idx}. {name}（玩過 {count} 次）  評分: {_rating_line(ratings[idx - 1])}")
 
     sel = input("想查看 / 評價哪一款？輸入編號（直接 Enter 取消）: ").strip()
     if sel == "":
@@ -605,6 +1059,9 @@ def show_online_users(sock):
 def player_menu(sock, username: str):
     while True:
         print(f"\n=== Player Menu ({username}) ===")
+        downloading = background_download_status()
+        if downloading:
+            print("（背景下載中：" + "、".join(downloading) + "）")
         print("1. 瀏覽商城遊戲")
         print("2. 查看線上玩家列表")
         print("3. 進入遊戲大廳")
@@ -613,6 +1070,8 @@ def player_menu(sock, username: str):
         choice = input("請選擇: ").strip()
 
         if choice == "0":
+            if background_download_status():
+                print("背景下載還沒完成，下次下載同一款遊戲會從中斷的地方接著下載。")
             send_json(
                 sock,
                 {
@@ -650,6 +1109,10 @@ def player_menu(sock, username: str):
                 continue
 
             game_names = list(games.keys())
+            # 每款遊戲的評分包成一個 batch，一次來回拿完
+            ratings = batch(sock, "player", [
+                ("get_game_ratings", {"game_name": name}) for name in game_names
+            ]) or [None] * len(game_names)
             for idx, name in enumerate(game_names, start=1):
                 info = games.get(name, {}) or {}
                 version = info.get("version", "?")
@@ -662,6 +1125,7 @@ def player_menu(sock, username: str):
                 print(f"{idx}. {name} (v{version})")
                 print(f"   開發者: {developer}  類型: {gtype}  人數: {min_p}-{max_p}")
                 print(f"   簡介: {desc}")
+                print(f"   評分: {_rating_line(ratings[idx - 1])}")
                 print()
 
             sel = input("輸入編號可查看詳細資訊（直接 Enter 返回）: ").strip()
@@ -686,7 +1150,8 @@ def player_menu(sock, username: str):
             # 問要不要下載 / 更新到最新版本
             ans = input("要下載 / 更新這款遊戲嗎？(y/n): ").strip().lower()
             if ans == "y":
-                ok = _download_game_core(sock, username, selected_game)
+                # 在背景下載，下載時可以繼續逛商城 / 進其他遊戲的大廳
+                ok = _download_game_core(sock, username, selected_game, background=True)
                 if not ok:
                     print("下載失敗或中途出錯。")
                 # 如果成功，你之後可以從「進入遊戲大廳」那邊進去玩
@@ -754,6 +1219,20 @@ def player_menu(sock, username: str):
 
 
 def game_lobby_menu(sock, username: str, game_name: str):
+    # 訂閱這款遊戲的大廳：開房 / 關房 / 人數變動會即時顯示，不用一直重查列表
+    resp = subscribe(sock, {"game_name": game_name}, render_room_event)
+    if resp is not None and resp.get("status") == "ok":
+        rooms = resp.get("rooms", [])
+        print(f"=== {game_name} 目前的房間（{len(rooms)}）===")
+        for r in rooms:
+            _print_room_line(r)
+    try:
+        _game_lobby_loop(sock, username, game_name)
+    finally:
+        unsubscribe(sock, {"game_name": game_name})
+
+
+def _game_lobby_loop(sock, username: str, game_name: str):
     while True:
         print(f"\n=== Game Lobby ({game_name}) - Player: {username} ===")
         print("1. 創建房間")
@@ -1,11 +1,24 @@
 # server/db_server.py
+import base64
 import json
+import os
+from bisect import bisect_left, bisect_right
+from collections import deque
+from collections.abc import Mapping
 from pathlib import Path
-from threading import Lock
+from threading import Condition, Lock, Thread
+from types import MappingProxyType
 
 DATA_DIR = Path(__file__).parent / "data"
 DATA_DIR.mkdir(exist_ok=True)
 
+# 儲存引擎：
+#   json  ：data/*.json 檔案（ratings / history 為 snapshot + journal）
+#   sqlite：data/game_store.db（見 sqlite_store.py，可用 `python sqlite_store.py migrate` 從 json 匯入）
+# rooms 是暫時性的狀態，不管哪種引擎都寫在 rooms.json。
+STORAGE_ENGINE = os.environ.get("GAME_STORE_ENGINE", "json")
+SQLITE_PATH = Path(os.environ.get("GAME_STORE_SQLITE_PATH", str(DATA_DIR / "game_store.db")))
+
 
 def _load_json(path, default):
     if not path.exists():
@@ -17,108 +30,729 @@ def _load_json(path, default):
         return default
 
 
-def _save_json(path, data):
-    with path.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def _save_json(path, data, indent=2):
+    # 先寫暫存檔再 os.replace：寫到一半當掉也不會留下壞掉的 json
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp, path)
 
 
-# ============ accounts ============
+def _file_stamp(path):
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
 
-_accounts_lock = Lock()
-ACCOUNTS_PATH = DATA_DIR / "accounts.json"
+
+def _freeze(obj):
+    """把 dict / list 遞迴轉成唯讀的 MappingProxyType / tuple。"""
+    if isinstance(obj, Mapping):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+
+def thaw(obj):
+    """_freeze 的反向：唯讀 view 轉回可以修改的 dict / list（深複製）。"""
+    if isinstance(obj, Mapping):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+def json_default(obj):
+    """給 json.dumps(default=...) 用，讓唯讀 view 也能直接序列化。"""
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+# ============ rooms ============
+
+_rooms_lock = Lock()
+ROOMS_PATH = DATA_DIR / "rooms.json"
+
+ROOMS_DEFAULT = {}
+
+# rooms.json 的寫入方式：
+#   write_behind：標記 dirty，由背景 thread 每 ROOMS_FLUSH_INTERVAL 秒
+#                 或累積 ROOMS_FLUSH_BATCH 次修改時寫一次
+#   sync        ：每次修改都立刻寫（舊行為）
+#   off         ：房間是暫時性的狀態，完全不寫檔
+ROOMS_PERSIST_MODE = os.environ.get("GAME_STORE_ROOMS_PERSIST", "write_behind")
+ROOMS_FLUSH_INTERVAL = float(os.environ.get("GAME_STORE_ROOMS_FLUSH_INTERVAL", "1.0"))
+ROOMS_FLUSH_BATCH = int(os.environ.get("GAME_STORE_ROOMS_FLUSH_BATCH", "50"))
+
+
+def load_rooms():
+    data = _load_json(ROOMS_PATH, ROOMS_DEFAULT.copy())
+    return data
+
+
+def save_rooms(data):
+    with _rooms_lock:
+        _save_json(ROOMS_PATH, data)
+
+
+class WriteBehind:
+    """
+    合併多次修改、由背景 thread 寫檔的 persister。
+
+    呼叫端改完資料只要 mark_dirty()；真正寫檔時才呼叫 snapshot() 取得
+    當下的資料，所以兩次 flush 之間的修改只會寫一次檔。
+    """
+
+    def __init__(self, path, snapshot, mode="write_behind",
+                 interval=1.0, batch_size=50, indent=None):
+        if mode not in ("write_behind", "sync", "off"):
+            raise ValueError(f"unknown persist mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.interval = interval
+        self.batch_size = max(1, batch_size)
+        self.indent = indent
+        self._snapshot = snapshot
+        self._cond = Condition()
+        self._write_lock = Lock()
+        self._dirty = 0
+        self._closed = False
+        self._thread = None
+        if mode == "write_behind":
+            self._thread = Thread(target=self._run, name=f"write-behind:{path.name}", daemon=True)
+            self._thread.start()
+
+    def mark_dirty(self):
+        if self.mode == "off":
+            return
+        if self.mode == "sync":
+            self._write()
+            return
+        with self._cond:
+            self._dirty += 1
+            if self._dirty >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """有未寫入的修改就立刻寫檔；回傳是否真的寫了。"""
+        with self._cond:
+            pending = self._dirty
+            self._dirty = 0
+        if not pending:
+            return False
+        self._write()
+        return True
+
+    def close(self):
+        """停掉背景 thread，並把剩下的修改寫出去（server 關閉時呼叫）。"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _write(self):
+        # snapshot 也要在鎖裡拿：不然兩個 sync 模式的寫入者可能一個先拿到新的、另一個後寫舊的
+        # （snapshot 只能拿 registry 鎖這種短的鎖，見 room_registry.py 的鎖順序）
+        with self._write_lock:
+            data = self._snapshot()
+            _save_json(self.path, data, indent=self.indent)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and self._dirty < self.batch_size:
+                    self._cond.wait(self.interval)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[DB] write-behind flush failed for {self.path}: {e}")
+
+
+def rooms_persister(snapshot):
+    """依照 ROOMS_* 設定建立 rooms.json 的 persister。"""
+    return WriteBehind(
+        ROOMS_PATH,
+        snapshot,
+        mode=ROOMS_PERSIST_MODE,
+        interval=ROOMS_FLUSH_INTERVAL,
+        batch_size=ROOMS_FLUSH_BATCH,
+    )
+
+# ============ journal ============
+
+# ratings / history 用「snapshot + append-only journal」存：
+#   <name>.json          ：snapshot，格式 {"journal_seq": N, "data": {...}}
+#                          （舊版沒有包 journal_seq 的檔案視為 seq 0 直接匯入）
+#   <name>.journal.jsonl ：每次修改 append 一行 {"seq": n, "op": ...}
+# 每累積 JOURNAL_COMPACT_EVERY 筆就把整份資料寫成新的 snapshot 並清空 journal。
+JOURNAL_COMPACT_EVERY = int(os.environ.get("GAME_STORE_JOURNAL_COMPACT_EVERY", "1000"))
+JOURNAL_FSYNC = os.environ.get("GAME_STORE_JOURNAL_FSYNC", "0") == "1"
+
+
+class JournalStore:
+    """
+    記憶體裡的 data 是權威資料，修改只 append 一行 journal（O(1)），
+    啟動時讀 snapshot 再 replay journal 的尾巴來復原。
+    """
+
+    def __init__(self, snapshot_path, apply, compact_every=1000, fsync=False):
+        self.snapshot_path = snapshot_path
+        self.journal_path = snapshot_path.with_suffix(".journal.jsonl")
+        self.compact_every = max(1, compact_every)
+        self.fsync = fsync
+        self._apply = apply
+        self.lock = Lock()
+        self._pending = 0  # journal 裡還沒 compact 的筆數
+        self.data, self._seq = self._recover()
+        self._journal = self.journal_path.open("a", encoding="utf-8")
+
+    def _recover(self):
+        raw = _load_json(self.snapshot_path, {})
+        if isinstance(raw, dict) and set(raw) == {"journal_seq", "data"}:
+            seq = int(raw["journal_seq"])
+            data = raw["data"]
+        else:
+            seq = 0
+            data = raw
+        if not isinstance(data, dict):
+            data = {}
+
+        if not self.journal_path.exists():
+            return data, seq
+
+        good_end = 0
+        with self.journal_path.open("rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 最後一行沒寫完就當掉了：丟掉這段
+                    print(f"[DB] dropping torn journal tail in {self.journal_path.name}")
+                    break
+                good_end += len(line)
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    print(f"[DB] skipping corrupt journal line in {self.journal_path.name}")
+                    continue
+                if rec.get("seq", 0) <= seq:
+                    continue  # snapshot 已經包含（compact 到一半當掉的情況）
+                self._apply(data, rec)
+                seq = rec["seq"]
+                self._pending += 1
+
+        if good_end != self.journal_path.stat().st_size:
+            with self.journal_path.open("r+b") as f:
+                f.truncate(good_end)
+        return data, seq
+
+    def append(self, records):
+        """寫入並套用多筆紀錄；呼叫端必須持有 self.lock。"""
+        lines = []
+        for rec in records:
+            self._seq += 1
+            rec = dict(rec, seq=self._seq)
+            self._apply(self.data, rec)
+            lines.append(json.dumps(rec, ensure_ascii=False))
+        if not lines:
+            return
+        self._journal.write("\n".join(lines) + "\n")
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+        self._pending += len(lines)
+        if self._pending >= self.compact_every:
+            self._compact()
+
+    def replace(self, data):
+        """整份換掉（save_* 用），等於立刻做一次 compact。"""
+        with self.lock:
+            self.replace_locked(data)
+
+    def replace_locked(self, data):
+        """同 replace；呼叫端必須持有 self.lock（要跟別的狀態一起換掉時用）。"""
+        self.data = thaw(data)
+        self._compact()
+
+    def _compact(self):
+        _save_json(self.snapshot_path, {"journal_seq": self._seq, "data": self.data})
+        # snapshot 已經落地才清空 journal；中間當掉的話 replay 會用 seq 跳過
+        self._journal.close()
+        self._journal = self.journal_path.open("w", encoding="utf-8")
+        self._pending = 0
+
+    def copy(self):
+        with self.lock:
+            return thaw(self.data)
+
+
+# ============ json engine ============
 
 ACCOUNTS_DEFAULT = {
     "players": {},
     "developers": {},
 }
+# 預設就給空 dict，不要放型別物件
+GAMES_DEFAULT = {}
+RATINGS_DEFAULT = {}  # {game_name: [ {player, score, comment, timestamp}, ... ]}
+HISTORY_DEFAULT = {}  # {player: {game_name: play_count}}
+
+ACCOUNTS_PATH = DATA_DIR / "accounts.json"
+GAMES_PATH = DATA_DIR / "games.json"
+RATINGS_PATH = DATA_DIR / "ratings.json"
+HISTORY_PATH = DATA_DIR / "history.json"
+
+
+def _apply_rating(data, rec):
+    if rec.get("op") == "add":
+        data.setdefault(rec["game"], []).append(rec["entry"])
+
+
+def _apply_history(data, rec):
+    if rec.get("op") == "incr":
+        games = data.setdefault(rec["player"], {})
+        games[rec["game"]] = int(games.get(rec["game"], 0)) + int(rec.get("n", 1))
+
+
+def _index_score(buckets, rating_id, entry):
+    try:
+        score = int(entry.get("score", 0))
+    except (TypeError, ValueError):
+        return
+    buckets.setdefault(score, []).append(rating_id)
+
+
+class JsonEngine:
+    """把資料存在 data_dir 底下 json 檔的儲存引擎。"""
+
+    name = "json"
+
+    def __init__(self, data_dir=DATA_DIR):
+        data_dir = Path(data_dir)
+        self.accounts_path = data_dir / ACCOUNTS_PATH.name
+        self.games_path = data_dir / GAMES_PATH.name
+        self._accounts_lock = Lock()
+        self._accounts = None
+        self._ratings = JournalStore(
+            data_dir / RATINGS_PATH.name, _apply_rating, JOURNAL_COMPACT_EVERY, JOURNAL_FSYNC
+        )
+        self._history = JournalStore(
+            data_dir / HISTORY_PATH.name, _apply_history, JOURNAL_COMPACT_EVERY, JOURNAL_FSYNC
+        )
+        # 分數索引 {game_name: {score: [rating_id, ...]}}，第一次依分數排序時才建立
+        self._score_index = None
+
+    # ---------- accounts ----------
+
+    def _accounts_data(self):
+        # 呼叫端必須持有 _accounts_lock
+        if self._accounts is None:
+            data = _load_json(self.accounts_path, {})
+            if not isinstance(data, dict):
+                data = {}
+            data.setdefault("players", {})
+            data.setdefault("developers", {})
+            self._accounts = data
+        return self._accounts
+
+    def load_accounts(self):
+        with self._accounts_lock:
+            return thaw(self._accounts_data())
+
+    def save_accounts(self, data):
+        with self._accounts_lock:
+            data = thaw(data)
+            data.setdefault("players", {})
+            data.setdefault("developers", {})
+            _save_json(self.accounts_path, data)
+            self._accounts = data
+
+    def get_account(self, group, username):
+        with self._accounts_lock:
+            info = self._accounts_data().get(group, {}).get(username)
+            return dict(info) if info is not None else None
+
+    def register_account(self, group, username, info):
+        with self._accounts_lock:
+            accounts = self._accounts_data()
+            members = accounts.setdefault(group, {})
+            if username in members:
+                return False
+            members[username] = dict(info)
+            _save_json(self.accounts_path, accounts)
+            return True
+
+    # ---------- games ----------
+
+    def games_stamp(self):
+        return _file_stamp(self.games_path)
+
+    def read_games(self):
+        data = _load_json(self.games_path, GAMES_DEFAULT.copy())
+        if not isinstance(data, dict):
+            data = {}
+        return data
+
+    def write_games(self, data):
+        _save_json(self.games_path, data)
+
+    # ---------- ratings ----------
+
+    def load_ratings(self):
+        return self._ratings.copy()
+
+    def save_ratings(self, data):
+        # 清掉分數索引跟換資料要在同一段鎖裡，不然 page_ratings 可能用舊資料重建索引
+        with self._ratings.lock:
+            self._ratings.replace_locked(data)
+            self._score_index = None
+
+    def append_rating(self, game_name, entry):
+        with self._ratings.lock:
+            self._ratings.append([{"op": "add", "game": game_name, "entry": dict(entry)}])
+            if self._score_index is not None:
+                rating_id = len(self._ratings.data[game_name]) - 1
+                _index_score(self._score_index.setdefault(game_name, {}), rating_id, entry)
+
+    def get_ratings(self, game_name):
+        with self._ratings.lock:
+            return [dict(r) for r in self._ratings.data.get(game_name, [])]
+
+    def page_ratings(self, game_name, order, after, limit):
+        """
+        回傳 [(rating_id, entry), ...]，rating_id 是評價在該遊戲 list 裡的位置。
+        after 為上一頁最後一筆的 key（見 db_server.get_ratings_page）。
+        """
+        with self._ratings.lock:
+            entries = self._ratings.data.get(game_name, [])
+            if after is not None and order in ("newest", "oldest") and not 0 <= after[-1] < len(entries):
+                raise ValueError("invalid cursor")  # 偽造的、或評價被整份換掉之前的 cursor
+            if order == "newest":
+                start = len(entries) - 1 if after is None else after[-1] - 1
+                ids = range(start, max(start - limit, -1), -1)
+            elif order == "oldest":
+                start = 0 if after is None else after[-1] + 1
+                ids = range(start, min(start + limit, len(entries)))
+            else:
+                ids = self._page_by_score(game_name, order == "highest", after, limit)
+            return [(i, dict(entries[i])) for i in ids]
+
+    def _page_by_score(self, game_name, desc, after, limit):
+        # 呼叫端必須持有 self._ratings.lock
+        if self._score_index is None:
+            self._score_index = {}
+            for name, entries in self._ratings.data.items():
+                buckets = self._score_index[name] = {}
+                for i, entry in enumerate(entries):
+                    _index_score(buckets, i, entry)
+
+        # highest：分數高到低、同分新到舊；lowest 剛好反過來
+        buckets = self._score_index.get(game_name, {})
+        ids = []
+        for score in sorted(buckets, reverse=desc):
+            bucket = buckets[score]  # 同分數的 rating_id，遞增
+            if after is not None:
+                after_score, after_id = after
+                if (desc and score > after_score) or (not desc and score < after_score):
+                    continue
+                if score == after_score:
+                    if desc:
+                        bucket = bucket[:bisect_left(bucket, after_id)]
+                    else:
+                        bucket = bucket[bisect_right(bucket, after_id):]
+            need = limit - len(ids)
+            ids.extend(reversed(bucket[-need:]) if desc else bucket[:need])
+            if len(ids) >= limit:
+                break
+        return ids
+
+    # ---------- play history ----------
+
+    def load_history(self):
+        return self._history.copy()
+
+    def save_history(self, data):
+        self._history.replace(data)
+
+    def increment_play_count(self, players, game_name, n=1):
+        with self._history.lock:
+            self._history.append(
+                [{"op": "incr", "player": p, "game": game_name, "n": n} for p in players]
+            )
+
+    def get_history(self, player):
+        with self._history.lock:
+            return dict(self._history.data.get(player, {}))
+
+
+def _create_engine(name):
+    if name == "json":
+        return JsonEngine(DATA_DIR)
+    if name == "sqlite":
+        from sqlite_store import SqliteEngine
+        return SqliteEngine(SQLITE_PATH)
+    raise ValueError(f"unknown storage engine: {name}")
+
+
+_engine = _create_engine(STORAGE_ENGINE)
+
+
+# ============ accounts ============
 
 
 def load_accounts():
-    data = _load_json(ACCOUNTS_PATH, ACCOUNTS_DEFAULT.copy())
-    data.setdefault("players", {})
-    data.setdefault("developers", {})
-    return data
+    return _engine.load_accounts()
 
 
 def save_accounts(data):
-    with _accounts_lock:
-        data.setdefault("players", {})
-        data.setdefault("developers", {})
-        _save_json(ACCOUNTS_PATH, data)
+    _engine.save_accounts(data)
+
+
+def get_account(group, username):
+    """group 為 "players" / "developers"，找不到回傳 None。"""
+    return _engine.get_account(group, username)
+
+
+def register_account(group, username, info):
+    """新增一個帳號；帳號已存在則回傳 False。"""
+    return _engine.register_account(group, username, info)
 
 
 # ============ games ============
 
 _games_lock = Lock()
-GAMES_PATH = DATA_DIR / "games.json"
 
-# 預設就給空 dict，不要放型別物件
-GAMES_DEFAULT = {}
+# 商城目錄快取：以記憶體為準（write-through），save_games 會同步更新快取，
+# 有人直接改資料（games.json 或 sqlite 的 games table）時用引擎的 stamp 偵測後重新載入。
+# 三個值包在同一個 tuple 裡，讀取時不用拿鎖也不會看到一半的狀態。
+_games_state = (None, None, 0)  # (stamp, 唯讀 view, catalog version)
 
 
 def load_games():
-    data = _load_json(GAMES_PATH, GAMES_DEFAULT.copy())
-    return data
+    """
+    回傳遊戲目錄的唯讀 view（不會每次都讀檔）。
+    要修改請用 load_games_for_update()，改完再 save_games()。
+    """
+    global _games_state
+    stamp, view, _ = _games_state
+    if view is not None and _engine.games_stamp() == stamp:
+        return view
+
+    with _games_lock:
+        stamp, view, version = _games_state
+        current = _engine.games_stamp()
+        if view is None or current != stamp:
+            view = _freeze(_engine.read_games())
+            _games_state = (current, view, version + 1)
+        return view
+
+
+def load_games_for_update():
+    """回傳一份可修改的遊戲目錄複本。"""
+    return thaw(load_games())
+
+
+def games_version():
+    """目錄每次變動（save_games 或偵測到資料被改）就 +1。"""
+    load_games()
+    return _games_state[2]
 
 
 def save_games(data):
+    global _games_state
     with _games_lock:
-        _save_json(GAMES_PATH, data)
+        view = _freeze(data)
+        _engine.write_games(data)
+        _games_state = (_engine.games_stamp(), view, _games_state[2] + 1)
 
 
-# ============ rooms ============
+# ============ ratings ============
 
-_rooms_lock = Lock()
-ROOMS_PATH = DATA_DIR / "rooms.json"
+# 每款遊戲的評價統計（count / sum / 1~5 分分布 / 最近 N 則），
+# append_rating 時順便更新，get_rating_summary 直接 O(1) 回傳，不用每次掃全部評價。
+RATING_LATEST_N = int(os.environ.get("GAME_STORE_RATING_LATEST_N", "5"))
 
-ROOMS_DEFAULT = {}
+_rating_stats_lock = Lock()
+_rating_stats = None  # {game_name: _RatingStats}，第一次用到時從儲存引擎重建
+_ratings_version = 0  # 評價每次變動就 +1（lobby_server 的回覆快取用）
 
 
-def load_rooms():
-    data = _load_json(ROOMS_PATH, ROOMS_DEFAULT.copy())
-    return data
+class _RatingStats:
+    __slots__ = ("count", "scored", "total", "histogram", "latest")
 
+    def __init__(self):
+        self.count = 0  # 評價筆數
+        self.scored = 0  # 分數有效的筆數（算平均用）
+        self.total = 0
+        self.histogram = [0, 0, 0, 0, 0]  # 1~5 分各幾筆
+        self.latest = deque(maxlen=RATING_LATEST_N)
 
-def save_rooms(data):
-    with _rooms_lock:
-        _save_json(ROOMS_PATH, data)
+    def add(self, entry):
+        self.count += 1
+        self.latest.append(dict(entry))
+        try:
+            score = int(entry.get("score", 0))
+        except (TypeError, ValueError):
+            return
+        self.scored += 1
+        self.total += score
+        if 1 <= score <= 5:
+            self.histogram[score - 1] += 1
 
-# ============ ratings ============
 
-_ratings_lock = Lock()
-RATINGS_PATH = DATA_DIR / "ratings.json"
-RATINGS_DEFAULT = {}  # {game_name: [ {player, score, comment, timestamp}, ... ]}
+def _stats_from(ratings):
+    stats = {}
+    for game_name, entries in ratings.items():
+        st = stats[game_name] = _RatingStats()
+        for entry in entries:
+            st.add(entry)
+    return stats
+
+
+def rebuild_rating_stats():
+    """從儲存引擎重建所有遊戲的評價統計（server 啟動時呼叫）。"""
+    global _rating_stats, _ratings_version
+    with _rating_stats_lock:
+        _rating_stats = _stats_from(_engine.load_ratings())
+        _ratings_version += 1
+
+
+def ratings_version():
+    return _ratings_version
+
+
+def _stats():
+    # 呼叫端必須持有 _rating_stats_lock
+    global _rating_stats
+    if _rating_stats is None:
+        _rating_stats = _stats_from(_engine.load_ratings())
+    return _rating_stats
 
 
 def load_ratings():
-    data = _load_json(RATINGS_PATH, RATINGS_DEFAULT.copy())
-    # 確保一定是 dict
+    return _engine.load_ratings()
+
+
+def save_ratings(data):
+    global _rating_stats, _ratings_version
     if not isinstance(data, dict):
         data = {}
-    return data
+    with _rating_stats_lock:
+        _engine.save_ratings(data)
+        _rating_stats = _stats_from(data)
+        _ratings_version += 1
 
 
-def save_ratings(data):
-    with _ratings_lock:
-        _save_json(RATINGS_PATH, data)
+def append_rating(game_name, entry):
+    """新增一筆評價（json 引擎只 append 一行 journal，sqlite 引擎只 INSERT 一列）。"""
+    global _ratings_version
+    with _rating_stats_lock:
+        _engine.append_rating(game_name, entry)
+        _stats().setdefault(game_name, _RatingStats()).add(entry)
+        _ratings_version += 1
 
 
-# ============ play history ============
+def get_ratings(game_name):
+    """回傳某款遊戲所有評價的複本（舊到新）。"""
+    return _engine.get_ratings(game_name)
 
-_history_lock = Lock()
-HISTORY_PATH = DATA_DIR / "history.json"
-HISTORY_DEFAULT = {}  # {player: {game_name: play_count}}
+
+RATING_ORDERS = ("newest", "oldest", "highest", "lowest")
+RATING_PAGE_MAX = 50
+
+
+def _encode_cursor(order, key):
+    raw = json.dumps([order, *key], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor, order):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cur_order, *key = json.loads(raw)
+        key = tuple(int(k) for k in key)
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor")
+    if cur_order != order or len(key) != (1 if order in ("newest", "oldest") else 2):
+        raise ValueError("cursor does not match order")
+    return key
+
+
+def get_ratings_page(game_name, order="newest", cursor=None, limit=10):
+    """
+    分頁讀取評價。cursor 為上一頁回傳的 next_cursor（不透明字串），
+    回傳 {"ratings": [...], "next_cursor": str 或 None}；格式錯誤丟 ValueError。
+    """
+    if order not in RATING_ORDERS:
+        raise ValueError(f"order must be one of {', '.join(RATING_ORDERS)}")
+    limit = max(1, min(int(limit), RATING_PAGE_MAX))
+    after = _decode_cursor(cursor, order) if cursor else None
+
+    # 多拿一筆判斷還有沒有下一頁
+    rows = _engine.page_ratings(game_name, order, after, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        rating_id, entry = rows[-1]
+        if order in ("newest", "oldest"):
+            key = (rating_id,)
+        else:
+            key = (int(entry.get("score", 0)), rating_id)
+        next_cursor = _encode_cursor(order, key)
+    return {"ratings": [entry for _, entry in rows], "next_cursor": next_cursor}
+
+
+def get_rating_summary(game_name):
+    """
+    回傳 {"count", "avg_score", "histogram", "latest"}，
+    histogram 為 {"1": n, ..., "5": n}，latest 為最近 RATING_LATEST_N 則（舊到新）。
+    """
+    with _rating_stats_lock:
+        return _summary(_stats().get(game_name))
+
+
+def get_rating_summaries(game_names):
+    """一次查多款遊戲的評價統計（只拿一次鎖），回傳 {game_name: summary}。"""
+    with _rating_stats_lock:
+        stats = _stats()
+        return {name: _summary(stats.get(name)) for name in game_names}
+
+
+def _summary(st):
+    # 呼叫端必須持有 _rating_stats_lock
+    if st is None:
+        st = _RatingStats()
+    return {
+        "count": st.count,
+        "avg_score": st.total / st.scored if st.scored else None,
+        "histogram": {str(i + 1): n for i, n in enumerate(st.histogram)},
+        "latest": [dict(e) for e in st.latest],
+    }
+
+
+# ============ play history ============
 
 
 def load_history():
-    data = _load_json(HISTORY_PATH, HISTORY_DEFAULT.copy())
+    return _engine.load_history()
+
+
+def save_history(data):
     if not isinstance(data, dict):
         data = {}
-    return data
+    _engine.save_history(data)
 
 
-def save_history(data):
-    with _history_lock:
-        _save_json(HISTORY_PATH, data)
+def increment_play_count(players, game_name, n=1):
+    """這些玩家各玩過 game_name n 次（一次寫入，不會有 lost update）。"""
+    _engine.increment_play_count(list(players), game_name, n)
 
 
+def get_history(player):
+    """回傳某位玩家 {game_name: play_count} 的複本。"""
+    return _engine.get_history(player)
@@ -1,28 +1,116 @@
 from typing import Dict, Any
+import os
+import time
 import zipfile
 from pathlib import Path
 
-from db_server import load_games, save_games
+import download_tickets
+import game_manifest
+from db_server import load_games, load_games_for_update, save_games
 
 UPLOAD_DIR = Path(__file__).parent / "uploaded_games"
 UPLOAD_DIR.mkdir(exist_ok=True)
+STAGING_DIR = UPLOAD_DIR / "staging"  # 從資料通道傳上來、還沒 upload_game / update_game 的 zip
 
 
-def _recv_exact(conn, size: int):
+def _recv_exact(reader, size: int):
     """
-    從 socket 收滿 size bytes，yield 一塊一塊的 bytes。
+    從連線收滿 size bytes，yield 一塊一塊的資料（直接寫進檔案，不要留著）。
+    reader 是這條連線的 FramedReader（或 lobby_async 的同介面物件），
+    JSON 後面已經先收進 buffer 的檔案開頭也會一起給。
     如果連線中途斷掉就丟例外。
     """
-    remaining = size
-    while remaining > 0:
-        chunk = conn.recv(min(4096, remaining))
-        if not chunk:
-            raise ConnectionError("connection closed while receiving file")
-        remaining -= len(chunk)
-        yield chunk
+    return reader.iter_exact(size)
 
 
-def upload_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
+def _staged_path(claims: Dict[str, Any]) -> Path:
+    return STAGING_DIR / f"{claims['upload']}.zip"
+
+
+def _clean_staging():
+    """票過期還沒用掉的暫存檔刪掉。"""
+    deadline = time.time() - download_tickets.TICKET_TTL
+    for path in STAGING_DIR.glob("*"):
+        try:
+            if path.stat().st_mtime < deadline:
+                path.unlink()
+        except OSError:
+            pass
+
+
+def issue_upload_ticket(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    developer / upload_ticket：先把 zip 傳到資料通道（transfer_server 的 upload）暫存，
+    之後 upload_game / update_game 的 payload 帶同一張票（upload_ticket），lobby 連線上就不用再傳檔。
+    """
+    developer = payload.get("developer")
+    archive_size = payload.get("archive_size")
+    if not developer or not isinstance(archive_size, int) or archive_size <= 0:
+        return {"status": "error", "message": "missing fields in upload_ticket"}
+
+    _clean_staging()
+    claims = {"op": "upload", "upload": os.urandom(16).hex(), "developer": developer, "size": archive_size}
+    return {
+        "status": "ok",
+        "message": "upload ticket",
+        "ticket": download_tickets.sign(claims),
+        "expires_in": download_tickets.TICKET_TTL,
+    }
+
+
+def receive_upload(payload: Dict[str, Any], reader) -> Dict[str, Any]:
+    """資料通道的 upload：照上傳票上的大小收檔，存成暫存檔。"""
+    claims = download_tickets.verify(payload.get("ticket"), op="upload")
+    if claims is None:
+        return {"status": "error", "message": "invalid or expired ticket"}
+
+    STAGING_DIR.mkdir(exist_ok=True)
+    staged = _staged_path(claims)
+    tmp = staged.with_suffix(".part")
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in _recv_exact(reader, claims["size"]):
+                f.write(chunk)
+        os.replace(tmp, staged)
+    finally:
+        if tmp.exists():
+            tmp.unlink()  # 沒收完（連線斷了），例外往上丟，這條連線就關掉
+    print(f"[UPLOAD] staged {staged.name} ({claims['size']} bytes) for {claims['developer']}")
+    return {"status": "ok", "message": "upload received", "archive_size": claims["size"]}
+
+
+def _receive_archive(payload: Dict[str, Any], reader, zip_path: Path, archive_size: int):
+    """
+    把這次上傳的 zip 放到 zip_path：payload 有 upload_ticket 就用資料通道傳好的暫存檔，
+    否則檔案內容接在這個 JSON 後面，從 lobby 連線收。有問題丟例外。
+    """
+    ticket = payload.get("upload_ticket")
+    if ticket is None:
+        with open(zip_path, "wb") as f:
+            for chunk in _recv_exact(reader, archive_size):
+                f.write(chunk)
+        return
+
+    claims = download_tickets.verify(ticket, op="upload")
+    if claims is None:
+        raise ValueError("invalid or expired upload ticket")
+    if claims["developer"] != payload.get("developer") or claims["size"] != archive_size:
+        raise ValueError("upload ticket does not match this upload")
+    staged = _staged_path(claims)
+    if not staged.exists():
+        raise ValueError("archive has not been uploaded to the transfer port")
+    os.replace(staged, zip_path)
+
+
+def _save_manifest(game_name: str, version: str, zip_path: Path):
+    # 失敗也不影響上架（manifest 之後下載 delta 時會從 zip 補算）
+    try:
+        game_manifest.save_manifest(game_name, version, zip_path)
+    except Exception as e:
+        print(f"[MANIFEST] failed to build manifest for {game_name} v{version}: {e}")
+
+
+def upload_game(payload: Dict[str, Any], reader) -> Dict[str, Any]:
     developer = payload.get("developer")
     game_name = payload.get("game_name")
     version = payload.get("version")
@@ -36,6 +124,10 @@ def upload_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
     if not all([developer, game_name, version, archive_size]):
         return {"status": "error", "message": "missing fields in upload_game"}
 
+    # 版本號會變成檔名，不能帶路徑（見 game_manifest.valid_version）
+    if not game_manifest.valid_version(version):
+        return {"status": "error", "message": "invalid version: use letters, digits, '.', '_' or '-'"}
+
     try:
         archive_size = int(archive_size)
     except ValueError:
@@ -65,9 +157,7 @@ def upload_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
 
     # step 1: receive the zip file
     try:
-        with open(zip_path, "wb") as f:
-            for chunk in _recv_exact(conn, archive_size):
-                f.write(chunk)
+        _receive_archive(payload, reader, zip_path, archive_size)
     except Exception as e:
         return {"status": "error", "message": f"failed to receive file: {e}"}
 
@@ -89,8 +179,11 @@ def upload_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
     except Exception as e:
         return {"status": "error", "message": f"failed to extract zip: {e}"}
 
+    # 記下這個版本的檔案清單，之後玩家更新時可以只下載有變的檔案
+    _save_manifest(game_name, str(version), zip_path)
+
     # step 3: update games database
-    games = load_games()
+    games = load_games_for_update()
     info = {
         "developer": developer,
         "version": str(version),
@@ -111,7 +204,7 @@ def upload_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
 
 
 
-def update_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
+def update_game(payload: Dict[str, Any], reader) -> Dict[str, Any]:
     """只有原本的 developer 可以更新同一個 game_name。"""
     developer = payload.get("developer")
     game_name = payload.get("game_name")
@@ -125,13 +218,17 @@ def update_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
     if not all([developer, game_name, new_version, archive_size]):
         return {"status": "error", "message": "missing fields in update_game"}
 
+    # 版本號會變成檔名，不能帶路徑（見 game_manifest.valid_version）
+    if not game_manifest.valid_version(new_version):
+        return {"status": "error", "message": "invalid version: use letters, digits, '.', '_' or '-'"}
+
     try:
         archive_size = int(archive_size)
     except ValueError:
         return {"status": "error", "message": "invalid archive_size"}
 
     # 先載入遊戲資料，之後要用到舊的 min/max
-    games = load_games()
+    games = load_games_for_update()
     info = games.get(game_name)
     if not info:
         return {"status": "error", "message": "game not found"}
@@ -168,46 +265,43 @@ def update_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
         return {"status": "error", "message": "invalid min_players or max_players"}
 
     old_version = str(info.get("version", ""))
-    # 刪舊檔案（忽略失敗）
-    try:
-        old_zip = UPLOAD_DIR / f"{game_name}_{old_version}.zip"
-        old_dir = UPLOAD_DIR / f"{game_name}_{old_version}"
-        if old_zip.exists():
-            old_zip.unlink()
-        if old_dir.exists():
-            import shutil
-            shutil.rmtree(old_dir)
-    except Exception:
-        pass
+    # 舊版本的 manifest 要在 zip 刪掉之前準備好（玩家之後從舊版本更新要用）
+    game_manifest.load_manifest(game_name, old_version)
 
-    # 跟 upload_game 一樣流程：收新的 zip、解壓
+    # 跟 upload_game 一樣流程：收新的 zip、解壓；
+    # 先放在暫存的位置，任何一步失敗舊版本都還在，資料庫也還指著它
     zip_name = f"{game_name}_{new_version}.zip"
     zip_path = UPLOAD_DIR / zip_name
     extract_dir = UPLOAD_DIR / f"{game_name}_{new_version}"
+    tmp_zip = UPLOAD_DIR / f"{zip_name}.part"
+    tmp_dir = UPLOAD_DIR / f"{extract_dir.name}.part"
 
+    import shutil
     try:
-        with open(zip_path, "wb") as f:
-            for chunk in _recv_exact(conn, archive_size):
-                f.write(chunk)
+        _receive_archive(payload, reader, tmp_zip, archive_size)
     except Exception as e:
+        tmp_zip.unlink(missing_ok=True)
         return {"status": "error", "message": f"failed to receive file: {e}"}
 
     try:
-        if not extract_dir.exists():
-            extract_dir.mkdir()
-
-        for item in extract_dir.iterdir():
-            if item.is_file():
-                item.unlink()
-            else:
-                import shutil
-                shutil.rmtree(item)
-
-        with zipfile.ZipFile(zip_path, "r") as zip_ref:
-            zip_ref.extractall(extract_dir)
+        if tmp_dir.exists():
+            shutil.rmtree(tmp_dir)
+        tmp_dir.mkdir()
+        with zipfile.ZipFile(tmp_zip, "r") as zip_ref:
+            zip_ref.extractall(tmp_dir)
     except Exception as e:
+        tmp_zip.unlink(missing_ok=True)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
         return {"status": "error", "message": f"failed to extract zip: {e}"}
 
+    # 新版本完整了才換上去（版本號沒變時就是蓋掉原本的）
+    os.replace(tmp_zip, zip_path)
+    if extract_dir.exists():
+        shutil.rmtree(extract_dir)
+    os.replace(tmp_dir, extract_dir)
+
+    _save_manifest(game_name, str(new_version), zip_path)
+
     # 更新資料庫
     info["version"] = str(new_version)
     if description is not None:
@@ -221,6 +315,18 @@ def update_game(payload: Dict[str, Any], conn) -> Dict[str, Any]:
     games[game_name] = info
     save_games(games)
 
+    # 資料庫已經指到新版本，才刪舊檔案（忽略失敗）
+    if old_version != str(new_version):
+        try:
+            old_zip = UPLOAD_DIR / f"{game_name}_{old_version}.zip"
+            old_dir = UPLOAD_DIR / f"{game_name}_{old_version}"
+            if old_zip.exists():
+                old_zip.unlink()
+            if old_dir.exists():
+                shutil.rmtree(old_dir)
+        except Exception:
+            pass
+
     return {
         "status": "ok",
         "message": "update_game success",
@@ -236,7 +342,7 @@ def delete_game(payload: Dict[str, Any]) -> Dict[str, Any]:
     if not all([developer, game_name]):
         return {"status": "error", "message": "missing fields in delete_game"}
 
-    games = load_games()
+    games = load_games_for_update()
     info = games.get(game_name)
     if not info:
         return {"status": "error", "message": "game not found"}
@@ -258,6 +364,8 @@ def delete_game(payload: Dict[str, Any]) -> Dict[str, Any]:
     except Exception:
         pass
 
+    game_manifest.remove_game(game_name)
+
     # 再刪資料
     del games[game_name]
     save_games(games)
@@ -286,15 +394,3 @@ def list_my_games(payload: Dict[str, Any]) -> Dict[str, Any]:
         "message": "list_my_games success",
         "games": my_games,
     }
-
-def handle_developer_action(action: str, payload: Dict[str, Any], conn) -> Dict[str, Any]:
-    if action == "upload_game":
-        return upload_game(payload, conn)
-    elif action == "update_game":
-        return update_game(payload, conn)
-    elif action == "delete_game":
-        return delete_game(payload)
-    elif action == "list_my_games":
-        return list_my_games(payload)
-    else:
-        return {"status": "error", "message": f"unknown developer action: {action}"}
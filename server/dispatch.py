@@ -0,0 +1,252 @@
+# server/dispatch.py
+"""
+請求的分派：每個 (role, action) 在啟動時註冊一次（handler、payload 的欄位型別、要不要登入），
+收到請求時查表（一次 dict lookup）後經過 middleware 鏈再交給 handler。
+
+middleware 是有 before / after / on_error 的物件：
+  - before(req) 回傳非 None 就直接當作回覆，後面的 middleware 和 handler 都不跑
+  - after(req, resp) 可以換掉回覆（只有 before 有跑過的 middleware 才會呼叫，順序相反）
+  - on_error(req, exc) 回傳非 None 就當作回覆（例外被吃掉，之後只有更外層的 after 會跑），
+    都沒有人處理就往外丟；before 自己丟的例外也一樣，從丟例外的那個 middleware 開始往外找
+每個 route 要經過哪些 middleware 在 compile() 時就決定好（applies()），之後不用再判斷。
+
+handler 收到 Request，回傳回覆 dict、已經編好的 JSON bytes（例如快取裡的），
+或 None（handler 自己送完了，例如下載）。handler 可以是一般函式，也可以是 coroutine function
+（lobby_async 用 override() 換掉需要 event loop 的動作）。
+"""
+import asyncio
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def _err(message: str) -> Dict[str, Any]:
+    return {"status": "error", "message": message}
+
+
+class Request:
+    """一個請求；session 是這條連線的狀態（lobby_server._Session / lobby_async._Connection）。"""
+
+    def __init__(self, msg: Dict[str, Any], session):
+        self.role = msg.get("role")
+        self.action = msg.get("action")
+        self.payload = msg.get("payload", {}) or {}
+        self.request_id = msg.get("request_id")
+        self.session = session
+        self.route: Optional["Route"] = None
+        self.ran = 0  # 開始跑 before 的 middleware 數（before 丟例外時 on_error / after 才知道要找誰）
+        self.after_send: List[Callable[[], None]] = []  # 回覆送出去之後要做的事（例如 hello 切換格式）
+
+
+class Route:
+    def __init__(self, role: str, action: str, handler, schema: Dict[str, Any],
+                 auth: bool, payload_only: bool):
+        self.role = role
+        self.action = action
+        self.handler = handler
+        self.schema = schema
+        self.auth = auth  # 需要先用同一個 role 登入
+        self.payload_only = payload_only  # handler 只吃 payload（可以給 batch / coordinator 直接呼叫）
+        # compile() 之後才有
+        self.checks: Tuple[Tuple[str, tuple], ...] = ()
+        self.middleware: Tuple["Middleware", ...] = ()
+        self.call: Callable = None
+        self.is_async = False
+
+    def validate(self, payload) -> Optional[Dict[str, Any]]:
+        """payload 欄位型別不對就回傳錯誤回覆（有沒有給由 handler 自己檢查，錯誤訊息才會跟以前一樣）。"""
+        if not isinstance(payload, dict):
+            return _err("invalid payload")
+        for field, types in self.checks:
+            value = payload.get(field)
+            if value is not None and not isinstance(value, types):
+                return _err(f"invalid {field}")
+        return None
+
+
+class Middleware:
+    def applies(self, route: Route) -> bool:
+        return True
+
+    def before(self, req: Request):
+        return None
+
+    def after(self, req: Request, resp):
+        return resp
+
+    def on_error(self, req: Request, exc: Exception):
+        return None
+
+
+class Dispatcher:
+    def __init__(self, unknown: Callable[[Request], Dict[str, Any]]):
+        """unknown(req)：查不到 route 時的回覆。"""
+        self._routes: Dict[Tuple[str, str], Route] = {}
+        self._middleware: List[Middleware] = []
+        self._unknown = unknown
+
+    def add(self, role: str, action: str, handler, schema: Dict[str, Any] = None,
+            auth: bool = True, payload_only: bool = False):
+        """
+        schema 是 {欄位: 型別或型別 tuple}；payload_only 的 handler 呼叫方式是 handler(payload)，
+        其他是 handler(req)。
+        """
+        self._routes[(role, action)] = Route(role, action, handler, schema or {}, auth, payload_only)
+
+    def override(self, role: str, action: str, handler):
+        """換掉已註冊動作的 handler（schema、auth 不變），handler 呼叫方式是 handler(req)。"""
+        route = self._routes[(role, action)]
+        route.handler = handler
+        route.payload_only = False
+        if route.call is not None:
+            self._compile_route(route)
+
+    def use(self, middleware: Middleware):
+        self._middleware.append(middleware)
+
+    def route(self, role: str, action: str) -> Optional[Route]:
+        return self._routes.get((role, action))
+
+    def actions(self, role: str) -> List[str]:
+        return [action for (r, action) in self._routes if r == role]
+
+    def compile(self):
+        for route in self._routes.values():
+            self._compile_route(route)
+
+    def _compile_route(self, route: Route):
+        route.checks = tuple(
+            (field, types if isinstance(types, tuple) else (types,))
+            for field, types in route.schema.items()
+        )
+        route.middleware = tuple(m for m in self._middleware if m.applies(route))
+        handler = route.handler
+        route.call = (lambda req: handler(req.payload)) if route.payload_only else handler
+        route.is_async = asyncio.iscoroutinefunction(handler)
+
+    # ---------- 執行 ----------
+
+    def _before(self, req: Request):
+        """
+        跑 before；回傳提早的回覆或 None。跑到第幾個記在 req.ran（要在呼叫 before 之前記，
+        before 丟例外時 _error 才找得到外層的 ErrorMapping，Timing 的 after 也才會跑）。
+        """
+        for i, m in enumerate(req.route.middleware):
+            req.ran = i + 1
+            resp = m.before(req)
+            if resp is not None:
+                return resp
+        return None
+
+    def _after(self, req: Request, ran: int, resp):
+        for m in reversed(req.route.middleware[:ran]):
+            resp = m.after(req, resp)
+        return resp
+
+    def _error(self, req: Request, ran: int, exc: Exception):
+        """回傳 (處理掉例外的 middleware 的位置, 回覆)。"""
+        for i in reversed(range(ran)):
+            resp = req.route.middleware[i].on_error(req, exc)
+            if resp is not None:
+                return i, resp
+        raise exc
+
+    def dispatch(self, req: Request):
+        """同步執行一個請求（threaded server，或 lobby_async 在 executor 裡）。"""
+        req.route = self._routes.get((req.role, req.action))
+        if req.route is None:
+            return self._unknown(req)
+        try:
+            resp = self._before(req)
+            if resp is None:
+                resp = req.route.call(req)
+            ran = req.ran
+        except Exception as e:
+            ran, resp = self._error(req, req.ran, e)
+        return self._after(req, ran, resp)
+
+    async def dispatch_async(self, req: Request, run_sync):
+        """
+        lobby_async 用：一般 handler 連同 middleware 整個丟給 run_sync（executor）跑；
+        coroutine handler 在 event loop 上跑（middleware 也是）。
+        """
+        route = self._routes.get((req.role, req.action))
+        if route is None or not route.is_async:
+            return await run_sync(self.dispatch, req)
+        req.route = route
+        try:
+            resp = self._before(req)
+            if resp is None:
+                resp = await route.call(req)
+            ran = req.ran
+        except Exception as e:
+            ran, resp = self._error(req, req.ran, e)
+        return self._after(req, ran, resp)
+
+
+# ---------- 通用的 middleware ----------
+
+
+class ErrorMapping(Middleware):
+    """handler 丟例外時回 internal server error，不再讓整條連線斷掉（連線本身壞掉的 OSError 照樣往外丟）。"""
+
+    def on_error(self, req: Request, exc: Exception):
+        if isinstance(exc, OSError):
+            return None
+        print(f"[!] Error handling {req.role}/{req.action}: {exc!r}")
+        return _err("internal server error")
+
+
+class Timing(Middleware):
+    """每個動作的次數 / 總耗時 / 最大耗時；要放在 ErrorMapping 外面，出錯的請求才會算到。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats: Dict[str, List[float]] = {}
+
+    def before(self, req: Request):
+        req.started = time.perf_counter()
+        return None
+
+    def after(self, req: Request, resp):
+        elapsed = time.perf_counter() - req.started
+        key = f"{req.role}/{req.action}"
+        with self._lock:
+            st = self._stats.get(key)
+            if st is None:
+                st = self._stats[key] = [0, 0.0, 0.0]
+            st[0] += 1
+            st[1] += elapsed
+            st[2] = max(st[2], elapsed)
+        return resp
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                key: {
+                    "count": count,
+                    "avg_ms": total / count * 1000,
+                    "max_ms": worst * 1000,
+                }
+                for key, (count, total, worst) in sorted(self._stats.items())
+            }
+
+
+class Auth(Middleware):
+    """需要登入的動作：要先用同一個 role 登入（訊息跟以前 client_loop 的一樣）。"""
+
+    def applies(self, route: Route) -> bool:
+        return route.auth
+
+    def before(self, req: Request):
+        session = req.session
+        if session.role is None or session.user is None:
+            return _err("please login first")
+        if session.role != req.role:
+            return _err("role mismatch or unknown role")
+        return None
+
+
+class Validate(Middleware):
+    def before(self, req: Request):
+        return req.route.validate(req.payload)
@@ -0,0 +1,60 @@
+# server/download_tickets.py
+"""
+下載 / 上傳票：lobby 發給已登入的使用者，之後 client 另外開連線（lobby 的 system / download_range，
+或資料通道 transfer_server）時拿這張票傳檔，不用在每條連線上再登入一次。
+- 下載票（player / download_ticket）：遊戲名稱、zip 的 sha256，用來要檔案的某一段
+- 上傳票（developer / upload_ticket，op = "upload"）：developer、檔案大小、暫存檔的 id
+
+票本身帶著這些資訊和到期時間，用 HMAC 簽名，server 不用記任何狀態；
+多 process 模式（lobby_cluster）下哪個 worker 收到都能驗證，只要大家用同一個 secret
+（GAME_STORE_TICKET_SECRET，沒設定時每次啟動隨機產生，lobby_cluster 會幫 worker 設好）。
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+_secret_env = os.environ.get("GAME_STORE_TICKET_SECRET")
+SECRET = _secret_env.encode("utf-8") if _secret_env else os.urandom(32)
+TICKET_TTL = int(os.environ.get("GAME_STORE_TICKET_TTL", "600"))  # 秒
+
+
+def _sign(body: bytes) -> str:
+    return hmac.new(SECRET, body, hashlib.sha256).hexdigest()
+
+
+def sign(claims: Dict[str, Any], ttl: int = TICKET_TTL) -> str:
+    claims = {**claims, "exp": int(time.time()) + ttl}
+    body = base64.urlsafe_b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{body.decode('ascii')}.{_sign(body)}"
+
+
+def issue(game_name: str, sha256: str, ttl: int = TICKET_TTL) -> str:
+    """下載票（沒有 op 欄位，跟之前發的票一樣）。"""
+    return sign({"game": game_name, "sha256": sha256}, ttl)
+
+
+def verify(ticket, op: str = "download") -> Optional[Dict[str, Any]]:
+    """簽名對、是 op 這種票、還沒過期就回傳票裡的內容（下載票是 {"game", "sha256", "exp"}），否則 None。"""
+    if not isinstance(ticket, str) or "." not in ticket:
+        return None
+    body, _, sig = ticket.rpartition(".")
+    try:
+        body = body.encode("ascii")
+    except UnicodeEncodeError:
+        return None
+    # 比 bytes：compare_digest 遇到含非 ASCII 字元的 str 會丟 TypeError，那是 client 亂給的票，不是 server 出錯
+    if not hmac.compare_digest(_sign(body).encode("ascii"), sig.encode("utf-8", "replace")):
+        return None
+    try:
+        claims = json.loads(base64.urlsafe_b64decode(body))
+    except ValueError:
+        return None
+    if not isinstance(claims, dict) or claims.get("exp", 0) < time.time():
+        return None
+    if claims.get("op", "download") != op:
+        return None  # 上傳票不能拿來下載，反過來也一樣
+    return claims
@@ -0,0 +1,277 @@
+# server/framing.py
+"""
+lobby 協定的收發格式。
+
+預設是文字模式：一行一個 JSON（\n 結尾），上傳檔案時 JSON 後面直接接 archive_size 個 bytes。
+連線後 client 送 system/hello 可以協商（見 WireFormat）：
+  - 壓縮：大訊息用 zlib 壓縮
+  - binary framing：之後每個 frame 都是 8 bytes 的 header（HEADER）+ length bytes 的內容，
+    JSON 訊息（FRAME_JSON）和檔案內容（FRAME_DATA）走同一層，收的一方直接照長度收、不用找換行；
+    檔案內容切成很多個 DATA frame，中間可以插進事件或其他回覆
+
+FramedReader 是每條連線一個的讀取器：
+  - recv_into 直接收進重複使用的 bytearray，不會每收一塊就串接一次
+  - 找換行只掃新收到的部分
+  - 一次收到的多餘 bytes（下一個請求、上傳檔案的開頭）留在 buffer 給下一次讀
+  - 單一訊息超過 max_frame 就丟 FrameTooLarge
+"""
+import itertools
+import os
+import socket
+import struct
+import threading
+import zlib
+from typing import Any, Dict, Iterator, Optional
+
+MAX_FRAME = 1024 * 1024  # 單一 JSON 訊息最大長度
+INITIAL_BUFFER = 64 * 1024
+
+# 連線一開始 client 送 system/hello 協商好壓縮之後，server 送出的訊息超過 COMPRESS_MIN bytes
+# 就改成 {"type": "zlib", "size": 壓縮後長度, "raw": 原長度}\n + size bytes 的 zlib 資料
+# （跟下載檔案一樣是「header 再接 raw bytes」）。每則訊息各自壓縮，事件跟平行回覆交錯也不影響。
+COMPRESSION = "zlib"
+COMPRESS_MIN = int(os.environ.get("GAME_STORE_COMPRESS_MIN", "4096"))
+COMPRESS_LEVEL = int(os.environ.get("GAME_STORE_COMPRESS_LEVEL", "1"))  # JSON 用 1 就壓得不錯，又快
+
+# binary framing 的 header：type, flags, stream, length（network byte order）
+HEADER = struct.Struct("!BBHI")
+FRAME_JSON = 1  # 一個 JSON 訊息（UTF-8）
+FRAME_DATA = 2  # 檔案內容的一段；stream 對應下載 header 裡的 "stream"（上傳固定是 0）
+FLAG_ZLIB = 0x01  # 內容是 zlib 壓縮過的（只用在 FRAME_JSON）
+DATA_CHUNK = 256 * 1024  # 檔案內容每個 DATA frame 最多幾 bytes
+
+
+class FrameTooLarge(ValueError):
+    pass
+
+
+class CompressionStats:
+    """server 送出訊息的壓縮統計（整個 process 共用一份）。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.messages = 0  # 送出的訊息數（有協商壓縮的連線）
+        self.compressed = 0  # 其中真的壓縮的
+        self.raw_bytes = 0  # 不壓縮的話要送幾 bytes
+        self.sent_bytes = 0  # 實際送了幾 bytes
+
+    def record(self, raw: int, sent: int, compressed: bool):
+        with self._lock:
+            self.messages += 1
+            self.compressed += compressed
+            self.raw_bytes += raw
+            self.sent_bytes += sent
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            saved = self.raw_bytes - self.sent_bytes
+            return {
+                "messages": self.messages,
+                "compressed": self.compressed,
+                "raw_bytes": self.raw_bytes,
+                "sent_bytes": self.sent_bytes,
+                "saved_bytes": saved,
+                "saved_ratio": saved / self.raw_bytes if self.raw_bytes else 0.0,
+            }
+
+
+compression_stats = CompressionStats()
+
+
+def negotiate(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """hello 的 payload 裡 client 列出支援的壓縮方式 / framing，回傳這條連線要用哪些。"""
+    def offered(key):
+        value = payload.get(key) or []
+        return value if isinstance(value, list) else []
+
+    return {
+        "compression": COMPRESSION if COMPRESSION in offered("compression") else None,
+        "framing": "binary" if "binary" in offered("framing") else "line",
+    }
+
+
+def inflate(body: bytes, limit: int) -> bytes:
+    """解壓縮收到的 frame，解開後超過 limit 就丟 FrameTooLarge（不會先把整個結果生出來）。"""
+    d = zlib.decompressobj()
+    data = d.decompress(body, limit)
+    if d.unconsumed_tail:
+        raise FrameTooLarge(f"frame exceeds {limit} bytes")
+    return data
+
+
+def compress_line(line: bytes) -> bytes:
+    """line 是含 \n 的一行 JSON；夠大而且壓了有變小就換成 zlib frame，否則原樣回傳。"""
+    if len(line) < COMPRESS_MIN:
+        compression_stats.record(len(line), len(line), False)
+        return line
+    body = zlib.compress(line[:-1], COMPRESS_LEVEL)
+    header = b'{"type":"zlib","size":%d,"raw":%d}\n' % (len(body), len(line) - 1)
+    if len(header) + len(body) >= len(line):
+        compression_stats.record(len(line), len(line), False)
+        return line
+    compression_stats.record(len(line), len(header) + len(body), True)
+    return header + body
+
+
+class WireFormat:
+    """一條連線 hello 協商後的送訊格式；hello 之前是文字模式、不壓縮。"""
+
+    def __init__(self):
+        self.compress = False
+        self.binary = False
+        self._streams = itertools.count(1)
+
+    def apply(self, hello: Dict[str, Any]):
+        """hello 的回覆送出去之後才呼叫，回覆本身還是用舊格式。"""
+        self.compress = hello.get("compression") == COMPRESSION
+        self.binary = hello.get("framing") == "binary"
+
+    def encode(self, body: bytes) -> bytes:
+        """body 是一個 JSON 訊息（不含 \n），回傳要送出去的 bytes。"""
+        if not self.binary:
+            line = body + b"\n"
+            return compress_line(line) if self.compress else line
+        flags = 0
+        if self.compress:
+            raw = HEADER.size + len(body)
+            if len(body) >= COMPRESS_MIN:
+                packed = zlib.compress(body, COMPRESS_LEVEL)
+                if len(packed) < len(body):
+                    body, flags = packed, FLAG_ZLIB
+            compression_stats.record(raw, HEADER.size + len(body), bool(flags))
+        return HEADER.pack(FRAME_JSON, flags, 0, len(body)) + body
+
+    def next_stream(self) -> int:
+        """下載用的 stream 編號（1 ~ 65535 循環，0 保留給上傳）。"""
+        return (next(self._streams) - 1) % 0xFFFF + 1
+
+    @staticmethod
+    def data_header(stream: int, length: int) -> bytes:
+        return HEADER.pack(FRAME_DATA, 0, stream, length)
+
+
+class FramedReader:
+    def __init__(self, sock: socket.socket, max_frame: int = MAX_FRAME,
+                 buffer_size: int = INITIAL_BUFFER):
+        self.sock = sock
+        self.max_frame = max_frame
+        self._initial = buffer_size
+        self._buf = bytearray(buffer_size)
+        self._start = 0  # 還沒被讀走的資料 = _buf[_start:_end]
+        self._end = 0
+        self._scanned = 0  # _buf[_start:_scanned] 已經確定沒有換行
+        self.binary = False  # hello 協商成 binary framing 之後設成 True
+
+    def buffered(self) -> int:
+        return self._end - self._start
+
+    def _fill(self) -> int:
+        """至少收一次資料到 buffer 尾端，空間不夠就先搬到開頭或放大；回傳收到幾 bytes。"""
+        if self._end == len(self._buf):
+            pending = self._end - self._start
+            if self._start > 0:
+                self._buf[:pending] = self._buf[self._start:self._end]
+                self._scanned -= self._start
+                self._start, self._end = 0, pending
+            else:
+                self._buf.extend(bytes(len(self._buf)))
+        n = self.sock.recv_into(memoryview(self._buf)[self._end:])
+        self._end += n
+        return n
+
+    def _consumed(self):
+        if self._start == self._end:
+            self._start = self._end = self._scanned = 0
+            if len(self._buf) > self._initial:
+                # 收過大訊息之後縮回來，閒置連線不要一直佔著大 buffer
+                self._buf = bytearray(self._initial)
+
+    def _ensure(self, n: int) -> bool:
+        """讓 buffer 裡至少有 n bytes 還沒讀；連線先關掉就回傳 False。"""
+        while self._end - self._start < n:
+            if self._fill() == 0:
+                return False
+        return True
+
+    def _read_header(self):
+        if not self._ensure(HEADER.size):
+            return None
+        header = HEADER.unpack_from(self._buf, self._start)
+        self._start = self._scanned = self._start + HEADER.size
+        return header
+
+    def read_frame(self) -> Optional[bytes]:
+        """讀一個 JSON 訊息（文字模式是一行，不含 \\n）；對方關閉連線時回傳 None。"""
+        if self.binary:
+            return self._read_binary_frame()
+        while True:
+            i = self._buf.find(b"\n", max(self._scanned, self._start), self._end)
+            if i >= 0:
+                line = bytes(self._buf[self._start:i])
+                self._start = self._scanned = i + 1
+                self._consumed()
+                return line
+            self._scanned = self._end
+            if self._end - self._start > self.max_frame:
+                raise FrameTooLarge(f"frame exceeds {self.max_frame} bytes")
+            if self._fill() == 0:
+                return None
+
+    def _read_binary_frame(self) -> Optional[bytes]:
+        header = self._read_header()
+        if header is None:
+            return None
+        ftype, flags, _stream, length = header
+        if ftype != FRAME_JSON:
+            raise ConnectionError(f"unexpected frame type {ftype}")
+        if length > self.max_frame:
+            raise FrameTooLarge(f"frame exceeds {self.max_frame} bytes")
+        if not self._ensure(length):
+            return None
+        body = bytes(self._buf[self._start:self._start + length])
+        self._start = self._scanned = self._start + length
+        self._consumed()
+        if flags & FLAG_ZLIB:
+            body = inflate(body, self.max_frame)
+        return body
+
+    def iter_exact(self, size: int) -> Iterator[memoryview]:
+        """
+        收滿 size bytes 的檔案內容，一塊一塊 yield（先給 buffer 裡剩下的，之後直接 recv_into）。
+        binary framing 時內容是一連串 DATA frame，這裡會把 header 拿掉。
+        yield 出去的 memoryview 指向內部 buffer，下一次迭代時就會被 release，要先用完（例如寫進檔案）。
+        連線中途斷掉就丟 ConnectionError。
+        """
+        if not self.binary:
+            yield from self._iter_raw(size)
+            return
+        remaining = size
+        while remaining > 0:
+            header = self._read_header()
+            if header is None:
+                raise ConnectionError("connection closed while receiving file")
+            ftype, _flags, _stream, length = header
+            if ftype != FRAME_DATA or length > remaining:
+                raise ConnectionError("unexpected frame while receiving file")
+            yield from self._iter_raw(length)
+            remaining -= length
+
+    def _iter_raw(self, size: int) -> Iterator[memoryview]:
+        remaining = size
+        if self._start < self._end:
+            take = min(remaining, self._end - self._start)
+            with memoryview(self._buf)[self._start:self._start + take] as chunk:
+                yield chunk
+            self._start += take
+            self._scanned = max(self._scanned, self._start)
+            remaining -= take
+            self._consumed()
+
+        with memoryview(self._buf) as view:
+            while remaining > 0:
+                n = self.sock.recv_into(view, min(remaining, len(view)))
+                if n == 0:
+                    raise ConnectionError("connection closed while receiving file")
+                remaining -= n
+                with view[:n] as chunk:
+                    yield chunk
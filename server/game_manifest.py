@@ -0,0 +1,153 @@
+# server/game_manifest.py
+"""
+遊戲版本的檔案清單（manifest）與差異更新包（delta）。
+
+每次上架 / 更新遊戲時記下這個版本 zip 裡每個檔案的大小和 sha256：
+    uploaded_games/manifests/<game>/<version>.json   {"path": [size, sha256], ...}
+舊版本的 zip 在更新時就刪掉了，但 manifest 留著，之後玩家從舊版本更新時
+只要比對兩份 manifest 就知道哪些檔案新增 / 改過 / 刪掉，不需要舊的 zip。
+
+delta 包是一個 zip：只放新增或改過的檔案，再加一個 DELTA_INFO 記著
+from / to 版本、要刪掉的檔案和新版本完整的 manifest（client 用來檢查沒改的檔案）。
+同一組 (from, to) 只做一次，存在 uploaded_games/deltas/<game>/。
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import zipfile
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+UPLOAD_DIR = Path(__file__).parent / "uploaded_games"
+MANIFEST_DIR = UPLOAD_DIR / "manifests"
+DELTA_DIR = UPLOAD_DIR / "deltas"
+DELTA_INFO = ".delta.json"  # delta 包裡記錄資訊的檔名
+
+_VERSION_RE = re.compile(r"[A-Za-z0-9._-]+")
+
+_build_lock = threading.Lock()
+
+
+def valid_version(version) -> bool:
+    """
+    版本號會變成檔名的一部分（<game>_<version>.zip、manifests/<game>/<version>.json），
+    只接受英數字和 . _ -，而且不能有 ".."，不然玩家 / 開發者可以用 "../" 讀寫 uploaded_games 外面的檔案。
+    """
+    version = str(version)
+    return bool(_VERSION_RE.fullmatch(version)) and ".." not in version
+
+
+def _inside(root: Path, path: Path) -> Path:
+    """path resolve 之後一定要在 root 底下，不是就丟 ValueError。"""
+    resolved = path.resolve()
+    if not resolved.is_relative_to(root.resolve()):
+        raise ValueError(f"path escapes {root.name}: {path}")
+    return resolved
+
+
+def _manifest_path(game_name: str, version: str) -> Path:
+    return _inside(MANIFEST_DIR, MANIFEST_DIR / game_name / f"{version}.json")
+
+
+def build_manifest(zip_path: Path) -> Dict[str, List]:
+    """zip 裡每個檔案的 [大小, sha256]（資料夾不算）。"""
+    files = {}
+    with zipfile.ZipFile(zip_path, "r") as z:
+        for info in z.infolist():
+            if info.is_dir():
+                continue
+            h = hashlib.sha256()
+            with z.open(info) as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    h.update(block)
+            files[info.filename] = [info.file_size, h.hexdigest()]
+    return files
+
+
+def save_manifest(game_name: str, version: str, zip_path: Path) -> Dict[str, List]:
+    files = build_manifest(zip_path)
+    path = _manifest_path(game_name, version)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")  # 多 process 同時寫也不會互相蓋到
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(files, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    return files
+
+
+def load_manifest(game_name: str, version: str) -> Optional[Dict[str, List]]:
+    """
+    讀某個版本的 manifest；還沒有 manifest（這個功能之前上架的）但 zip 還在就現在補算。
+    都沒有回傳 None。路徑跑出 uploaded_games 就丟 ValueError。
+    """
+    path = _manifest_path(game_name, version)
+    try:
+        with path.open("r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    zip_path = _inside(UPLOAD_DIR, UPLOAD_DIR / f"{game_name}_{version}.zip")
+    if not zip_path.exists():
+        return None
+    try:
+        return save_manifest(game_name, version, zip_path)
+    except (OSError, zipfile.BadZipFile):
+        return None
+
+
+def remove_game(game_name: str):
+    """delete_game 時把這款遊戲的 manifest 和 delta 包都清掉。"""
+    for root in (MANIFEST_DIR, DELTA_DIR):
+        try:
+            path = _inside(root, root / game_name)
+        except ValueError:
+            continue
+        if path != root.resolve():  # game_name 是 "." 之類的不要把整個目錄刪掉
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def build_delta(game_name: str, from_version: str, to_version: str,
+                zip_path: Path) -> Optional[Tuple[Path, Dict]]:
+    """
+    從 from_version 更新到 to_version（zip_path 是新版本的 zip）的 delta 包；
+    回傳 (delta 包路徑, DELTA_INFO 的內容)，舊版本沒有 manifest 就回傳 None。
+    版本號不合法（見 valid_version）或路徑跑出 uploaded_games 就丟 ValueError。
+    """
+    if not (valid_version(from_version) and valid_version(to_version)):
+        raise ValueError("invalid version")
+    delta_path = _inside(DELTA_DIR, DELTA_DIR / game_name / f"{from_version}_to_{to_version}.zip")
+    with _build_lock:
+        if delta_path.exists() and delta_path.stat().st_mtime >= zip_path.stat().st_mtime:
+            with zipfile.ZipFile(delta_path, "r") as z:
+                return delta_path, json.loads(z.read(DELTA_INFO))
+
+        old = load_manifest(game_name, from_version)
+        new = load_manifest(game_name, to_version)
+        if old is None or new is None:
+            return None
+        changed = [p for p, entry in new.items() if old.get(p) != entry]
+        info = {
+            "from_version": from_version,
+            "to_version": to_version,
+            "deleted": sorted(p for p in old if p not in new),
+            "files": new,
+        }
+
+        delta_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = delta_path.with_suffix(f".{os.getpid()}.tmp")
+        with zipfile.ZipFile(zip_path, "r") as src, \
+                zipfile.ZipFile(tmp, "w", zipfile.ZIP_DEFLATED) as dst:
+            for name in changed:
+                src_info = src.getinfo(name)
+                dst_info = zipfile.ZipInfo(name, date_time=src_info.date_time)
+                dst_info.external_attr = src_info.external_attr
+                dst_info.compress_type = zipfile.ZIP_DEFLATED
+                dst_info.file_size = src_info.file_size  # 讓 zipfile 判斷要不要 zip64
+                with src.open(src_info) as r, dst.open(dst_info, "w") as w:
+                    shutil.copyfileobj(r, w, 1024 * 1024)
+            dst.writestr(DELTA_INFO, json.dumps(info, ensure_ascii=False))
+        os.replace(tmp, delta_path)
+        return delta_path, info
@@ -0,0 +1,431 @@
+# server/lobby_async.py
+"""
+asyncio 版的 lobby server：跟 lobby_server.py 共用同一套 handler 和房間資料，
+但一條連線只是一個 coroutine（不是一個 thread），閒置的連線幾乎不佔資源，
+一個 process 可以掛上萬條連線。
+
+    python lobby_async.py
+
+event loop 只負責收發訊息；會擋住的工作（讀寫資料、房間鎖、收上傳檔、解壓 zip）
+都丟到 executor 的 thread 裡做。下載用 loop.sendfile 直接從檔案送到 socket。
+"""
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+try:
+    import resource  # 只有 Unix 有
+except ImportError:
+    resource = None
+
+from dispatch import Request
+from framing import (
+    DATA_CHUNK,
+    FLAG_ZLIB,
+    FRAME_DATA,
+    FRAME_JSON,
+    HEADER,
+    INITIAL_BUFFER,
+    MAX_FRAME,
+    FrameTooLarge,
+    WireFormat,
+    inflate,
+)
+from lobby_server import (
+    HOST,
+    MAX_INFLIGHT_PER_CONN,
+    PIPELINE_SAFE_ACTIONS,
+    PORT,
+    DOWNLOAD_SOURCES,
+    WAIT_START_TIMEOUT,
+    _rooms_persister,
+    action_timing,
+    begin_wait_start,
+    body_with_request_id,
+    compression_stats,
+    dispatcher,
+    encode_body,
+    encode_message,
+    end_session,
+    finish_wait_start,
+    frame_body,
+    prepare_storage,
+    resp_err,
+    resp_ok,
+    response_cache,
+    room_events,
+    room_registry,
+    start_transfer_server,
+    stop_transfer_server,
+    update_subscription,
+    with_request_id,
+)
+from room_events import AsyncSubscriber
+
+# executor 的 thread 數：同時在做 blocking 工作的請求數上限，跟連線數無關
+ASYNC_WORKERS = int(os.environ.get("GAME_STORE_ASYNC_WORKERS", "32"))
+BACKLOG = 4096
+
+_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix="lobby-worker")
+
+
+async def _run(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+class _UploadSource:
+    """
+    developer 上傳時 handler 在 executor thread 裡呼叫 reader.iter_exact()（同 framing.FramedReader），
+    這裡把它轉成 event loop 上的 StreamReader.read()。
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, loop: asyncio.AbstractEventLoop, binary: bool):
+        self._reader = reader
+        self._loop = loop
+        self._binary = binary
+
+    def _await(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def iter_exact(self, size: int):
+        if not self._binary:
+            yield from self._iter_raw(size)
+            return
+        # binary framing：檔案內容是一連串 DATA frame
+        remaining = size
+        while remaining > 0:
+            try:
+                header = self._await(self._reader.readexactly(HEADER.size))
+            except asyncio.IncompleteReadError:
+                raise ConnectionError("connection closed while receiving file")
+            ftype, _flags, _stream, length = HEADER.unpack(header)
+            if ftype != FRAME_DATA or length > remaining:
+                raise ConnectionError("unexpected frame while receiving file")
+            yield from self._iter_raw(length)
+            remaining -= length
+
+    def _iter_raw(self, size: int):
+        remaining = size
+        while remaining > 0:
+            chunk = self._await(self._reader.read(min(remaining, INITIAL_BUFFER)))
+            if not chunk:
+                raise ConnectionError("connection closed while receiving file")
+            remaining -= len(chunk)
+            yield chunk
+
+
+class _Connection:
+    """一條連線的狀態；所有寫入都要拿 write_lock，房間事件才不會插進回覆或檔案中間。"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+        self.loop = asyncio.get_running_loop()
+        self.write_lock = asyncio.Lock()
+        self.role = None
+        self.user = None
+        self.subscriber = None
+        self.stashed = []  # wait_start 期間先收到的下一個請求
+        self.pending_read = None  # wait_start 留下來、還在讀下一個請求的 task
+        self.wire = WireFormat()  # hello 協商過才會壓縮 / 改用 binary framing
+
+    async def send(self, obj: Dict[str, Any]):
+        await self.send_body(encode_body(obj))
+
+    async def send_body(self, body: bytes):
+        """body 是已經編好的 JSON（例如快取裡的回覆）。"""
+        async with self.write_lock:
+            self.writer.write(frame_body(body, self.wire))
+            await self.writer.drain()
+
+    async def send_response(self, req: Request, resp):
+        """同 lobby_server._Session.send_response。"""
+        if isinstance(resp, bytes):
+            await self.send_body(body_with_request_id(resp, req.request_id))
+        elif resp is not None:
+            await self.send(with_request_id(resp, req.request_id))
+        for hook in req.after_send:
+            hook()
+
+    @property
+    def source(self) -> _UploadSource:
+        """developer 上傳時 handler（在 executor thread 裡）從這裡讀檔案內容。"""
+        return _UploadSource(self.reader, self.loop, self.wire.binary)
+
+    def apply_hello(self, resp: Dict[str, Any]):
+        self.wire.apply(resp)
+
+    async def read_message(self) -> bytes:
+        """下一個請求的 JSON bytes；連線關閉回傳 b""。"""
+        if self.stashed:
+            return self.stashed.pop(0)
+        if self.pending_read is not None:
+            task, self.pending_read = self.pending_read, None
+            return await task
+        return await self._read_message()
+
+    async def _read_message(self) -> bytes:
+        if not self.wire.binary:
+            return await self.reader.readline()
+        try:
+            header = await self.reader.readexactly(HEADER.size)
+            ftype, flags, _stream, length = HEADER.unpack(header)
+            if ftype != FRAME_JSON:
+                raise ConnectionError(f"unexpected frame type {ftype}")
+            if length > MAX_FRAME:
+                raise FrameTooLarge(f"frame exceeds {MAX_FRAME} bytes")
+            body = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return b""
+        return inflate(body, MAX_FRAME) if flags & FLAG_ZLIB else body
+
+    def drop_subscriber(self):
+        if self.subscriber is not None:
+            room_events.remove(self.subscriber)
+            self.subscriber = None
+
+
+async def wait_start(req: Request) -> Dict[str, Any]:
+    """
+    跟 lobby_server.wait_room_start 一樣，只是等待時不佔 thread：
+    同時等「房間開始 / 關掉」跟「連線斷掉」，哪個先發生就處理哪個。
+    """
+    c = req.session
+    resp, fut, room_id = await _run(begin_wait_start, req.payload)
+    if fut is None:
+        return resp
+
+    loop = asyncio.get_running_loop()
+    started_fut = asyncio.wrap_future(fut)
+    deadline = loop.time() + WAIT_START_TIMEOUT
+    try:
+        while True:
+            # 讀下一個請求的 task 不取消（binary frame 讀到一半取消會掉資料），
+            # 等完之後還沒讀到就留在 c.pending_read 給主迴圈接著等
+            if c.pending_read is None and not c.stashed:
+                c.pending_read = asyncio.ensure_future(c._read_message())
+            waiting = {started_fut} if c.pending_read is None else {started_fut, c.pending_read}
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return resp_err("wait_start timed out")
+            done, _ = await asyncio.wait(
+                waiting, timeout=remaining, return_when=asyncio.FIRST_COMPLETED
+            )
+            if started_fut in done:
+                return finish_wait_start(room_id, started_fut.result())
+            if c.pending_read in done:
+                task, c.pending_read = c.pending_read, None
+                try:
+                    line = task.result()
+                except (OSError, ValueError):
+                    line = b""
+                if not line:
+                    return resp_err("wait_start cancelled")
+                # client 先送了下一個請求：留給主迴圈處理，繼續等
+                c.stashed.append(line)
+    finally:
+        if not started_fut.done():
+            started_fut.cancel()
+        room_registry.remove_start_waiter(room_id, fut)
+
+
+async def download_game(req: Request):
+    """download_game / download_range / download_delta（要送哪個檔案見 DOWNLOAD_SOURCES）。"""
+    c, request_id = req.session, req.request_id
+    header, zip_path = await _run(DOWNLOAD_SOURCES[req.action], req.payload)
+    if not c.wire.binary or zip_path is None:
+        async with c.write_lock:
+            c.writer.write(encode_message(with_request_id(header, request_id), c.wire))
+            if zip_path is None:
+                await c.writer.drain()
+                return
+            try:
+                with zip_path.open("rb") as f:
+                    if header["length"]:
+                        await asyncio.get_running_loop().sendfile(
+                            c.writer.transport, f, header["offset"], header["length"]
+                        )
+                print(f"[DOWNLOAD] sent {zip_path} ({header['length']} bytes from {header['offset']})")
+            except Exception as e:
+                print(f"[DOWNLOAD] error sending file: {e}")
+        return
+
+    # binary framing：一個 DATA frame 拿一次 write_lock，中間可以插進事件和其他回覆
+    stream = header["stream"] = c.wire.next_stream()
+    await c.send(with_request_id(header, request_id))
+    loop = asyncio.get_running_loop()
+    try:
+        with zip_path.open("rb") as f:
+            offset, end = header["offset"], header["offset"] + header["length"]
+            while offset < end:
+                count = min(DATA_CHUNK, end - offset)
+                async with c.write_lock:
+                    c.writer.write(c.wire.data_header(stream, count))
+                    await loop.sendfile(c.writer.transport, f, offset, count)
+                offset += count
+        print(f"[DOWNLOAD] sent {zip_path} ({header['length']} bytes from {header['offset']})")
+    except Exception as e:
+        print(f"[DOWNLOAD] error sending file: {e}")
+
+
+async def subscription(req: Request) -> Dict[str, Any]:
+    c = req.session
+    if c.subscriber is None and req.action == "subscribe":
+        c.subscriber = AsyncSubscriber(c.send, asyncio.get_running_loop())
+        c.subscriber.start()
+    if c.subscriber is None:
+        return resp_ok("unsubscribed")
+    resp = await _run(update_subscription, c.subscriber, req.action, req.payload)
+    if not c.subscriber.topics:
+        # 停掉推送之後才回覆，client 收到回覆後就不會再有事件
+        c.drop_subscriber()
+    return resp
+
+
+async def logout(req: Request) -> Dict[str, Any]:
+    c = req.session
+    c.drop_subscriber()
+    if c.role and c.user:
+        await _run(end_session, c.role, c.user)
+        print(f"[LOGOUT] {c.role} {c.user}")
+        c.role = None
+        c.user = None
+    return resp_ok("logout success")
+
+
+# 這幾個動作要用到 event loop（推送、等房間開始、sendfile），換成 coroutine 版；
+# 其他動作連同 middleware 整個丟到 executor 跑 lobby_server 註冊的 handler
+dispatcher.override("system", "logout", logout)
+dispatcher.override("player", "download_game", download_game)
+dispatcher.override("system", "download_range", download_game)
+dispatcher.override("player", "download_delta", download_game)
+dispatcher.override("player", "subscribe", subscription)
+dispatcher.override("player", "unsubscribe", subscription)
+dispatcher.override("player", "wait_start", wait_start)
+
+
+async def dispatch(c: _Connection, req: Request):
+    resp = await dispatcher.dispatch_async(req, _run)
+    await c.send_response(req, resp)
+
+
+async def run_concurrent(c: _Connection, req: Request):
+    try:
+        await dispatch(c, req)
+    except OSError:
+        pass  # 連線已經斷了，client_loop 會收尾
+
+
+def _is_concurrent(c: _Connection, req: Request) -> bool:
+    """帶 request_id 的唯讀玩家請求可以平行處理，規則同 lobby_server.client_loop。"""
+    return (
+        req.request_id is not None
+        and req.role == "player"
+        and c.role == "player"
+        and req.action in PIPELINE_SAFE_ACTIONS
+    )
+
+
+async def client_loop(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    addr = writer.get_extra_info("peername")
+    print(f"[+] New connection from {addr}")
+    c = _Connection(reader, writer)
+    inflight = set()  # 平行處理中、還沒回覆的請求
+
+    try:
+        while True:
+            line = await c.read_message()
+            if not line:
+                print(f"[-] Client {addr} disconnected")
+                break
+            try:
+                msg = json.loads(line.decode("utf-8"))
+            except (UnicodeDecodeError, json.JSONDecodeError):
+                # 跟 threaded server 一樣，收到壞掉的訊息就斷線
+                break
+
+            if not isinstance(msg, dict):
+                await c.send(resp_err("invalid message format"))
+                continue
+
+            req = Request(msg, c)
+            if _is_concurrent(c, req):
+                if len(inflight) >= MAX_INFLIGHT_PER_CONN:
+                    await asyncio.wait(inflight, return_when=asyncio.FIRST_COMPLETED)
+                task = asyncio.create_task(run_concurrent(c, req))
+                inflight.add(task)
+                task.add_done_callback(inflight.discard)
+                continue
+            # 其他請求照順序：先等之前平行處理的請求都回覆完
+            if inflight:
+                await asyncio.wait(inflight)
+
+            await dispatch(c, req)
+
+    except (OSError, ValueError) as e:
+        # ValueError：單行超過 MAX_FRAME
+        print(f"[!] Error with client {addr}: {e}")
+    except Exception as e:
+        print(f"[!] Error with client {addr}: {e}")
+    finally:
+        for task in inflight:
+            task.cancel()
+        if c.pending_read is not None:
+            c.pending_read.cancel()
+        c.drop_subscriber()
+        if c.role and c.user:
+            # 斷線時也要把人從房間跟在線列表拿掉
+            await _run(end_session, c.role, c.user)
+        writer.close()
+        print(f"[+] Connection with {addr} closed")
+
+
+def _raise_fd_limit():
+    """把可開的檔案數調到 hard limit，一條連線就是一個 fd。"""
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+async def serve(sock=None):
+    if sock is not None:
+        server = await asyncio.start_server(client_loop, sock=sock, limit=MAX_FRAME)
+    else:
+        server = await asyncio.start_server(
+            client_loop, HOST, PORT, limit=MAX_FRAME, backlog=BACKLOG, reuse_address=True
+        )
+    print(f"[SERVER] (asyncio) Listening on {HOST}:{PORT}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(sock=None, transfer_sock=None):
+    """
+    sock / transfer_sock 給已經 listen 的 socket（lobby_cluster 的 worker）；
+    不給就自己開 HOST:PORT 和資料通道的 port（資料通道用 thread pool，見 transfer_server.py）。
+    """
+    _raise_fd_limit()
+    prepare_storage()
+    start_transfer_server(transfer_sock)
+    try:
+        asyncio.run(serve(sock))
+    except KeyboardInterrupt:
+        print("\n[SERVER] Shutting down...")
+    finally:
+        print(f"[SERVER] compression: {compression_stats.snapshot()}")
+        print(f"[SERVER] response cache: {response_cache.stats()}")
+        print(f"[SERVER] actions: {action_timing.snapshot()}")
+        _executor.shutdown(wait=False)
+        stop_transfer_server()
+        _rooms_persister.close()
+
+
+if __name__ == "__main__":
+    main()
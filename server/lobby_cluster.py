@@ -0,0 +1,293 @@
+# server/lobby_cluster.py
+"""
+多 process 版的 lobby server：一個 supervisor 開 N 個 worker process，
+大家用 SO_REUSEPORT 共用同一個 port，由 kernel 把新連線分給各個 worker，
+JSON 編解碼不再被單一 process 的 GIL 卡住。
+
+    GAME_STORE_ENGINE=sqlite python lobby_cluster.py --workers 4 [--async]
+
+必須是全域唯一的狀態放在另一個 coordinator process：
+  - 在線名單（同一個帳號只能登入一次）
+  - 房間（成員、ready、開始遊戲、開遊戲 server 也都在 coordinator 做）
+  - 評價統計
+worker 透過 multiprocessing.managers 的 proxy 呼叫 coordinator（見 lobby_server.COORDINATED_ACTIONS），
+房間事件則由 worker 的 pump thread 長輪詢拿回來，再推給自己這邊有訂閱的連線。
+遊戲目錄每次讀取都會比對版本（db_server.load_games），所以各個 worker 自然一致。
+
+帳號、評價、遊玩紀錄要所有 process 看到同一份，只有 sqlite 引擎做得到，
+所以這個模式必須搭配 GAME_STORE_ENGINE=sqlite（json 資料先用 sqlite_store.py migrate 匯入）。
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from multiprocessing.managers import BaseManager
+from typing import Any, Dict, List
+
+import lobby_server
+import transfer_server
+from db_server import STORAGE_ENGINE, rebuild_rating_stats
+
+POLL_TIMEOUT = 5.0  # worker 長輪詢事件時每次最多等幾秒
+COORDINATOR_START_TIMEOUT = 30
+
+
+class Coordinator:
+    """
+    在 coordinator process 裡持有唯一一份房間 / 在線名單 / 評價統計。
+    worker 透過 proxy 呼叫這些方法，每個呼叫在 manager 的 thread 裡執行，
+    底下直接用 lobby_server 原本的 handler（這個 process 的 _coordinator 是 None）。
+    """
+
+    def __init__(self):
+        # 鎖的順序：房間鎖 -> ... -> self._cond（_fan_out 會在持有房間鎖時被呼叫），
+        # 所以持有 self._cond 時不能呼叫任何 lobby_server 的 handler
+        self._cond = threading.Condition()
+        self._queues: Dict[int, deque] = {}  # worker_id -> 還沒被拿走的事件
+        self._sessions: Dict[int, set] = {}  # worker_id -> {(role, username)}
+        lobby_server.room_events.add_sink(self._fan_out)
+
+    def _fan_out(self, event: Dict[str, Any]):
+        with self._cond:
+            for q in self._queues.values():
+                q.append(event)
+            self._cond.notify_all()
+
+    # ---------- worker 管理 ----------
+
+    def register_worker(self, worker_id: int):
+        with self._cond:
+            self._queues[worker_id] = deque()
+            self._sessions.setdefault(worker_id, set())
+
+    def worker_exit(self, worker_id: int):
+        """worker 掛掉時由 supervisor 呼叫：那個 worker 上的人全部當作斷線。"""
+        with self._cond:
+            self._queues.pop(worker_id, None)
+            sessions = self._sessions.pop(worker_id, set())
+        for role, username in sessions:
+            lobby_server.end_session(role, username)
+        return len(sessions)
+
+    def poll_events(self, worker_id: int, timeout: float) -> List[Dict[str, Any]]:
+        with self._cond:
+            q = self._queues.get(worker_id)
+            if q is None:
+                return []
+            if not q:
+                self._cond.wait(timeout)
+            events = list(q)
+            q.clear()
+        return events
+
+    # ---------- 在線名單 ----------
+
+    def claim_online(self, group_key: str, username: str, worker_id: int) -> bool:
+        if not lobby_server.claim_online(group_key, username):
+            return False
+        role = "player" if group_key == "players" else "developer"
+        with self._cond:
+            self._sessions.setdefault(worker_id, set()).add((role, username))
+        return True
+
+    def end_session(self, role: str, username: str):
+        with self._cond:
+            for sessions in self._sessions.values():
+                sessions.discard((role, username))
+        lobby_server.end_session(role, username)
+
+    # ---------- 房間 ----------
+
+    def player_action(self, action: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        return lobby_server.handle_player_action(action, payload)
+
+    def begin_wait_start(self, payload: Dict[str, Any]):
+        """標記 ready；已經開始或有錯就回傳回覆，要繼續等則回傳 None（由 worker 自己等事件）。"""
+        resp, fut, room_id = lobby_server.begin_wait_start(payload)
+        if fut is not None:
+            lobby_server.room_registry.remove_start_waiter(room_id, fut)
+        return resp
+
+    def subscription_snapshot(self, topic) -> Dict[str, Any]:
+        return lobby_server.subscription_snapshot(tuple(topic))
+
+
+_coordinator = None
+
+
+def _get_coordinator() -> Coordinator:
+    global _coordinator
+    if _coordinator is None:
+        _coordinator = Coordinator()
+    return _coordinator
+
+
+class CoordinatorManager(BaseManager):
+    pass
+
+
+CoordinatorManager.register("Coordinator", callable=_get_coordinator)
+
+
+def _run_coordinator(address: str, authkey: bytes, ready):
+    # supervisor 用 SIGTERM 叫我們結束；變成 SystemExit，serve_forever 才會正常收尾
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    rebuild_rating_stats()
+    _get_coordinator()
+    server = CoordinatorManager(address=address, authkey=authkey).get_server()
+    print(f"[CLUSTER] coordinator ready (pid {os.getpid()})")
+    ready.set()
+    try:
+        server.serve_forever()
+    finally:
+        lobby_server._rooms_persister.close()
+
+
+def _pump_events(coordinator, worker_id: int):
+    """把 coordinator 轉來的房間事件交給本地的 waiter 和訂閱者。"""
+    while True:
+        try:
+            events = coordinator.poll_events(worker_id, POLL_TIMEOUT)
+        except (EOFError, OSError) as e:
+            print(f"[CLUSTER] worker {worker_id} lost coordinator: {e}")
+            return
+        for event in events:
+            room_id = event["room_id"]
+            if event["event"] == "room_started":
+                room = event["room"]
+                lobby_server.room_registry.wake_start_waiters(room_id, {
+                    "game_name": room.get("game_name", ""),
+                    "version": str(room.get("version", "0")),
+                    "players": list(room.get("players", [])),
+                })
+            elif event["event"] == "room_closed":
+                lobby_server.room_registry.wake_start_waiters(room_id, None)
+            lobby_server.room_events.dispatch(event)
+
+
+def _listen_socket() -> socket.socket:
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    srv.bind((lobby_server.HOST, lobby_server.PORT))
+    srv.listen(4096)
+    return srv
+
+
+def _run_worker(worker_id: int, address: str, authkey: bytes, use_async: bool):
+    # supervisor 用 SIGTERM 停 worker，當成 Ctrl+C 處理，server 的主迴圈才會正常收尾
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    manager = CoordinatorManager(address=address, authkey=authkey)
+    manager.connect()
+    coordinator = manager.Coordinator()
+    # 先登記事件佇列再開始收連線，之後的房間事件一定收得到
+    coordinator.register_worker(worker_id)
+    lobby_server.use_coordinator(coordinator, worker_id)
+    threading.Thread(
+        target=_pump_events, args=(coordinator, worker_id), name="cluster-events", daemon=True
+    ).start()
+
+    srv = _listen_socket()
+    # 資料通道也是每個 worker 各開一個、共用同一個 port
+    try:
+        transfer_srv = transfer_server.listen(lobby_server.HOST, reuse_port=True)
+    except OSError as e:
+        print(f"[CLUSTER] worker {worker_id} cannot open transfer port: {e}")
+        transfer_srv = None
+    print(f"[CLUSTER] worker {worker_id} (pid {os.getpid()}) serving")
+    if use_async:
+        import lobby_async
+
+        lobby_async.main(srv, transfer_srv)
+    else:
+        lobby_server.main(srv, transfer_srv)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="multi-process game store lobby")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run each worker with the asyncio server (lobby_async.py)")
+    args = parser.parse_args()
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+    if not hasattr(socket, "SO_REUSEPORT"):
+        sys.exit("[CLUSTER] SO_REUSEPORT is not available on this platform, use lobby_server.py")
+    if STORAGE_ENGINE != "sqlite":
+        sys.exit(
+            "[CLUSTER] multi-process mode needs GAME_STORE_ENGINE=sqlite "
+            "(import json data first: python sqlite_store.py migrate)"
+        )
+
+    # spawn：每個 process 都從頭 import，不會繼承 supervisor 的 thread / lock 狀態
+    ctx = multiprocessing.get_context("spawn")
+    run_dir = tempfile.mkdtemp(prefix="game-store-")
+    address = os.path.join(run_dir, "coordinator.sock")
+    authkey = os.urandom(32)
+    # 下載票的簽名 key：每個 worker 都要一樣，哪個 worker 發的票其他 worker 才認得
+    os.environ.setdefault("GAME_STORE_TICKET_SECRET", os.urandom(32).hex())
+
+    ready = ctx.Event()
+    coordinator_proc = ctx.Process(
+        target=_run_coordinator, args=(address, authkey, ready), name="coordinator"
+    )
+    coordinator_proc.start()
+    if not ready.wait(COORDINATOR_START_TIMEOUT):
+        coordinator_proc.terminate()
+        shutil.rmtree(run_dir, ignore_errors=True)
+        sys.exit("[CLUSTER] coordinator failed to start")
+
+    manager = CoordinatorManager(address=address, authkey=authkey)
+    manager.connect()
+    coordinator = manager.Coordinator()
+
+    def start_worker(worker_id: int):
+        p = ctx.Process(
+            target=_run_worker, args=(worker_id, address, authkey, args.use_async),
+            name=f"lobby-worker-{worker_id}",
+        )
+        p.start()
+        return p
+
+    workers = {worker_id: start_worker(worker_id) for worker_id in range(args.workers)}
+    print(f"[CLUSTER] {args.workers} workers on {lobby_server.HOST}:{lobby_server.PORT}")
+
+    try:
+        while True:
+            time.sleep(1.0)
+            if not coordinator_proc.is_alive():
+                print("[CLUSTER] coordinator exited, shutting down")
+                break
+            for worker_id, p in list(workers.items()):
+                if p.is_alive():
+                    continue
+                # worker 上的人都斷線了，先把他們從房間跟在線名單拿掉再重開
+                dropped = coordinator.worker_exit(worker_id)
+                print(f"[CLUSTER] worker {worker_id} exited ({p.exitcode}), "
+                      f"dropped {dropped} sessions, restarting")
+                workers[worker_id] = start_worker(worker_id)
+    except KeyboardInterrupt:
+        print("\n[CLUSTER] Shutting down...")
+    finally:
+        for p in workers.values():
+            if p.is_alive():
+                p.terminate()
+        for p in workers.values():
+            p.join(5)
+            if p.is_alive():
+                p.kill()
+        if coordinator_proc.is_alive():
+            coordinator_proc.terminate()  # SIGTERM：會先把房間資料寫出去
+        coordinator_proc.join(10)
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
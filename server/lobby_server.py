@@ -1,24 +1,55 @@
 import socket
 import threading
 import json
+import hashlib
 from typing import Dict, Any
 import os, sys
+import select
 import subprocess 
 import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import nullcontext
 from datetime import datetime
 
 from db_server import (
-    load_accounts,
-    save_accounts,
+    get_account,
+    register_account,
     load_games,
-    load_rooms,
-    save_rooms,
-    load_ratings,
-    save_ratings,
-    load_history,
-    save_history,
+    rooms_persister,
+    append_rating,
+    get_rating_summary,
+    get_rating_summaries,
+    get_ratings_page,
+    rebuild_rating_stats,
+    get_history,
+    games_version,
+    increment_play_count,
+    json_default,
+    ratings_version,
 )
-from developer_server import handle_developer_action
+import download_tickets
+import game_manifest
+import transfer_server
+from developer_server import (
+    delete_game,
+    issue_upload_ticket,
+    list_my_games,
+    receive_upload,
+    update_game,
+    upload_game,
+)
+from dispatch import Auth, Dispatcher, ErrorMapping, Middleware, Request, Timing, Validate
+from response_cache import ResponseCache
+from framing import (
+    COMPRESS_MIN,
+    DATA_CHUNK,
+    FramedReader,
+    WireFormat,
+    compression_stats,
+    negotiate,
+)
+from room_events import RoomEventHub, Subscriber, room_snapshot
+from room_registry import RoomRegistry
 from pathlib import Path
 
 UPLOAD_DIR = Path(__file__).parent / "uploaded_games"
@@ -27,61 +58,147 @@ sys.path.append(os.path.dirname(__file__))
 HOST = "0.0.0.0"
 PORT = 7070
 
-accounts_lock = threading.Lock()  # 帳號資料鎖
-accounts: Dict[str, Any] = load_accounts()  # 載入帳號資料
+WAIT_START_TIMEOUT = 600  # wait_start 最多等幾秒
+WAIT_START_CHECK_INTERVAL = 1.0  # 等待時多久檢查一次連線是否斷了
+
+# 帶 request_id 的唯讀請求可以平行處理（回覆可能不照順序，client 用 request_id 對應），
+# 其他請求一律等同一條連線先前的請求都回覆完才處理，保持原本的順序語意
+PIPELINE_SAFE_ACTIONS = frozenset({
+    "list_games",
+    "game_info",
+    "list_rooms",
+    "room_info",
+    "room_players",
+    "list_online_users",
+    "my_history",
+    "get_game_ratings",
+    "get_game_ratings_page",
+    "batch",
+})
+# batch 裡可以放的動作：只限唯讀的
+BATCH_ACTIONS = PIPELINE_SAFE_ACTIONS - {"batch"}
+BATCH_MAX = 100  # 一個 batch 最多幾個請求
+REQUEST_WORKERS = int(os.environ.get("GAME_STORE_REQUEST_WORKERS", "16"))
+MAX_INFLIGHT_PER_CONN = 32  # 一條連線同時在跑的平行請求上限
+_request_pool = ThreadPoolExecutor(max_workers=REQUEST_WORKERS, thread_name_prefix="lobby-request")
+
+# 這些唯讀請求的回覆編好 JSON 之後放進快取（見 _CachedReplies），
+# key 帶著資料版本：遊戲目錄 games_version()、評價 ratings_version()、在線名單 _online_version
+CACHED_ACTIONS = frozenset({"list_games", "game_info", "get_game_ratings", "list_online_users"})
+response_cache = ResponseCache(
+    max_entries=int(os.environ.get("GAME_STORE_RESPONSE_CACHE", "1024")),
+    max_bytes=int(os.environ.get("GAME_STORE_RESPONSE_CACHE_BYTES", str(32 * 1024 * 1024))),
+)
 
 online_users_lock = threading.Lock()  # 在線使用者鎖
 online_users = {
     "players": set(),
     "developers": set(),
 }
-
-rooms_lock = threading.Lock()  # 遊戲房間鎖
-
-_rooms_raw = load_rooms()
-rooms: Dict[int, Dict[str, Any]] = {}
-next_room_id = 1
+_online_version = 0  # 在線名單每次變動就 +1（要拿 online_users_lock）
+
+# 房間資料與索引（(game_name, status) / username -> room_ids）都在 registry 裡，
+# 修改房間一律透過 registry 的方法，索引才不會跟資料不一致；
+# 每次變動都會發事件給 room_events，推送給有訂閱的連線。
+# 每個房間有自己的鎖（room_registry.locked(room_id)），不同房間互不影響，
+# 鎖的順序見 room_registry.py。
+room_events = RoomEventHub()
+room_registry = RoomRegistry(on_event=room_events.publish)
+
+# 多 process 模式（lobby_cluster.py）：房間、在線名單、評價統計只在 coordinator process 有一份，
+# worker 收到這些動作就轉給 coordinator；商城、下載、上傳等其他動作在 worker 自己做。
+COORDINATED_ACTIONS = frozenset({
+    "list_online_users",
+    "create_room",
+    "list_rooms",
+    "join_room",
+    "start_game",
+    "room_players",
+    "leave_room",
+    "room_info",
+    "reset_room",
+    "add_rating",
+    "get_game_ratings",
+})
+_coordinator = None  # worker 裡是 coordinator 的 proxy，單一 process 時是 None
+_worker_id = None
+
+
+def use_coordinator(coordinator, worker_id: int):
+    """lobby_cluster 的 worker 啟動時呼叫，之後共用的狀態都交給 coordinator。"""
+    global _coordinator, _worker_id
+    _coordinator = coordinator
+    _worker_id = worker_id
+
+
+def prepare_storage():
+    """server 啟動時呼叫：重建評價統計（多 process 模式下由 coordinator 負責）。"""
+    if _coordinator is None:
+        rebuild_rating_stats()
 
 def record_play_history(players, game_name: str):
     """
     在 history.json 裡記錄：這些 players 玩過 game_name 一次。
     """
-    #history.json -> 紀錄玩家玩遊戲次數
+    #history.json -> 紀錄玩家玩遊戲次數（append 到 journal）
     if not players:
         return
-    history = load_history()
-    changed = False
-    for p in players:
-        games = history.setdefault(p, {})
-        count = int(games.get(game_name, 0))
-        games[game_name] = count + 1
-        changed = True
-    if changed:
-        save_history(history)
+    increment_play_count(players, game_name)
+
+# 只在真正寫檔時才複製一次房間資料
+_rooms_persister = rooms_persister(room_registry.snapshot_all)
+
 
 def _save_rooms():
-    save_rooms(rooms)
+    # 只標記 dirty，由 db_server 的 write-behind thread 合併後寫檔
+    _rooms_persister.mark_dirty()
 
 # 處理 JSON 傳輸
-def send_json(conn: socket.socket, obj: Dict[str, Any]):
-    data = json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n"
-    conn.sendall(data)
+def encode_body(obj: Dict[str, Any]) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, default=json_default).encode("utf-8")
 
 
-# 接收 JSON 訊息
-def recv_json(conn: socket.socket):
-    buf = b""
-    while True:
-        chunk = conn.recv(4096)  # 每次接收最多 4096 bytes
-        if not chunk:
-            return None
-        buf += chunk
-        if b"\n" in buf:
-            line, buf = buf.split(b"\n", 1)
-            try:
-                return json.loads(line.decode("utf-8"))
-            except json.JSONDecodeError:
-                return None
+def frame_body(body: bytes, wire: WireFormat = None) -> bytes:
+    """body 是編好的 JSON；wire 是這條連線 hello 協商的格式（None = 一行 JSON、不壓縮）。"""
+    return body + b"\n" if wire is None else wire.encode(body)
+
+
+def encode_message(obj: Dict[str, Any], wire: WireFormat = None) -> bytes:
+    return frame_body(encode_body(obj), wire)
+
+
+def send_json(conn: socket.socket, obj: Dict[str, Any], wire: WireFormat = None):
+    conn.sendall(encode_message(obj, wire))
+
+
+def handle_hello(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """連線後的能力協商；回覆送出去之後呼叫端再用 WireFormat.apply 切換格式。"""
+    return resp_ok("hello", compress_min=COMPRESS_MIN, **negotiate(payload))
+
+
+# 接收 JSON 訊息（reader 是這條連線的 FramedReader，多收到的 bytes 會留給下一次）
+def recv_json(reader: FramedReader):
+    line = reader.read_frame()
+    if line is None:
+        return None
+    try:
+        return json.loads(line)
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        return None
+
+
+def with_request_id(resp: Dict[str, Any], request_id) -> Dict[str, Any]:
+    """請求有帶 request_id 就原封不動放回回覆裡（不改動 resp 本身）。"""
+    if request_id is None:
+        return resp
+    return {**resp, "request_id": request_id}
+
+
+def body_with_request_id(body: bytes, request_id) -> bytes:
+    """同 with_request_id，但回覆已經編成 JSON bytes（快取裡的）：直接接在最後一個 } 前面。"""
+    if request_id is None:
+        return body
+    return b"%s,\"request_id\":%s}" % (body[:-1], encode_body(request_id))
 
 
 # 回傳成功訊息
@@ -112,13 +229,9 @@ def handle_register(payload: Dict[str, Any]):
 
     group_key = "players" if role == "player" else "developers"
 
-    # 檢查帳號是否已經存在
-    with accounts_lock:
-        group = accounts.setdefault(group_key, {})
-        if username in group:
-            return resp_err("username already exists")
-        group[username] = {"password": password}
-        save_accounts(accounts)
+    # 檢查帳號是否已經存在（存在就不會寫入）
+    if not register_account(group_key, username, {"password": password}):
+        return resp_err("username already exists")
 
     return resp_ok("registered successfully")
 
@@ -138,23 +251,31 @@ def handle_login(payload: Dict[str, Any]):
     group_key = "players" if role == "player" else "developers"
 
     # 檢查帳號密碼
-    with accounts_lock:
-        group = accounts.setdefault(group_key, {})
-        user = group.get(username)
-
-        if not user:
-            return resp_err("username does not exist")
-        if user.get("password") != password:
-            return resp_err("invalid username or password")
+    user = get_account(group_key, username)
+    if not user:
+        return resp_err("username does not exist")
+    if user.get("password") != password:
+        return resp_err("invalid username or password")
 
     # 檢查是否已經登入
+    if not claim_online(group_key, username):
+        return resp_err("user already logged in")
+
+    return resp_ok("login success", role=role, username=username)
+
+
+def claim_online(group_key: str, username: str) -> bool:
+    """把使用者加進在線列表；已經在線就回傳 False。"""
+    global _online_version
+    if _coordinator is not None:
+        return _coordinator.claim_online(group_key, username, _worker_id)
     with online_users_lock:
         online_set = online_users[group_key]
         if username in online_set:
-            return resp_err("user already logged in")
+            return False
         online_set.add(username)
-
-    return resp_ok("login success", role=role, username=username)
+        _online_version += 1
+    return True
 
 
 ### 玩家功能及遊戲大廳
@@ -189,37 +310,25 @@ def create_room(payload: Dict[str, Any]) -> Dict[str, Any]:
     # 紀錄遊戲版本
     game_version = str(game_info.get("version", "0"))
 
-    global next_room_id
-    with rooms_lock:
-        room_id = next_room_id
-        next_room_id += 1
-        rooms[room_id] = {
-            "id": room_id,
-            "host": username,
-            "game_name": game_name,
-            "players": [username],
-            "status": "waiting",
-            "min_players": min_players,
-            "max_players": max_players,
-            "version": game_version,
-            "ready_players": [username],
-        }
-
-        _save_rooms()
+    room = room_registry.create({
+        "host": username,
+        "game_name": game_name,
+        "players": [username],
+        "status": "waiting",
+        "min_players": min_players,
+        "max_players": max_players,
+        "version": game_version,
+        "ready_players": [username],
+    })
+    room_id = room["id"]
+    _save_rooms()
 
     return resp_ok("room created", room_id=room_id, game_name=game_name)
 
 
 def list_rooms(game_name=None) -> Dict[str, Any]:
     # 顯示該遊戲還未開始的房間
-    with rooms_lock:
-        result = []
-        for r in rooms.values():
-            if r.get("status") != "waiting":
-                continue
-            if game_name and r.get("game_name") != game_name:
-                continue
-            result.append(r)
+    result = room_registry.find("waiting", game_name)
     return resp_ok("room list", rooms=result)
 
 
@@ -235,8 +344,7 @@ def join_room(payload: Dict[str, Any]) -> Dict[str, Any]:
     except ValueError:
         return resp_err("invalid room_id")
 
-    with rooms_lock:
-        room = rooms.get(room_id)
+    with room_registry.locked(room_id) as room:
         if not room:
             return resp_err("room not found")
 
@@ -250,7 +358,7 @@ def join_room(payload: Dict[str, Any]) -> Dict[str, Any]:
         if len(room["players"]) >= max_players:
             return resp_err("room full")
 
-        room["players"].append(username)
+        room_registry.add_player(room, username)
         _save_rooms()
 
     return resp_ok("join room success", room_id=room_id)
@@ -327,8 +435,7 @@ def start_room_game(payload: Dict[str, Any]) -> Dict[str, Any]:
     except ValueError:
         return resp_err("invalid room_id")
 
-    with rooms_lock:
-        room = rooms.get(room_id)
+    with room_registry.locked(room_id) as room:
         if not room:
             return resp_err("room not found")
 
@@ -353,7 +460,7 @@ def start_room_game(payload: Dict[str, Any]) -> Dict[str, Any]:
         game_version = str(room.get("version", "0"))
 
         #開始遊戲後 -> 標記房間正在玩
-        room["status"] = "playing"
+        room_registry.set_status(room, "playing")
         _save_rooms()
 
     #離開log再啟動遊戲
@@ -383,8 +490,7 @@ def room_players(payload: Dict[str, Any]) -> Dict[str, Any]:
     except ValueError:
         return resp_err("invalid room_id")
 
-    with rooms_lock:
-        room = rooms.get(room_id)
+    with room_registry.locked(room_id) as room:
         if not room:
             return resp_err("room not found")
         players = list(room.get("players", []))
@@ -404,80 +510,123 @@ def leave_room(payload: Dict[str, Any]) -> Dict[str, Any]:
     except ValueError:
         return resp_err("invalid room_id")
 
-    with rooms_lock:
-        room = rooms.get(room_id)
+    with room_registry.locked(room_id) as room:
         if not room:
             return resp_err("room not found")
 
         if username not in room.get("players", []):
             return resp_err("not in room")
 
-        room["players"].remove(username)
-        ready = room.get("ready_players", [])
-        if username in ready:
-            ready.remove(username)
-
         # 房主離開：如果還有其他人，交給下一個；沒人就關房
-        if room.get("host") == username:
-            if room["players"]:
-                room["host"] = room["players"][0]
-            else:
-                del rooms[room_id]
-                _save_rooms()
-                return resp_ok("left room and room closed", room_id=room_id)
-
+        closed = room_registry.remove_player(room, username)
         _save_rooms()
+        if closed:
+            return resp_ok("left room and room closed", room_id=room_id)
 
     return resp_ok("left room", room_id=room_id)
 
-def wait_room_start(payload: Dict[str, Any]) -> Dict[str, Any]:
+def _peer_closed(conn: socket.socket) -> bool:
+    """不阻塞地檢查對方是不是已經斷線（只 peek，不會吃掉資料）。"""
+    try:
+        readable, _, _ = select.select([conn], [], [], 0)
+        if not readable:
+            return False
+        return conn.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
+
+
+def begin_wait_start(payload: Dict[str, Any]):
+    """
+    wait_start 的前半段：把玩家標記成 ready。
+    回傳 (resp, None, room_id) 代表可以直接回覆；
+    回傳 (None, fut, room_id) 代表要等 fut（房間 playing 或被關掉時會被叫醒），
+    等完之後交給 finish_wait_start()。
+    """
     username = payload.get("username")
     room_id = payload.get("room_id")
 
     if not username or room_id is None:
-        return resp_err("missing username or room_id")
+        return resp_err("missing username or room_id"), None, room_id
 
     try:
         room_id = int(room_id)
     except ValueError:
-        return resp_err("invalid room_id")
+        return resp_err("invalid room_id"), None, room_id
+
+    if _coordinator is not None:
+        # 房間在 coordinator；開始 / 關房事件轉到這個 worker 時會叫醒本地的 waiter。
+        # 先登記 waiter 再請 coordinator 標記 ready，中間房間剛好開始也不會漏掉
+        fut = room_registry.add_start_waiter(room_id)
+        resp = _coordinator.begin_wait_start(payload)
+        if resp is not None:
+            room_registry.remove_start_waiter(room_id, fut)
+            return resp, None, room_id
+        return None, fut, room_id
 
     # 先把這個玩家標記成 ready
-    with rooms_lock:
-        room = rooms.get(room_id)
+    with room_registry.locked(room_id) as room:
         if not room:
-            return resp_err("room not found")
+            return resp_err("room not found"), None, room_id
 
         if username not in room.get("players", []):
-            return resp_err("not in room")
+            return resp_err("not in room"), None, room_id
 
-        ready = room.setdefault("ready_players", [])
-        if username not in ready:
-            ready.append(username)
-
-        version = str(room.get("version", "0"))
-
-    # 然後開始「長輪詢」：等到房間變成 playing 才回覆
-    while True:
-        with rooms_lock:
-            room = rooms.get(room_id)
-            if not room:
-                return resp_err("room closed")
-            status = room.get("status", "waiting")
-            players = list(room.get("players", []))
-            game_name = room.get("game_name", "")
-            version = str(room.get("version", "0"))
-
-        if status == "playing":
-            return resp_ok(
+        room_registry.mark_ready(room, username)
+
+        if room.get("status") == "playing":
+            resp = resp_ok(
                 "game started",
                 room_id=room_id,
-                game_name=game_name,
-                version=version,
-                players=players,
+                game_name=room.get("game_name", ""),
+                version=str(room.get("version", "0")),
+                players=list(room.get("players", [])),
             )
+            return resp, None, room_id
+
+        # 房間變成 playing 或被關掉時 registry 會直接叫醒這個 future
+        return None, room_registry.add_start_waiter(room_id), room_id
 
-        time.sleep(0.3)  # 不要瘋狂佔 CPU
+
+def finish_wait_start(room_id: int, started) -> Dict[str, Any]:
+    if started is None:
+        return resp_err("room closed")
+
+    return resp_ok(
+        "game started",
+        room_id=room_id,
+        game_name=started["game_name"],
+        version=started["version"],
+        players=started["players"],
+    )
+
+
+def wait_room_start(payload: Dict[str, Any], cancelled=None) -> Dict[str, Any]:
+    """
+    把玩家標記成 ready，然後等房主開始遊戲。
+    cancelled() 回傳 True 時（例如連線斷了）就放棄等待。
+    """
+    resp, fut, room_id = begin_wait_start(payload)
+    if fut is None:
+        return resp
+
+    deadline = time.monotonic() + WAIT_START_TIMEOUT
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return resp_err("wait_start timed out")
+            try:
+                # 每隔一段時間醒來看一下連線還在不在；開始遊戲則是立刻被叫醒
+                started = fut.result(timeout=min(remaining, WAIT_START_CHECK_INTERVAL))
+                break
+            except FutureTimeout:
+                if cancelled is not None and cancelled():
+                    return resp_err("wait_start cancelled")
+    finally:
+        room_registry.remove_start_waiter(room_id, fut)
+
+    return finish_wait_start(room_id, started)
 
 
 def room_info(payload: Dict[str, Any]) -> Dict[str, Any]:
@@ -490,8 +639,7 @@ def room_info(payload: Dict[str, Any]) -> Dict[str, Any]:
     except ValueError:
         return resp_err("invalid room_id")
 
-    with rooms_lock:
-        room = rooms.get(room_id)
+    with room_registry.locked(room_id) as room:
         if not room:
             return resp_err("room not found")
 
@@ -520,16 +668,18 @@ def reset_room(payload: Dict[str, Any]) -> Dict[str, Any]:
     except ValueError:
         return resp_err("invalid room_id")
 
-    with rooms_lock:
-        room = rooms.get(room_id)
+    with room_registry.locked(room_id) as room:
         if not room:
             return resp_err("room not found")
 
         if room.get("host") != username:
             return resp_err("only host can reset the room")
 
-        room["status"] = "waiting"
         room["ready_players"] = [username]  # 房主維持 ready
+        if room.get("status") != "waiting":
+            room_registry.set_status(room, "waiting")
+        else:
+            room_registry.touch(room)
         _save_rooms()
 
     return resp_ok("room reset", room_id=room_id)
@@ -539,22 +689,67 @@ def remove_user_from_all_rooms(username: str):
     if not username:
         return
 
-    with rooms_lock:
-        to_delete = []
-        for room_id, room in list(rooms.items()):
-            players = room.get("players", [])
-            if username in players:
-                players.remove(username)
+    # 只看這個人所在的房間（user -> room_ids 索引），一次只拿一個房間的鎖
+    room_ids = room_registry.user_room_ids(username)
+    for room_id in room_ids:
+        with room_registry.locked(room_id) as room:
+            if room is not None and username in room.get("players", []):
                 # 房主離線：轉交房主 / 關房
-                if room.get("host") == username:
-                    if players:
-                        room["host"] = players[0]
-                    else:
-                        to_delete.append(room_id)
-        for rid in to_delete:
-            rooms.pop(rid, None)
+                room_registry.remove_player(room, username)
+    if room_ids:
         _save_rooms()
 
+def end_session(role: str, username: str):
+    """登出 / 斷線：把使用者從所有房間跟在線列表拿掉。"""
+    global _online_version
+    if _coordinator is not None:
+        _coordinator.end_session(role, username)
+        return
+    # 先從所有房間移除
+    remove_user_from_all_rooms(username)
+    # 再從在線列表拿掉
+    with online_users_lock:
+        key = "players" if role == "player" else "developers"
+        online_users[key].discard(username)
+        _online_version += 1
+
+
+def update_subscription(sub: Subscriber, action: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    subscribe / unsubscribe 房間事件。
+    payload 給 room_id 訂閱單一房間，給 game_name 訂閱該遊戲大廳的所有房間。
+    """
+    if payload.get("room_id") is not None:
+        try:
+            topic = ("room", int(payload["room_id"]))
+        except (TypeError, ValueError):
+            return resp_err("invalid room_id")
+    elif payload.get("game_name"):
+        topic = ("game", payload["game_name"])
+    else:
+        return resp_err("missing room_id or game_name")
+
+    if action == "unsubscribe":
+        room_events.unsubscribe(sub, topic)
+        return resp_ok("unsubscribed", topic=list(topic))
+
+    # 先訂閱再拿快照：快照之後的變動一定會收到事件
+    room_events.subscribe(sub, topic)
+    if _coordinator is not None:
+        snapshot = _coordinator.subscription_snapshot(topic)
+    else:
+        snapshot = subscription_snapshot(topic)
+    return resp_ok("subscribed", topic=list(topic), **snapshot)
+
+
+def subscription_snapshot(topic) -> Dict[str, Any]:
+    """訂閱時附在回覆裡的目前狀態：單一房間，或該遊戲所有 waiting 的房間。"""
+    if topic[0] == "room":
+        with room_registry.locked(topic[1]) as room:
+            return {"room": room_snapshot(room) if room else None}
+    return {"rooms": room_registry.find("waiting", topic[1], snapshot=room_snapshot)}
+
+
 def list_online_users() -> Dict[str, Any]:
     #線上玩家及開發者名單
     with online_users_lock:
@@ -567,8 +762,7 @@ def get_player_history(payload: Dict[str, Any]) -> Dict[str, Any]:
     if not username:
         return resp_err("missing username")
 
-    history = load_history()
-    user_hist = history.get(username, {})
+    user_hist = get_history(username)
     # user_hist: {game_name: play_count}
     return resp_ok("history", history=user_hist)
 
@@ -592,8 +786,7 @@ def add_rating(payload: Dict[str, Any]) -> Dict[str, Any]:
         return resp_err("score must be between 1 and 5")
 
     # 檢查是否玩過這款遊戲
-    history = load_history()
-    user_hist = history.get(username, {})
+    user_hist = get_history(username)
     if game_name not in user_hist or user_hist[game_name] <= 0:
         return resp_err("you must play this game before rating")
 
@@ -604,268 +797,727 @@ def add_rating(payload: Dict[str, Any]) -> Dict[str, Any]:
     if len(comment) > 300:
         return resp_err("comment too long (max 300 characters)")
 
-    ratings = load_ratings()
-    game_ratings = ratings.setdefault(game_name, [])
-
     entry = {
         "player": username,
         "score": score_int,
         "comment": comment,
         "timestamp": datetime.now().isoformat(timespec="seconds"),
     }
-    game_ratings.append(entry)
-    save_ratings(ratings)
+    append_rating(game_name, entry)
 
     return resp_ok("rating added", game_name=game_name)
 
 
-def get_game_ratings(payload: Dict[str, Any]) -> Dict[str, Any]:
+def get_game_ratings(payload: Dict[str, Any], summary=None) -> Dict[str, Any]:
+    """summary 給了就直接用（batch 會先一次查好），不然向 db_server 查。"""
     game_name = payload.get("game_name")
     if not game_name:
         return resp_err("missing game_name")
 
-    ratings = load_ratings()
-    game_ratings = ratings.get(game_name, [])
+    # 統計由 db_server 在 add_rating 時維護，這裡是 O(1)
+    if summary is None:
+        summary = get_rating_summary(game_name)
 
-    if not game_ratings:
+    if summary["count"] == 0:
         return resp_ok(
             "no ratings yet",
             game_name=game_name,
             avg_score=None,
             count=0,
+            histogram=summary["histogram"],
             ratings=[],
         )
 
-    scores = [r.get("score", 0) for r in game_ratings]
-    scores = [int(s) for s in scores if isinstance(s, (int, float, str))]
-    if scores:
-        avg_score = sum(scores) / len(scores)
-    else:
-        avg_score = None
-
-    # 只回傳最近 5 則（避免一次太多）
-    latest = game_ratings[-5:]
-
+    # ratings 只帶 db_server 維護的最近 RATING_LATEST_N 則（GAME_STORE_RATING_LATEST_N，舊到新），其餘用 get_game_ratings_page 分頁
     return resp_ok(
         "game ratings",
         game_name=game_name,
-        avg_score=avg_score,
-        count=len(game_ratings),
-        ratings=latest,
+        avg_score=summary["avg_score"],
+        count=summary["count"],
+        histogram=summary["histogram"],
+        ratings=summary["latest"],
     )
 
 
-def handle_player_action(action: str, payload: Dict[str, Any]):
-    if action == "list_games":
-        games = load_games()
-        return resp_ok("game list", games=games)
-    
-    if action == "list_online_users":
-        return list_online_users()
+def get_game_ratings_page(payload: Dict[str, Any]) -> Dict[str, Any]:
+    # 評論分頁：cursor 是上一頁回傳的 next_cursor，沒有就從第一頁開始
+    game_name = payload.get("game_name")
+    if not game_name:
+        return resp_err("missing game_name")
 
-    if action == "game_info":
-        game_name = payload.get("game_name")
-        if not game_name:
-            return resp_err("missing game_name")
-        games = load_games()
-        info = games.get(game_name)
-        if not info:
-            return resp_err("game not found")
-        return resp_ok("game info", game_name=game_name, info=info)
+    order = payload.get("order") or "newest"
+    try:
+        page = get_ratings_page(
+            game_name,
+            order=order,
+            cursor=payload.get("cursor"),
+            limit=payload.get("limit", 10),
+        )
+    except (TypeError, ValueError) as e:
+        return resp_err(f"invalid ratings page request: {e}")
 
-    if action == "create_room":
-        return create_room(payload)
+    return resp_ok(
+        "ratings page",
+        game_name=game_name,
+        order=order,
+        ratings=page["ratings"],
+        next_cursor=page["next_cursor"],
+    )
 
-    if action == "list_rooms":
-        game_name = payload.get("game_name")
-        return list_rooms(game_name)
 
-    if action == "join_room":
-        return join_room(payload)
+def game_info(payload: Dict[str, Any], games=None) -> Dict[str, Any]:
+    game_name = payload.get("game_name")
+    if not game_name:
+        return resp_err("missing game_name")
+    if games is None:
+        games = load_games()
+    info = games.get(game_name)
+    if not info:
+        return resp_err("game not found")
+    return resp_ok("game info", game_name=game_name, info=info)
 
-    if action == "start_game":
-        return start_room_game(payload)
 
-    if action == "room_players":
-        return room_players(payload)
+def handle_batch(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    payload = {"requests": [{"action": ..., "payload": {...}}, ...]}，只能放 BATCH_ACTIONS。
+    回傳 results（順序和 requests 一樣，每個就是單獨呼叫時的回覆）。
+    整批共用同一份遊戲目錄，評價統計也只拿一次鎖一起查。
+    """
+    requests = payload.get("requests")
+    if not isinstance(requests, list):
+        return resp_err("missing requests")
+    if len(requests) > BATCH_MAX:
+        return resp_err(f"too many requests in batch (max {BATCH_MAX})")
+
+    items = []
+    for item in requests:
+        if not isinstance(item, dict) or item.get("action") not in BATCH_ACTIONS:
+            items.append(None)
+        else:
+            items.append((item["action"], item.get("payload") or {}))
+    results = [None] * len(items)
+    for i, it in enumerate(items):
+        # 跟單獨送的請求一樣先檢查 payload 型別
+        err = it and dispatcher.route("player", it[0]).validate(it[1])
+        if err:
+            results[i] = err
+            items[i] = False
+
+    if _coordinator is not None:
+        # 要給 coordinator 處理的那幾個合成一個 batch，一次來回
+        remote = [i for i, it in enumerate(items) if it and it[0] in COORDINATED_ACTIONS]
+        if remote:
+            resp = _coordinator.player_action("batch", {"requests": [
+                {"action": items[i][0], "payload": items[i][1]} for i in remote
+            ]})
+            for i, result in zip(remote, resp.get("results", [])):
+                results[i] = result
+                items[i] = False
+
+    games = None
+    if any(it and it[0] in ("list_games", "game_info") for it in items):
+        games = load_games()
+    summaries = get_rating_summaries({
+        it[1].get("game_name") for it in items if it and it[0] == "get_game_ratings"
+    })
+
+    for i, it in enumerate(items):
+        if it is False:
+            continue
+        if it is None:
+            results[i] = resp_err("action not allowed in batch")
+            continue
+        action, item_payload = it
+        if action == "list_games":
+            results[i] = resp_ok("game list", games=games)
+        elif action == "game_info":
+            results[i] = game_info(item_payload, games)
+        elif action == "get_game_ratings":
+            results[i] = get_game_ratings(item_payload, summaries.get(item_payload.get("game_name")))
+        else:
+            results[i] = handle_player_action(action, item_payload)
 
-    if action == "leave_room":
-        return leave_room(payload)
-    
-    if action == "my_history":
-        return get_player_history(payload)
+    return resp_ok("batch", results=results)
 
-    if action == "add_rating":
-        return add_rating(payload)
 
+def _cache_key(action: str, payload: Dict[str, Any]):
+    """CACHED_ACTIONS 的快取 key；不能快取（參數怪、多 process 模式下由 coordinator 處理）回傳 None。"""
+    if _coordinator is not None and action in COORDINATED_ACTIONS:
+        return None  # 資料在 coordinator，這個 process 的版本號不準
+    if action == "list_games":
+        return (action, games_version())
+    if action == "list_online_users":
+        return (action, _online_version)
+    game_name = payload.get("game_name")
+    if not isinstance(game_name, str):
+        return None
+    if action == "game_info":
+        return (action, game_name, games_version())
     if action == "get_game_ratings":
-        return get_game_ratings(payload)
-    
-    if action == "room_info":
-        return room_info(payload)
+        return (action, game_name, ratings_version())
+    return None
 
-    if action == "wait_start":
-        return wait_room_start(payload)
-    
-    if action == "reset_room":
-        return reset_room(payload)
 
-    return resp_err(f"unknown player action: {action}")
+def handle_player_action(action: str, payload: Dict[str, Any]):
+    """
+    直接執行一個只吃 payload 的玩家動作（batch 裡的請求、coordinator 收到 worker 轉來的請求），
+    不經過 middleware；連線上收到的請求走 dispatcher。
+    """
+    if _coordinator is not None and action in COORDINATED_ACTIONS:
+        return _coordinator.player_action(action, payload)
+    route = dispatcher.route("player", action)
+    if route is None or not route.payload_only:
+        return resp_err(f"unknown player action: {action}")
+    return route.handler(payload)
+
+
+# zip 路徑 -> (大小, mtime, sha256)；同一個版本的 zip 不會變，不用每次下載都重算
+_archive_hashes: Dict[str, tuple] = {}
+_archive_hashes_lock = threading.Lock()
+
+
+def archive_sha256(path: Path) -> str:
+    st = path.stat()
+    with _archive_hashes_lock:
+        cached = _archive_hashes.get(str(path))
+    if cached is not None and cached[:2] == (st.st_size, st.st_mtime_ns):
+        return cached[2]
+    h = hashlib.sha256()
+    buf = bytearray(1024 * 1024)
+    with path.open("rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(memoryview(buf)[:n])
+    digest = h.hexdigest()
+    with _archive_hashes_lock:
+        _archive_hashes[str(path)] = (st.st_size, st.st_mtime_ns, digest)
+    return digest
 
 
-def player_download_game(conn: socket.socket, payload: Dict[str, Any]):
+def prepare_download(payload: Dict[str, Any]):
+    """
+    下載的前半段：找出要送的 zip 檔和要送的範圍。
+    payload 可以給 offset（從第幾個 byte 開始）、length（送幾 bytes，預設送到結尾）
+    和 sha256（client 手上那份不完整的檔案是哪個內容）：sha256 跟現在的 zip 不一樣時
+    offset 不算數，從頭送，client 看 header 的 offset 就知道要不要丟掉舊的部分。
+    回傳 (header, zip_path)；找不到檔案時 zip_path 是 None，header 是錯誤訊息。
+    """
     # 1. 取得遊戲名稱
     game_name = payload.get("game_name")
     if not game_name:
-        send_json(conn, resp_err("missing game_name"))
-        return
+        return resp_err("missing game_name"), None
 
     # 2. 確認遊戲是否存在
     games = load_games()
     info = games.get(game_name)
     if not info:
-        send_json(conn, resp_err("game not found"))
-        return
+        return resp_err("game not found"), None
 
     version = str(info.get("version", "0"))  # 取得遊戲版本號
     zip_path = UPLOAD_DIR / f"{game_name}_{version}.zip"  # zip 檔路徑
 
     if not zip_path.exists():
-        send_json(conn, resp_err("game file not found on server"))
-        return
+        return resp_err("game file not found on server"), None
+
+    header = _archive_header(zip_path, payload, game_name=game_name, version=version)
+    return header, (zip_path if header["status"] == "ok" else None)
+
+
+def _archive_header(path: Path, payload: Dict[str, Any], **fields) -> Dict[str, Any]:
+    """送 path 這個檔案的 header：照 payload 的 offset / length / sha256 決定範圍（見 prepare_download）。"""
+    file_size = path.stat().st_size
+    sha256 = archive_sha256(path)
 
-    file_size = zip_path.stat().st_size
+    offset = payload.get("offset") or 0
+    length = payload.get("length")
+    if payload.get("sha256") not in (None, sha256):
+        offset, length = 0, None  # 檔案換過了，client 的部分內容不能用
+    if offset < 0 or offset > file_size:
+        return resp_err("invalid offset")
+    if length is None or length > file_size - offset:
+        length = file_size - offset
+    if length < 0:
+        return resp_err("invalid length")
 
-    # 3. 把檔案大小資訊傳送給 client
-    header = resp_ok(
+    # 檔案大小、hash、這次送的範圍放在 header 裡，client 照 length 收檔
+    return resp_ok(
         "download_ready",
-        game_name=game_name,
-        version=version,
+        **fields,
         archive_size=file_size,
+        sha256=sha256,
+        offset=offset,
+        length=length,
+    )
+
+
+def prepare_delta(payload: Dict[str, Any]):
+    """
+    player / download_delta：從 from_version 更新到目前版本的 delta 包（見 game_manifest.py），
+    header 同 download_game，另外帶 from_version、delta=True。
+    沒辦法做 delta（舊版本沒有 manifest、已經是最新版、delta 不比完整的 zip 小）就回錯誤，
+    client 改下載完整的遊戲。
+    """
+    header, zip_path = prepare_download({"game_name": payload.get("game_name")})
+    if zip_path is None:
+        return header, None
+    game_name, version = header["game_name"], header["version"]
+    from_version = str(payload.get("from_version", ""))
+    if not from_version:
+        return resp_err("missing from_version"), None
+    if not game_manifest.valid_version(from_version):
+        return resp_err("invalid from_version"), None
+    if from_version == version:
+        return resp_err("already up to date"), None
+
+    delta = game_manifest.build_delta(game_name, from_version, version, zip_path)
+    if delta is None:
+        return resp_err(f"no delta from v{from_version}"), None
+    delta_path = delta[0]
+    if delta_path.stat().st_size >= header["archive_size"]:
+        return resp_err("delta is not smaller than the full archive"), None
+    header = _archive_header(delta_path, payload, game_name=game_name, version=version,
+                             from_version=from_version, delta=True)
+    return header, (delta_path if header["status"] == "ok" else None)
+
+
+def issue_download_ticket(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    player / download_ticket：發一張下載票（見 download_tickets.py）和檔案資訊，
+    client 拿去開額外的連線用 download_range 平行下載不同段。
+    """
+    header, zip_path = prepare_download({"game_name": payload.get("game_name")})
+    if zip_path is None:
+        return header
+    return resp_ok(
+        "download ticket",
+        **_transfer_port(),
+        ticket=download_tickets.issue(header["game_name"], header["sha256"]),
+        expires_in=download_tickets.TICKET_TTL,
+        game_name=header["game_name"],
+        version=header["version"],
+        archive_size=header["archive_size"],
+        sha256=header["sha256"],
     )
-    send_json(conn, header)
 
-    # 傳送檔案內容
+
+def prepare_range(payload: Dict[str, Any]):
+    """
+    system / download_range 的前半段：驗證下載票之後同 prepare_download（payload 的 offset / length）；
+    票發出之後檔案換過了（sha256 不一樣）就回錯誤，client 要重新拿票。
+    """
+    claims = download_tickets.verify(payload.get("ticket"))
+    if claims is None:
+        return resp_err("invalid or expired ticket"), None
+    header, zip_path = prepare_download({
+        "game_name": claims["game"], "offset": payload.get("offset"), "length": payload.get("length"),
+    })
+    if zip_path is not None and header["sha256"] != claims["sha256"]:
+        return resp_err("game file changed, please get a new ticket"), None
+    return header, zip_path
+
+
+def player_download_game(conn: socket.socket, payload: Dict[str, Any], request_id=None,
+                         wire: WireFormat = None, send_lock=None, prepare=prepare_download):
+    """
+    prepare 決定要送哪個檔案的哪一段（prepare_download / prepare_range）。
+    檔案內容用 socket.sendfile 送（Linux 上是 os.sendfile，資料直接從 page cache 進 socket，不經過 Python）。
+    文字模式下 header 跟檔案內容中間不能插進別的訊息，整段都拿著 send_lock；
+    binary framing 時檔案切成 DATA frame，每送一個 frame 拿一次鎖，事件和其他回覆可以插在中間。
+    """
+    header, zip_path = prepare(payload)
+    binary = wire is not None and wire.binary
+    if binary and zip_path is not None:
+        header["stream"] = wire.next_stream()
+    send_lock = send_lock or threading.Lock()
+    whole = nullcontext() if binary else send_lock
+    per_frame = send_lock if binary else nullcontext()
+
+    with whole:
+        with per_frame:
+            send_json(conn, with_request_id(header, request_id), wire)
+        if zip_path is None:
+            return
+
+        # 傳送檔案內容
+        try:
+            with zip_path.open("rb") as f:
+                offset, end = header["offset"], header["offset"] + header["length"]
+                if binary:
+                    while offset < end:
+                        count = min(DATA_CHUNK, end - offset)
+                        with per_frame:
+                            conn.sendall(wire.data_header(header["stream"], count))
+                            conn.sendfile(f, offset, count)
+                        offset += count
+                elif end > offset:
+                    conn.sendfile(f, offset, end - offset)
+            print(f"[DOWNLOAD] sent {zip_path} ({header['length']} bytes from {header['offset']})")
+        except Exception as e:
+            print(f"[DOWNLOAD] error sending file: {e}")
+
+
+# ---------- TRANSFER ----------
+# 資料通道（transfer_server.py）：檔案在另一個 port 上由自己的 worker pool 傳，不佔 lobby 的連線和 thread
+_transfer = None  # 開成功之後是 TransferServer
+
+
+def _transfer_port() -> Dict[str, Any]:
+    """票的回覆裡告訴 client 資料通道在哪個 port；沒開就不給，client 照舊連 lobby。"""
+    return {"transfer_port": _transfer.port} if _transfer is not None else {}
+
+
+def issue_upload_ticket_for_transfer(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """developer / upload_ticket：沒開資料通道就回錯誤，client 改在 lobby 連線上直接傳檔。"""
+    if _transfer is None:
+        return resp_err("transfer port is not available")
+    resp = issue_upload_ticket(payload)
+    if resp.get("status") == "ok":
+        resp.update(_transfer_port())
+    return resp
+
+
+def transfer_download(req: Request):
+    """資料通道的 download_range：跟 system / download_range 一樣（下載票 + offset / length）。"""
+    player_download_game(req.session.conn, req.payload, prepare=prepare_range)
+    return None
+
+
+def start_transfer_server(srv: socket.socket = None):
+    """開資料通道；srv 給已經 listen 的 socket（lobby_cluster 的 worker），port 開不起來就只用 lobby 連線傳檔。"""
+    global _transfer
     try:
-        with zip_path.open("rb") as f:
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                conn.sendall(chunk)
-        print(f"[DOWNLOAD] sent {zip_path} ({file_size} bytes)")
-    except Exception as e:
-        print(f"[DOWNLOAD] error sending file: {e}")
+        if srv is None:
+            srv = transfer_server.listen(HOST)
+    except OSError as e:
+        print(f"[TRANSFER] cannot listen on port {transfer_server.TRANSFER_PORT}: {e}")
+        return None
+    _transfer = transfer_server.TransferServer(srv, transfer_dispatcher).start()
+    return _transfer
+
+
+def stop_transfer_server():
+    if _transfer is not None:
+        _transfer.close()
+
+
+# 下載類的動作各自怎麼決定要送的檔案（lobby_async 也用這張表）
+DOWNLOAD_SOURCES = {
+    "download_game": prepare_download,
+    "download_range": prepare_range,
+    "download_delta": prepare_delta,
+}
+
+
+# ---------- DISPATCH ----------
+# 每個 (role, action) 註冊一次，收到請求查表分派；middleware 依序是
+# 計時 -> 例外轉成錯誤回覆 -> 登入檢查 -> payload 型別檢查 -> 回覆快取 -> 轉給 coordinator
+
+
+class _CachedReplies(Middleware):
+    """CACHED_ACTIONS 的回覆編好 JSON 放進 response_cache，key 帶著資料版本（見 _cache_key）。"""
+
+    def applies(self, route) -> bool:
+        return route.role == "player" and route.action in CACHED_ACTIONS
+
+    def before(self, req: Request):
+        # 版本號要在算回覆之前拿：算的時候資料剛好被改，存進去的也只會是比 key 新的內容
+        req.cache_key = _cache_key(req.action, req.payload)
+        if req.cache_key is None:
+            return None
+        return response_cache.get(req.cache_key)
+
+    def after(self, req: Request, resp):
+        if req.cache_key is not None and isinstance(resp, dict):
+            resp = encode_body(resp)
+            response_cache.put(req.cache_key, resp)
+        return resp
+
+
+class _Coordinated(Middleware):
+    """多 process 模式下 COORDINATED_ACTIONS 轉給 coordinator 做。"""
+
+    def applies(self, route) -> bool:
+        return route.role == "player" and route.action in COORDINATED_ACTIONS
+
+    def before(self, req: Request):
+        if _coordinator is None:
+            return None
+        return _coordinator.player_action(req.action, req.payload)
+
+
+def _unknown_action(req: Request) -> Dict[str, Any]:
+    session = req.session
+    if req.role == "system":
+        return resp_err("unknown system action")
+    if session.role is None or session.user is None:
+        return resp_err("please login first")
+    if req.role == session.role:
+        return resp_err(f"unknown {req.role} action: {req.action}")
+    return resp_err("role mismatch or unknown role")
+
+
+def system_hello(req: Request):
+    resp = handle_hello(req.payload)
+    # 回覆用舊格式送出去之後才切換
+    req.after_send.append(lambda: req.session.apply_hello(resp))
+    return resp
+
+
+def system_login(req: Request):
+    resp = handle_login(req.payload)
+    if resp.get("status") == "ok":
+        req.session.role = resp.get("role")
+        req.session.user = resp.get("username")
+        print(f"[LOGIN] {req.session.role} {req.session.user}")
+    return resp
+
+
+def system_logout(req: Request):
+    session = req.session
+    session.drop_subscriber()
+    if session.role and session.user:
+        end_session(session.role, session.user)
+        print(f"[LOGOUT] {session.role} {session.user}")
+        session.role = None
+        session.user = None
+    return resp_ok("logout success")
+
+
+def system_server_stats(req: Request):
+    return resp_ok(
+        "server stats",
+        actions=action_timing.snapshot(),
+        compression=compression_stats.snapshot(),
+        response_cache=response_cache.stats(),
+        transfer=_transfer.stats() if _transfer is not None else None,
+    )
+
+
+def player_download(req: Request):
+    session = req.session
+    player_download_game(session.conn, req.payload, req.request_id, session.wire, session.send_lock,
+                         DOWNLOAD_SOURCES[req.action])
+    return None  # header 跟檔案都已經送出去了
+
+
+def player_subscription(req: Request):
+    session = req.session
+    if session.subscriber is None and req.action == "subscribe":
+        session.subscriber = Subscriber(session.reply)
+        session.subscriber.start()
+    if session.subscriber is None:
+        return resp_ok("unsubscribed")
+    resp = update_subscription(session.subscriber, req.action, req.payload)
+    if not session.subscriber.topics:
+        # 停掉推送 thread 之後才回覆，client 收到回覆後就不會再有事件
+        session.drop_subscriber()
+    return resp
+
+
+def player_wait_start(req: Request):
+    conn = req.session.conn
+    return wait_room_start(req.payload, cancelled=lambda: _peer_closed(conn))
+
+
+# payload 欄位型別（見 dispatch.Route.validate）
+ACCOUNT = {"role": str, "username": str, "password": str}
+ROOM = {"username": str, "room_id": (int, str)}
+RANGE = {"ticket": str, "offset": int, "length": int}
+UPLOAD = {
+    "developer": str, "game_name": str, "version": (str, int, float), "description": str,
+    "type": str, "archive_size": (int, str), "min_players": (int, str), "max_players": (int, str),
+    "upload_ticket": str,
+}
+
+action_timing = Timing()
+dispatcher = Dispatcher(unknown=_unknown_action)
+for _middleware in (action_timing, ErrorMapping(), Auth(), Validate(), _CachedReplies(), _Coordinated()):
+    dispatcher.use(_middleware)
+
+dispatcher.add("system", "hello", system_hello, {"compression": list, "framing": list}, auth=False)
+dispatcher.add("system", "register", handle_register, ACCOUNT, auth=False, payload_only=True)
+dispatcher.add("system", "login", system_login, ACCOUNT, auth=False)
+dispatcher.add("system", "logout", system_logout, auth=False)
+dispatcher.add("system", "compression_stats",
+               lambda req: resp_ok("compression stats", **compression_stats.snapshot()), auth=False)
+dispatcher.add("system", "server_stats", system_server_stats, auth=False)
+dispatcher.add("system", "download_range", player_download, RANGE, auth=False)
+
+dispatcher.add("player", "list_games", lambda payload: resp_ok("game list", games=load_games()),
+               payload_only=True)
+dispatcher.add("player", "game_info", game_info, {"game_name": str}, payload_only=True)
+dispatcher.add("player", "list_online_users", lambda payload: list_online_users(), payload_only=True)
+dispatcher.add("player", "create_room", create_room, {"username": str, "game_name": str},
+               payload_only=True)
+dispatcher.add("player", "list_rooms", lambda payload: list_rooms(payload.get("game_name")),
+               {"game_name": str}, payload_only=True)
+dispatcher.add("player", "join_room", join_room, ROOM, payload_only=True)
+dispatcher.add("player", "start_game", start_room_game, ROOM, payload_only=True)
+dispatcher.add("player", "room_players", room_players, ROOM, payload_only=True)
+dispatcher.add("player", "leave_room", leave_room, ROOM, payload_only=True)
+dispatcher.add("player", "room_info", room_info, ROOM, payload_only=True)
+dispatcher.add("player", "reset_room", reset_room, ROOM, payload_only=True)
+dispatcher.add("player", "my_history", get_player_history, {"username": str}, payload_only=True)
+dispatcher.add("player", "add_rating", add_rating,
+               {"username": str, "game_name": str, "score": (int, str), "comment": str},
+               payload_only=True)
+dispatcher.add("player", "get_game_ratings", get_game_ratings, {"game_name": str}, payload_only=True)
+dispatcher.add("player", "get_game_ratings_page", get_game_ratings_page,
+               {"game_name": str, "order": str, "limit": int}, payload_only=True)
+dispatcher.add("player", "batch", handle_batch, {"requests": list}, payload_only=True)
+dispatcher.add("player", "download_ticket", issue_download_ticket, {"game_name": str},
+               payload_only=True)
+dispatcher.add("player", "download_game", player_download,
+               {"game_name": str, "offset": int, "length": int, "sha256": str})
+dispatcher.add("player", "download_delta", player_download,
+               {"game_name": str, "from_version": (str, int, float), "offset": int, "length": int,
+                "sha256": str})
+dispatcher.add("player", "subscribe", player_subscription, {"room_id": (int, str), "game_name": str})
+dispatcher.add("player", "unsubscribe", player_subscription, {"room_id": (int, str), "game_name": str})
+dispatcher.add("player", "wait_start", player_wait_start, ROOM)
+
+dispatcher.add("developer", "upload_game", lambda req: upload_game(req.payload, req.session.source), UPLOAD)
+dispatcher.add("developer", "update_game", lambda req: update_game(req.payload, req.session.source), UPLOAD)
+dispatcher.add("developer", "upload_ticket", issue_upload_ticket_for_transfer,
+               {"developer": str, "archive_size": int}, payload_only=True)
+dispatcher.add("developer", "delete_game", delete_game, {"developer": str, "game_name": str},
+               payload_only=True)
+dispatcher.add("developer", "list_my_games", list_my_games, {"developer": str}, payload_only=True)
+dispatcher.compile()
+
+# 資料通道（transfer_server）的請求：不用登入，一樣檢查 payload 型別、例外轉成錯誤回覆
+transfer_dispatcher = Dispatcher(unknown=lambda req: resp_err(f"unknown transfer action: {req.action}"))
+transfer_dispatcher.use(ErrorMapping())
+transfer_dispatcher.use(Validate())
+transfer_dispatcher.add(transfer_server.ROLE, "download_range", transfer_download, RANGE, auth=False)
+transfer_dispatcher.add(transfer_server.ROLE, "upload",
+                        lambda req: receive_upload(req.payload, req.session.reader),
+                        {"ticket": str}, auth=False)
+transfer_dispatcher.compile()
 
 
 # ---------- CLIENT LOOP ----------
+class _Session:
+    """threaded server 一條連線的狀態，handler 透過 req.session 拿到。"""
+
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self.reader = FramedReader(conn)
+        self.source = self.reader  # developer 上傳時從這裡讀檔案內容
+        # 房間事件由另一個 thread 推送，所有寫入這條連線的動作都要拿 send_lock
+        self.send_lock = threading.Lock()
+        self.wire = WireFormat()  # hello 協商過才會壓縮 / 改用 binary framing
+        self.subscriber = None
+        self.role = None
+        self.user = None
+
+    def reply(self, obj: Dict[str, Any]):
+        with self.send_lock:
+            send_json(self.conn, obj, self.wire)
+
+    def send_response(self, req: Request, resp):
+        """resp 是 dict、編好的 JSON bytes，或 None（handler 自己送過了）。"""
+        if isinstance(resp, bytes):
+            data = frame_body(body_with_request_id(resp, req.request_id), self.wire)
+            with self.send_lock:
+                self.conn.sendall(data)
+        elif resp is not None:
+            self.reply(with_request_id(resp, req.request_id))
+        for hook in req.after_send:
+            hook()
+
+    def apply_hello(self, resp: Dict[str, Any]):
+        self.wire.apply(resp)
+        self.reader.binary = self.wire.binary
+
+    def drop_subscriber(self):
+        if self.subscriber is not None:
+            room_events.remove(self.subscriber)
+            self.subscriber = None
+
+
 def client_loop(conn: socket.socket, addr):
     print(f"[+] New connection from {addr}")
+    session = _Session(conn)
+
+    # 這條連線丟到 _request_pool 平行處理、還沒回覆的請求
+    inflight = []
+
+    def wait_inflight(limit: int = 0):
+        while len(inflight) > limit:
+            inflight.pop(0).result()
 
-    current_role = None
-    current_user = None
+    def run_concurrent(req: Request):
+        try:
+            session.send_response(req, dispatcher.dispatch(req))
+        except OSError:
+            pass  # 連線已經斷了，client_loop 會收尾
 
     try:
         while True:
-            msg = recv_json(conn)
+            msg = recv_json(session.reader)
             if msg is None:
                 print(f"[-] Client {addr} disconnected")
                 break
 
             if not isinstance(msg, dict):
-                send_json(conn, resp_err("invalid message format"))
+                session.reply(resp_err("invalid message format"))
                 continue
 
-            role = msg.get("role")
-            action = msg.get("action")
-            payload = msg.get("payload", {}) or {}
-
-            # --- system: register/login ---
-            if role == "system":
-                if action == "register":
-                    resp = handle_register(payload)
-                    send_json(conn, resp)
-                    continue
-                elif action == "login":
-                    resp = handle_login(payload)
-                    send_json(conn, resp)
-                    if resp.get("status") == "ok":
-                        current_role = resp.get("role")
-                        current_user = resp.get("username")
-                        print(f"[LOGIN] {current_role} {current_user}")
-                    continue
-                elif action == "logout":
-                    if current_role and current_user:
-                        # 先從所有房間移除
-                        remove_user_from_all_rooms(current_user)
-                        # 再從在線列表拿掉
-                        with online_users_lock:
-                            key = "players" if current_role == "player" else "developers"
-                            online_users[key].discard(current_user)
-                        print(f"[LOGOUT] {current_role} {current_user}")
-                        current_role = None
-                        current_user = None
-
-                    send_json(conn, resp_ok("logout success"))
-                    continue
-                else:
-                    send_json(conn, resp_err("unknown system action"))
-                    continue
-
-            # 之後的動作都需要已登入
-            if current_role is None or current_user is None:
-                send_json(conn, resp_err("please login first"))
-                continue
-
-            # --- player actions ---
-            if role == "player" and current_role == "player":
-
-                if action == "download_game":
-                    player_download_game(conn, payload)
-                    continue
-
-                resp = handle_player_action(action, payload)
-                send_json(conn, resp)
-                continue
-
-            # --- developer actions ---
-            if role == "developer" and current_role == "developer":
-                resp = handle_developer_action(action, payload, conn)
-                send_json(conn, resp)
+            req = Request(msg, session)
+            concurrent = (
+                req.request_id is not None
+                and req.role == "player"
+                and session.role == "player"
+                and req.action in PIPELINE_SAFE_ACTIONS
+            )
+            if concurrent:
+                wait_inflight(MAX_INFLIGHT_PER_CONN - 1)
+                inflight.append(_request_pool.submit(run_concurrent, req))
                 continue
-
-            # 其他情況
-            send_json(conn, resp_err("role mismatch or unknown role"))
+            # 其他請求（登入登出、房間變動、下載上傳...）照順序來
+            wait_inflight()
+            session.send_response(req, dispatcher.dispatch(req))
 
     except Exception as e:
         print(f"[!] Error with client {addr}: {e}")
     finally:
-        if current_role and current_user:
+        for fut in inflight:
+            fut.cancel()
+        session.drop_subscriber()
+        if session.role and session.user:
             # 斷線時也要把人從房間跟在線列表拿掉
-            remove_user_from_all_rooms(current_user)
-            with online_users_lock:
-                key = "players" if current_role == "player" else "developers"
-                online_users[key].discard(current_user)
+            end_session(session.role, session.user)
         conn.close()
         print(f"[+] Connection with {addr} closed")
 
-def main():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as srv:
+def main(srv: socket.socket = None, transfer_srv: socket.socket = None):
+    """
+    srv / transfer_srv 給已經 listen 的 socket（lobby_cluster 的 worker）；
+    不給就自己開 HOST:PORT 和資料通道的 port。
+    """
+    prepare_storage()
+    start_transfer_server(transfer_srv)
+
+    if srv is None:
+        srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         srv.bind((HOST, PORT))
         srv.listen()
 
+    with srv:
         srv.settimeout(1.0)
         print(f"[SERVER] Listening on {HOST}:{PORT}")
 
-        threads = []
-
+        # 一條連線一個 thread（daemon，不留 reference，結束就回收）；
+        # 要撐大量閒置連線請改用 lobby_async.py
         while True:
             try:
                 conn, addr = srv.accept()
                 t = threading.Thread(target=client_loop, args=(conn, addr), daemon=True)
                 t.start()
-                threads.append(t)
 
             except socket.timeout:
                 pass
@@ -878,7 +1530,12 @@ def main():
                 print(f"[SERVER] Error in main loop: {e}")
                 break
 
-        print("server shutting down, waiting for threads to finish...")
+        print("server shutting down...")
+        print(f"[SERVER] compression: {compression_stats.snapshot()}")
+        print(f"[SERVER] response cache: {response_cache.stats()}")
+        print(f"[SERVER] actions: {action_timing.snapshot()}")
+        stop_transfer_server()
+        _rooms_persister.close()
 
 
 if __name__ == "__main__":
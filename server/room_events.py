@@ -0,0 +1,197 @@
+# server/room_events.py
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+# 房間事件：room_updated / player_joined / player_left / room_started / room_closed
+# 推給 client 的格式：{"type": "event", "event": ..., "room_id": ..., "game_name": ..., "room": {...}}
+# 佇列塞爆時改推一個 {"type": "event", "event": "resync"}，叫 client 自己重新查詢。
+
+Topic = Tuple[str, Any]  # ("game", game_name) 或 ("room", room_id)
+
+
+class Subscriber:
+    """
+    一條連線的訂閱：有界佇列 + 自己的推送 thread。
+    同一個房間還沒送出去的事件會被合併成最新的那一筆，慢的 client 只會拿到最新狀態。
+    """
+
+    def __init__(self, send: Callable[[Dict[str, Any]], None], max_pending: int = 64):
+        self.topics: Set[Topic] = set()
+        self._send = send
+        self._max_pending = max_pending
+        self._pending: "OrderedDict[Any, Dict[str, Any]]" = OrderedDict()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="room-events", daemon=True)
+        self._thread.start()
+
+    def offer(self, event: Dict[str, Any]):
+        with self._cond:
+            if self._closed:
+                return
+            key = event.get("room_id")
+            if key in self._pending:
+                # 合併：舊的那筆拿掉，最新的排到後面
+                del self._pending[key]
+            elif len(self._pending) >= self._max_pending:
+                self._pending.clear()
+                key = None
+                event = {"type": "event", "event": "resync"}
+            self._pending[key] = event
+            self._notify()
+
+    def _notify(self):
+        # 呼叫端持有 self._cond
+        self._cond.notify()
+
+    def close(self):
+        """停止推送；回傳後保證不會再送出任何事件。"""
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                _, event = self._pending.popitem(last=False)
+            try:
+                self._send(event)
+            except OSError:
+                # 連線壞了就不用再推了，client_loop 那邊會負責收尾
+                with self._cond:
+                    self._closed = True
+                return
+
+
+class AsyncSubscriber(Subscriber):
+    """
+    給 lobby_async 用的訂閱：不開 thread，由 event loop 上的 task 推送，send 是 coroutine function。
+    offer() 會在 executor 的 thread 被呼叫，所以用 call_soon_threadsafe 叫醒 task。
+    close() 要在 event loop 的 thread 呼叫。
+    """
+
+    def __init__(self, send, loop: asyncio.AbstractEventLoop, max_pending: int = 64):
+        super().__init__(send, max_pending)
+        self._loop = loop
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = self._loop.create_task(self._run_async())
+
+    def _notify(self):
+        try:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        except RuntimeError:
+            pass  # event loop 已經關了
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+        # task 下次醒來看到 _closed 就結束；正在送的那一筆已經寫進 transport，
+        # 之後寫的東西一定排在它後面
+        self._wakeup.set()
+
+    async def _run_async(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while True:
+                with self._cond:
+                    if self._closed:
+                        return
+                    if not self._pending:
+                        break
+                    _, event = self._pending.popitem(last=False)
+                try:
+                    await self._send(event)
+                except OSError:
+                    with self._cond:
+                        self._closed = True
+                    return
+
+
+class RoomEventHub:
+    """topic -> 訂閱者；RoomRegistry 有變動時呼叫 publish()。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs: Dict[Topic, Set[Subscriber]] = {}
+        self._sinks: List[Callable[[Dict[str, Any]], None]] = []
+
+    def add_sink(self, sink: Callable[[Dict[str, Any]], None]):
+        """sink(event) 會收到每一個事件（lobby_cluster 的 coordinator 用來轉送給 worker）。"""
+        self._sinks.append(sink)
+
+    def subscribe(self, sub: Subscriber, topic: Topic):
+        with self._lock:
+            self._subs.setdefault(topic, set()).add(sub)
+            sub.topics.add(topic)
+
+    def unsubscribe(self, sub: Subscriber, topic: Topic):
+        with self._lock:
+            subs = self._subs.get(topic)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[topic]
+            sub.topics.discard(topic)
+
+    def remove(self, sub: Subscriber):
+        with self._lock:
+            for topic in list(sub.topics):
+                subs = self._subs.get(topic)
+                if subs is not None:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[topic]
+            sub.topics.clear()
+        sub.close()
+
+    def publish(self, event_name: str, room: Dict[str, Any], **extra):
+        event = {
+            "type": "event",
+            "event": event_name,
+            "room_id": room["id"],
+            "game_name": room.get("game_name"),
+            "room": None if event_name == "room_closed" else room_snapshot(room),
+        }
+        event.update(extra)
+        for sink in self._sinks:
+            sink(event)
+        self.dispatch(event)
+
+    def dispatch(self, event: Dict[str, Any]):
+        """把已經組好的事件交給訂閱者（worker 收到 coordinator 轉來的事件時直接呼叫）。"""
+        with self._lock:
+            targets = set(self._subs.get(("room", event["room_id"]), ()))
+            targets.update(self._subs.get(("game", event.get("game_name")), ()))
+        for sub in targets:
+            sub.offer(event)
+
+
+def room_snapshot(room: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": room["id"],
+        "host": room.get("host"),
+        "game_name": room.get("game_name"),
+        "players": list(room.get("players", [])),
+        "ready_players": list(room.get("ready_players", [])),
+        "status": room.get("status", "waiting"),
+        "min_players": room.get("min_players", 1),
+        "max_players": room.get("max_players", 2),
+        "version": room.get("version", "0"),
+    }
@@ -0,0 +1,252 @@
+# server/room_registry.py
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+
+class RoomRegistry:
+    """
+    房間資料 + 兩組索引，讓查詢只跟結果大小有關：
+      (game_name, status) -> room_ids   給 list_rooms 用
+      username            -> room_ids   給登出 / 斷線時移除玩家用
+
+    鎖分兩層：
+      self.lock      registry 鎖，只保護 rooms dict、索引、waiter 表，拿的時間很短
+      每個房間的鎖    保護該房間的成員、ready、status 轉換，透過 locked(room_id) 取得
+
+    鎖的順序（一定要照這個順序拿，不然會 deadlock）：
+      房間鎖 -> registry 鎖 -> room_events 的鎖
+    （sync 模式的 rooms persister 在持有房間鎖時寫檔，寫檔鎖夾在房間鎖和 registry 鎖中間）
+    也就是：持有 registry 鎖的時候不能再去拿任何房間鎖，
+    而且同一時間最多只持有一個房間鎖。
+    房間的修改方法（add_player / remove_player / set_status ...）都要在持有該房間鎖時呼叫。
+
+    等待開始遊戲的玩家用 add_start_waiter() 拿一個 Future：
+    房間變成 playing 時 result 是房間資訊，房間被刪掉時 result 是 None。
+
+    on_event(event_name, room, **extra) 會在每次變動後（仍持有房間鎖）被呼叫，
+    所以同一個房間的事件順序和實際修改順序一致；事件名稱見 room_events.py。
+    """
+
+    def __init__(self, on_event=None):
+        self.lock = threading.Lock()
+        self.rooms: Dict[int, Dict[str, Any]] = {}
+        self.next_room_id = 1
+        self._room_locks: Dict[int, threading.Lock] = {}
+        # dict 當作有順序的 set 用
+        self._by_game_status: Dict[Tuple[str, str], Dict[int, None]] = {}
+        self._by_status: Dict[str, Dict[int, None]] = {}
+        self._by_user: Dict[str, Set[int]] = {}
+        self._start_waiters: Dict[int, List[Future]] = {}
+        self._on_event = on_event
+
+    def _emit(self, event_name: str, room: Dict[str, Any], **extra):
+        if self._on_event is not None:
+            self._on_event(event_name, room, **extra)
+
+    # ---------- 索引（呼叫端必須持有 self.lock） ----------
+
+    def _index(self, room: Dict[str, Any]):
+        room_id = room["id"]
+        status = room.get("status", "waiting")
+        self._by_game_status.setdefault((room["game_name"], status), {})[room_id] = None
+        self._by_status.setdefault(status, {})[room_id] = None
+
+    def _unindex(self, room: Dict[str, Any]):
+        room_id = room["id"]
+        status = room.get("status", "waiting")
+        key = (room["game_name"], status)
+        ids = self._by_game_status.get(key)
+        if ids is not None:
+            ids.pop(room_id, None)
+            if not ids:
+                del self._by_game_status[key]
+        ids = self._by_status.get(status)
+        if ids is not None:
+            ids.pop(room_id, None)
+            if not ids:
+                del self._by_status[status]
+
+    def _link_user(self, username: str, room_id: int):
+        self._by_user.setdefault(username, set()).add(room_id)
+
+    def _unlink_user(self, username: str, room_id: int):
+        ids = self._by_user.get(username)
+        if ids is not None:
+            ids.discard(room_id)
+            if not ids:
+                del self._by_user[username]
+
+    # ---------- 等待開始 ----------
+
+    def add_start_waiter(self, room_id: int) -> Future:
+        fut: Future = Future()
+        with self.lock:
+            self._start_waiters.setdefault(room_id, []).append(fut)
+        return fut
+
+    def remove_start_waiter(self, room_id: int, fut: Future):
+        with self.lock:
+            waiters = self._start_waiters.get(room_id)
+            if waiters and fut in waiters:
+                waiters.remove(fut)
+                if not waiters:
+                    del self._start_waiters[room_id]
+
+    def wake_start_waiters(self, room_id: int, result: Optional[Dict[str, Any]]):
+        """叫醒這個房間所有的 waiter（lobby_cluster 的 worker 收到遠端事件時也會直接呼叫）。"""
+        with self.lock:
+            waiters = self._start_waiters.pop(room_id, [])
+        for fut in waiters:
+            if not fut.done():
+                fut.set_result(result)
+
+    # ---------- 查詢 ----------
+
+    @contextmanager
+    def locked(self, room_id: int) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        拿這個房間的鎖並 yield 房間；房間不存在（或拿到鎖時已經被刪掉）就 yield None。
+        """
+        with self.lock:
+            lock = self._room_locks.get(room_id)
+        if lock is None:
+            yield None
+            return
+        with lock:
+            with self.lock:
+                room = self.rooms.get(room_id)
+            yield room
+
+    def find_ids(self, status: str, game_name: Optional[str] = None) -> List[int]:
+        """回傳符合 status（及 game_name）的 room id，依 id 排序。"""
+        with self.lock:
+            if game_name:
+                ids = list(self._by_game_status.get((game_name, status), ()))
+            else:
+                ids = list(self._by_status.get(status, ()))
+        return sorted(ids)
+
+    def find(self, status: str, game_name: Optional[str] = None,
+             snapshot=None) -> List[Dict[str, Any]]:
+        """
+        回傳符合條件的房間快照（snapshot(room)，預設淺複製）。
+        每個房間各自拿鎖再複製，拿到鎖時狀態已經變了的房間會被略過。
+        """
+        result = []
+        for room_id in self.find_ids(status, game_name):
+            with self.locked(room_id) as room:
+                if room is None or room.get("status", "waiting") != status:
+                    continue
+                result.append(snapshot(room) if snapshot else _copy_room(room))
+        return result
+
+    def user_room_ids(self, username: str) -> List[int]:
+        with self.lock:
+            return sorted(self._by_user.get(username, ()))
+
+    def snapshot_all(self) -> Dict[int, Dict[str, Any]]:
+        """
+        給寫檔用的全部房間複本。只拿 registry 鎖（可能在持有某個房間鎖時被呼叫），
+        所以單一房間可能剛好在修改中；write-behind 下一次 flush 會再寫一次。
+        """
+        with self.lock:
+            return {room_id: _copy_room(room) for room_id, room in self.rooms.items()}
+
+    # ---------- 修改 ----------
+
+    def create(self, room: Dict[str, Any]) -> Dict[str, Any]:
+        """配一個新的 room id 並登記房間；room 需要有 host / game_name / players。"""
+        lock = threading.Lock()
+        with lock:
+            with self.lock:
+                room_id = self.next_room_id
+                self.next_room_id += 1
+                room["id"] = room_id
+                room.setdefault("status", "waiting")
+                self.rooms[room_id] = room
+                self._room_locks[room_id] = lock
+                self._index(room)
+                for p in room.get("players", []):
+                    self._link_user(p, room_id)
+            # 其他人最快也要等這裡放掉房間鎖才碰得到新房間，所以建立事件一定排在最前面
+            self._emit("room_updated", room)
+        return room
+
+    def add_player(self, room: Dict[str, Any], username: str):
+        with self.lock:
+            room["players"].append(username)
+            self._link_user(username, room["id"])
+        self._emit("player_joined", room, username=username)
+
+    def mark_ready(self, room: Dict[str, Any], username: str):
+        ready = room.setdefault("ready_players", [])
+        if username not in ready:
+            ready.append(username)
+            self._emit("room_updated", room)
+
+    def touch(self, room: Dict[str, Any]):
+        """房間其他欄位（例如 ready_players）被直接改掉時，通知訂閱者。"""
+        self._emit("room_updated", room)
+
+    def remove_player(self, room: Dict[str, Any], username: str) -> bool:
+        """
+        把玩家移出房間（連同 ready 狀態）；房主離開就交給下一個人。
+        房間沒人了就刪掉並回傳 True。
+        """
+        players = room.get("players", [])
+        with self.lock:
+            if username in players:
+                players.remove(username)
+            self._unlink_user(username, room["id"])
+        ready = room.get("ready_players", [])
+        if username in ready:
+            ready.remove(username)
+
+        if room.get("host") == username and players:
+            room["host"] = players[0]
+        if not players:
+            self.delete(room["id"])
+            return True
+        self._emit("player_left", room, username=username)
+        return False
+
+    def set_status(self, room: Dict[str, Any], status: str):
+        if room.get("status") == status:
+            return
+        with self.lock:
+            self._unindex(room)
+            room["status"] = status
+            self._index(room)
+        if status == "playing":
+            self.wake_start_waiters(room["id"], {
+                "game_name": room.get("game_name", ""),
+                "version": str(room.get("version", "0")),
+                "players": list(room.get("players", [])),
+            })
+            self._emit("room_started", room)
+        else:
+            self._emit("room_updated", room)
+
+    def delete(self, room_id: int) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            room = self.rooms.pop(room_id, None)
+            if room is None:
+                return None
+            # 正在等這個房間鎖的人拿到鎖後，locked() 會發現房間已經不見了
+            self._room_locks.pop(room_id, None)
+            self._unindex(room)
+            for p in room.get("players", []):
+                self._unlink_user(p, room_id)
+        self.wake_start_waiters(room_id, None)
+        self._emit("room_closed", room)
+        return room
+
+
+def _copy_room(room: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        **room,
+        "players": list(room.get("players", [])),
+        "ready_players": list(room.get("ready_players", [])),
+    }
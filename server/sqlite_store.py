@@ -0,0 +1,288 @@
+# server/sqlite_store.py
+"""
+db_server 的 sqlite 儲存引擎（GAME_STORE_ENGINE=sqlite 時使用）。
+
+- WAL 模式：讀寫不互相擋
+- 每個 thread 一條 connection（sqlite3 connection 不能跨 thread 共用）
+- SQL 都是固定字串 + ? 參數，sqlite3 會把編譯好的 statement 快取在 connection 上
+- 提供細粒度操作：新增一筆評價、某玩家某遊戲 +1、註冊一個帳號，不用整份重寫
+
+從現有 json 檔匯入（先停掉 lobby server）：
+    python sqlite_store.py migrate [--data-dir data] [--db data/game_store.db]
+"""
+import argparse
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('games_version', 0);
+
+CREATE TABLE IF NOT EXISTS accounts (
+    grp      TEXT NOT NULL,
+    username TEXT NOT NULL,
+    info     TEXT NOT NULL,
+    PRIMARY KEY (grp, username)
+);
+
+CREATE TABLE IF NOT EXISTS games (
+    name TEXT PRIMARY KEY,
+    info TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    game_name TEXT NOT NULL,
+    player    TEXT NOT NULL,
+    score     INTEGER NOT NULL,
+    comment   TEXT NOT NULL DEFAULT '',
+    timestamp TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_ratings_game ON ratings (game_name, id);
+CREATE INDEX IF NOT EXISTS idx_ratings_game_score ON ratings (game_name, score, id);
+CREATE INDEX IF NOT EXISTS idx_ratings_player ON ratings (player);
+
+CREATE TABLE IF NOT EXISTS play_history (
+    player     TEXT NOT NULL,
+    game_name  TEXT NOT NULL,
+    play_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (player, game_name)
+);
+CREATE INDEX IF NOT EXISTS idx_history_game ON play_history (game_name);
+"""
+
+_SQL_GET_ACCOUNT = "SELECT info FROM accounts WHERE grp = ? AND username = ?"
+_SQL_INSERT_ACCOUNT = "INSERT OR IGNORE INTO accounts (grp, username, info) VALUES (?, ?, ?)"
+_SQL_INSERT_GAME = "INSERT INTO games (name, info) VALUES (?, ?)"
+_SQL_GAMES_VERSION = "SELECT value FROM meta WHERE key = 'games_version'"
+_SQL_BUMP_GAMES_VERSION = "UPDATE meta SET value = value + 1 WHERE key = 'games_version'"
+_SQL_INSERT_RATING = (
+    "INSERT INTO ratings (game_name, player, score, comment, timestamp) VALUES (?, ?, ?, ?, ?)"
+)
+_SQL_GAME_RATINGS = (
+    "SELECT player, score, comment, timestamp FROM ratings WHERE game_name = ? ORDER BY id"
+)
+# 分頁用 keyset（WHERE ... < 上一頁最後一筆），深頁也只走 index 的一小段
+_SQL_PAGE_SELECT = "SELECT id, player, score, comment, timestamp FROM ratings WHERE game_name = ? "
+_SQL_RATINGS_PAGE = {
+    ("newest", False): _SQL_PAGE_SELECT + "ORDER BY id DESC LIMIT ?",
+    ("newest", True): _SQL_PAGE_SELECT + "AND id < ? ORDER BY id DESC LIMIT ?",
+    ("oldest", False): _SQL_PAGE_SELECT + "ORDER BY id LIMIT ?",
+    ("oldest", True): _SQL_PAGE_SELECT + "AND id > ? ORDER BY id LIMIT ?",
+    ("highest", False): _SQL_PAGE_SELECT + "ORDER BY score DESC, id DESC LIMIT ?",
+    ("highest", True): _SQL_PAGE_SELECT + "AND (score, id) < (?, ?) ORDER BY score DESC, id DESC LIMIT ?",
+    ("lowest", False): _SQL_PAGE_SELECT + "ORDER BY score, id LIMIT ?",
+    ("lowest", True): _SQL_PAGE_SELECT + "AND (score, id) > (?, ?) ORDER BY score, id LIMIT ?",
+}
+_SQL_INCR_PLAY = (
+    "INSERT INTO play_history (player, game_name, play_count) VALUES (?, ?, ?) "
+    "ON CONFLICT (player, game_name) DO UPDATE SET play_count = play_count + excluded.play_count"
+)
+_SQL_PLAYER_HISTORY = "SELECT game_name, play_count FROM play_history WHERE player = ?"
+
+
+def _rating_row(entry):
+    return (
+        str(entry.get("player", "")),
+        int(entry.get("score", 0)),
+        str(entry.get("comment") or ""),
+        str(entry.get("timestamp") or ""),
+    )
+
+
+class SqliteEngine:
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：自己用 BEGIN/COMMIT 控制交易
+            conn = sqlite3.connect(
+                str(self.path), timeout=30, isolation_level=None, cached_statements=256
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ---------- accounts ----------
+
+    def load_accounts(self):
+        data = {"players": {}, "developers": {}}
+        for grp, username, info in self._conn().execute("SELECT grp, username, info FROM accounts"):
+            data.setdefault(grp, {})[username] = json.loads(info)
+        return data
+
+    def save_accounts(self, data):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM accounts")
+            conn.executemany(
+                _SQL_INSERT_ACCOUNT,
+                (
+                    (grp, username, json.dumps(dict(info), ensure_ascii=False))
+                    for grp, members in data.items()
+                    for username, info in members.items()
+                ),
+            )
+
+    def get_account(self, group, username):
+        row = self._conn().execute(_SQL_GET_ACCOUNT, (group, username)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def register_account(self, group, username, info):
+        cur = self._conn().execute(
+            _SQL_INSERT_ACCOUNT, (group, username, json.dumps(dict(info), ensure_ascii=False))
+        )
+        return cur.rowcount == 1
+
+    # ---------- games ----------
+
+    def games_stamp(self):
+        return self._conn().execute(_SQL_GAMES_VERSION).fetchone()[0]
+
+    def read_games(self):
+        rows = self._conn().execute("SELECT name, info FROM games ORDER BY rowid")
+        return {name: json.loads(info) for name, info in rows}
+
+    def write_games(self, data):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM games")
+            conn.executemany(
+                _SQL_INSERT_GAME,
+                ((name, json.dumps(info, ensure_ascii=False, default=dict)) for name, info in data.items()),
+            )
+            conn.execute(_SQL_BUMP_GAMES_VERSION)
+
+    # ---------- ratings ----------
+
+    def load_ratings(self):
+        data = {}
+        rows = self._conn().execute(
+            "SELECT game_name, player, score, comment, timestamp FROM ratings ORDER BY id"
+        )
+        for game_name, player, score, comment, ts in rows:
+            data.setdefault(game_name, []).append(
+                {"player": player, "score": score, "comment": comment, "timestamp": ts}
+            )
+        return data
+
+    def save_ratings(self, data):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM ratings")
+            conn.executemany(
+                _SQL_INSERT_RATING,
+                ((game_name, *_rating_row(e)) for game_name, entries in data.items() for e in entries),
+            )
+
+    def append_rating(self, game_name, entry):
+        self._conn().execute(_SQL_INSERT_RATING, (game_name, *_rating_row(entry)))
+
+    def get_ratings(self, game_name):
+        rows = self._conn().execute(_SQL_GAME_RATINGS, (game_name,))
+        return [
+            {"player": player, "score": score, "comment": comment, "timestamp": ts}
+            for player, score, comment, ts in rows
+        ]
+
+    def page_ratings(self, game_name, order, after, limit):
+        sql = _SQL_RATINGS_PAGE[(order, after is not None)]
+        rows = self._conn().execute(sql, (game_name, *(after or ()), limit))
+        return [
+            (rid, {"player": player, "score": score, "comment": comment, "timestamp": ts})
+            for rid, player, score, comment, ts in rows
+        ]
+
+    # ---------- play history ----------
+
+    def load_history(self):
+        data = {}
+        for player, game_name, count in self._conn().execute(
+            "SELECT player, game_name, play_count FROM play_history"
+        ):
+            data.setdefault(player, {})[game_name] = count
+        return data
+
+    def save_history(self, data):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM play_history")
+            conn.executemany(
+                _SQL_INCR_PLAY,
+                (
+                    (player, game_name, int(count))
+                    for player, games in data.items()
+                    for game_name, count in games.items()
+                ),
+            )
+
+    def increment_play_count(self, players, game_name, n=1):
+        with self._tx() as conn:
+            conn.executemany(_SQL_INCR_PLAY, ((p, game_name, n) for p in players))
+
+    def get_history(self, player):
+        return dict(self._conn().execute(_SQL_PLAYER_HISTORY, (player,)).fetchall())
+
+
+def migrate_from_json(data_dir, db_path):
+    """把 data_dir 底下的 json 資料（含 journal）一次匯入 sqlite，回傳各類筆數。"""
+    from db_server import JsonEngine
+
+    src = JsonEngine(data_dir)
+    dst = SqliteEngine(db_path)
+
+    accounts = src.load_accounts()
+    games = src.read_games()
+    ratings = src.load_ratings()
+    history = src.load_history()
+
+    dst.save_accounts(accounts)
+    dst.write_games(games)
+    dst.save_ratings(ratings)
+    dst.save_history(history)
+
+    return {
+        "accounts": sum(len(members) for members in accounts.values()),
+        "games": len(games),
+        "ratings": sum(len(entries) for entries in ratings.values()),
+        "history": sum(len(games) for games in history.values()),
+    }
+
+
+def main():
+    default_dir = Path(__file__).parent / "data"
+    parser = argparse.ArgumentParser(description="game store sqlite tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    mig = sub.add_parser("migrate", help="import the json data files into sqlite")
+    mig.add_argument("--data-dir", default=str(default_dir))
+    mig.add_argument("--db", default=str(default_dir / "game_store.db"))
+    args = parser.parse_args()
+
+    if args.cmd == "migrate":
+        counts = migrate_from_json(Path(args.data_dir), Path(args.db))
+        print(f"[MIGRATE] {args.data_dir} -> {args.db}: {counts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# server/transfer_server.py
+"""
+資料通道：遊戲檔案的上傳 / 下載不走 lobby 連線，改由另一個 port 上的 listener 處理。
+
+lobby 上先拿票（player / download_ticket、developer / upload_ticket，回覆裡有 transfer_port），
+再連到這個 port 送一行 JSON {"action": ..., "payload": {"ticket": ..., ...}}，後面接檔案內容。
+傳檔期間 lobby 連線可以繼續處理別的請求，慢的傳輸也不會卡住 lobby 的 thread；
+這邊的連線由自己的 worker pool（GAME_STORE_TRANSFER_WORKERS 條 thread）處理，
+pool 滿了新連線就排隊，閒置超過 IDLE_TIMEOUT 秒的連線會被關掉，把 worker 讓出來。
+
+這個模組只負責收連線、讀請求，請求交給 lobby_server 建好的 Dispatcher（role 一律是 "transfer"），
+跟 lobby 一樣經過 payload 型別檢查、例外轉成錯誤回覆；handler 從 req.session 拿到 conn / reader，
+自己送回覆和檔案（回傳 None），或回傳一個 dict 當回覆。
+"""
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from dispatch import Dispatcher, Request
+from framing import FramedReader
+
+TRANSFER_PORT = int(os.environ.get("GAME_STORE_TRANSFER_PORT", "7071"))
+TRANSFER_WORKERS = int(os.environ.get("GAME_STORE_TRANSFER_WORKERS", "8"))
+IDLE_TIMEOUT = 30  # 秒
+ROLE = "transfer"  # 資料通道的請求在 Dispatcher 裡註冊的 role
+
+
+def listen(host: str, port: int = TRANSFER_PORT, reuse_port: bool = False) -> socket.socket:
+    """開資料通道的 listening socket；reuse_port 給 lobby_cluster 的 worker 共用同一個 port。"""
+    srv = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        srv.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    srv.bind((host, port))
+    srv.listen()
+    return srv
+
+
+def _send_json(conn: socket.socket, obj: Dict[str, Any]):
+    conn.sendall(json.dumps(obj, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+class _Session:
+    """資料通道一條連線的狀態（不用登入，票就是憑證）。"""
+
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self.reader = FramedReader(conn)
+        self.role = None
+        self.user = None
+
+
+class TransferServer:
+    def __init__(self, srv: socket.socket, dispatcher: Dispatcher,
+                 workers: int = TRANSFER_WORKERS):
+        self.srv = srv
+        self.port = srv.getsockname()[1]
+        self.dispatcher = dispatcher
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="transfer")
+        self._closed = threading.Event()
+        self._lock = threading.Lock()
+        self._active = 0  # 正在處理的連線
+        self._served = 0  # 處理過的請求
+
+    def start(self):
+        threading.Thread(target=self._accept_loop, name="transfer-accept", daemon=True).start()
+        print(f"[TRANSFER] Listening on port {self.port} ({self.workers} workers)")
+        return self
+
+    def close(self):
+        self._closed.set()
+        self.srv.close()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"port": self.port, "active": self._active, "served": self._served}
+
+    def _accept_loop(self):
+        while not self._closed.is_set():
+            try:
+                conn, addr = self.srv.accept()
+            except OSError:
+                break  # close() 關掉了 listening socket
+            try:
+                self._pool.submit(self._serve, conn, addr)
+            except RuntimeError:
+                conn.close()  # pool 已經關了
+                break
+
+    def _serve(self, conn: socket.socket, addr):
+        with self._lock:
+            self._active += 1
+        try:
+            conn.settimeout(IDLE_TIMEOUT)
+            session = _Session(conn)
+            while True:
+                line = session.reader.read_frame()
+                if line is None:
+                    break
+                try:
+                    msg = json.loads(line)
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    msg = None
+                if not isinstance(msg, dict):
+                    _send_json(conn, {"status": "error", "message": "invalid message format"})
+                    continue
+                resp = self.dispatcher.dispatch(Request({**msg, "role": ROLE}, session))
+                with self._lock:
+                    self._served += 1
+                if resp is not None:
+                    _send_json(conn, resp)
+        except (OSError, ValueError) as e:
+            # 逾時、對方斷線、訊息太大：這條連線就不要了，client 會重新連
+            print(f"[TRANSFER] connection {addr} closed: {e}")
+        finally:
+            with self._lock:
+                self._active -= 1
+            conn.close()
@@ -0,0 +1,110 @@
+# tests/test_dispatch.py
+"""
+Dispatcher 的 middleware 鏈：before 丟例外時一樣要經過外層的 ErrorMapping / Timing。
+
+執行（在 repo 根目錄）：
+    python -m unittest tests.test_dispatch
+"""
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+from dispatch import Dispatcher, ErrorMapping, Middleware, Request, Timing, Validate  # noqa: E402
+
+
+class _Session:
+    role = None
+    user = None
+
+
+class _Boom(Middleware):
+    """before 丟例外（像 cluster 模式下 _Coordinated 轉給 coordinator 失敗）。"""
+
+    def __init__(self):
+        self.after_calls = 0
+
+    def before(self, req):
+        raise RuntimeError("coordinator went away")
+
+    def after(self, req, resp):
+        self.after_calls += 1
+        return resp
+
+
+class _Recorder(Middleware):
+    def __init__(self):
+        self.calls = []
+
+    def before(self, req):
+        self.calls.append("before")
+        return None
+
+    def after(self, req, resp):
+        self.calls.append("after")
+        return resp
+
+
+def _request(action, payload=None):
+    return Request({"role": "player", "action": action, "payload": payload or {}}, _Session())
+
+
+class DispatcherMiddlewareErrorTest(unittest.TestCase):
+    def _dispatcher(self, *middleware):
+        d = Dispatcher(unknown=lambda req: {"status": "error", "message": "unknown"})
+        for m in middleware:
+            d.use(m)
+        d.add("player", "ping", lambda req: {"status": "ok"}, auth=False)
+
+        async def aping(req):
+            return {"status": "ok"}
+
+        d.add("player", "aping", aping, auth=False)
+        d.compile()
+        return d
+
+    def test_before_raises_is_mapped_and_timed(self):
+        timing, outer, boom = Timing(), _Recorder(), _Boom()
+        d = self._dispatcher(timing, outer, ErrorMapping(), boom)
+        resp = d.dispatch(_request("ping"))
+        self.assertEqual(resp, {"status": "error", "message": "internal server error"})
+        self.assertEqual(timing.snapshot()["player/ping"]["count"], 1)
+        # 外層的 after 有跑；例外是 ErrorMapping 吃掉的，它裡面那層（丟例外的）不跑 after
+        self.assertEqual(outer.calls, ["before", "after"])
+        self.assertEqual(boom.after_calls, 0)
+
+    def test_before_raises_async_route(self):
+        timing = Timing()
+        d = self._dispatcher(timing, ErrorMapping(), _Boom())
+
+        async def run_sync(fn, req):
+            return fn(req)
+
+        resp = asyncio.run(d.dispatch_async(_request("aping"), run_sync))
+        self.assertEqual(resp, {"status": "error", "message": "internal server error"})
+        self.assertEqual(timing.snapshot()["player/aping"]["count"], 1)
+
+    def test_before_raises_without_error_mapping(self):
+        d = self._dispatcher(Timing(), _Boom())
+        with self.assertRaises(RuntimeError):
+            d.dispatch(_request("ping"))
+
+    def test_handler_error_and_short_circuit(self):
+        timing, outer = Timing(), _Recorder()
+        d = Dispatcher(unknown=lambda req: None)
+        for m in (timing, outer, ErrorMapping(), Validate()):
+            d.use(m)
+        d.add("player", "fail", lambda req: 1 / 0, auth=False)
+        d.add("player", "typed", lambda req: {"status": "ok"}, {"n": int}, auth=False)
+        d.compile()
+        self.assertEqual(d.dispatch(_request("fail"))["message"], "internal server error")
+        self.assertEqual(d.dispatch(_request("typed", {"n": "x"}))["message"], "invalid n")
+        self.assertEqual(d.dispatch(_request("typed", {"n": 1})), {"status": "ok"})
+        self.assertEqual(outer.calls, ["before", "after"] * 3)
+        self.assertEqual(timing.snapshot()["player/typed"]["count"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+# tests/test_download_tickets.py
+"""
+下載 / 上傳票的簽名檢查：亂給的票（包括含非 ASCII 字元的）一律回 None，不能丟例外。
+
+執行（在 repo 根目錄）：
+    python -m unittest tests.test_download_tickets
+"""
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+import download_tickets  # noqa: E402
+
+
+class DownloadTicketTest(unittest.TestCase):
+    def test_roundtrip(self):
+        claims = download_tickets.verify(download_tickets.issue("g", "abc"))
+        self.assertEqual((claims["game"], claims["sha256"]), ("g", "abc"))
+
+    def test_upload_and_download_tickets_are_separate(self):
+        upload = download_tickets.sign({"op": "upload", "developer": "d"})
+        self.assertIsNone(download_tickets.verify(upload))
+        self.assertEqual(download_tickets.verify(upload, op="upload")["developer"], "d")
+        self.assertIsNone(download_tickets.verify(download_tickets.issue("g", "abc"), op="upload"))
+
+    def test_expired(self):
+        self.assertIsNone(download_tickets.verify(download_tickets.issue("g", "abc", ttl=-1)))
+
+    def test_tampered(self):
+        ticket = download_tickets.issue("g", "abc")
+        body, _, sig = ticket.rpartition(".")
+        forged = download_tickets.issue("other", "abc").rpartition(".")[0]
+        for bad in (None, 5, "", "no-dot", f"{forged}.{sig}", f"{body}.{'0' * len(sig)}", f"{body}."):
+            self.assertIsNone(download_tickets.verify(bad), repr(bad))
+
+    def test_non_ascii(self):
+        ticket = download_tickets.issue("g", "abc")
+        body, _, sig = ticket.rpartition(".")
+        for bad in (f"{body}.{sig[:-1]}é", f"{body}.票", f"{body}é.{sig}", f"{body}.\udcff"):
+            self.assertIsNone(download_tickets.verify(bad), repr(bad))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+# tests/test_game_manifest.py
+"""
+game_manifest 的版本號 / 路徑檢查：玩家給的 from_version 帶 "../" 不能讀寫 uploaded_games 外面的檔案。
+
+執行（在 repo 根目錄）：
+    python -m unittest tests.test_game_manifest
+"""
+import json
+import sys
+import tempfile
+import unittest
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+import game_manifest  # noqa: E402
+
+
+class GameManifestPathTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        root = Path(self._tmp.name)
+        self._saved = (game_manifest.UPLOAD_DIR, game_manifest.MANIFEST_DIR, game_manifest.DELTA_DIR)
+        game_manifest.UPLOAD_DIR = root / "uploaded_games"
+        game_manifest.MANIFEST_DIR = game_manifest.UPLOAD_DIR / "manifests"
+        game_manifest.DELTA_DIR = game_manifest.UPLOAD_DIR / "deltas"
+        game_manifest.UPLOAD_DIR.mkdir()
+
+        # uploaded_games 外面的檔案，不能被當成 manifest 讀到
+        self.secret = root / "secret.json"
+        self.secret.write_text(json.dumps({"password": [1, "x"]}), encoding="utf-8")
+
+        self.zip_path = game_manifest.UPLOAD_DIR / "g_2.zip"
+        with zipfile.ZipFile(self.zip_path, "w") as z:
+            z.writestr("game_server.py", "print(2)\n")
+        game_manifest.save_manifest("g", "2", self.zip_path)
+
+    def tearDown(self):
+        game_manifest.UPLOAD_DIR, game_manifest.MANIFEST_DIR, game_manifest.DELTA_DIR = self._saved
+        self._tmp.cleanup()
+
+    def test_valid_version(self):
+        for v in ("1", "1.0", "2.0.1-beta", "v3_rc1", 2, 1.5):
+            self.assertTrue(game_manifest.valid_version(v), v)
+        for v in ("", "../secret", "../../../../secret", "a/b", "a\\b", "..", "1..2", "1\x00", "1 0"):
+            self.assertFalse(game_manifest.valid_version(v), repr(v))
+
+    def test_build_delta_rejects_traversal(self):
+        for v in ("../../secret", "../../../../secret", "..\\..\\secret"):
+            with self.assertRaises(ValueError):
+                game_manifest.build_delta("g", v, "2", self.zip_path)
+        # 沒有在 uploaded_games 外面留下 delta 包
+        self.assertEqual(list(Path(self._tmp.name).glob("*_to_*")), [])
+
+    def test_load_manifest_rejects_traversal(self):
+        with self.assertRaises(ValueError):
+            game_manifest.load_manifest("g", "../../../secret")
+        with self.assertRaises(ValueError):
+            game_manifest.load_manifest("../..", "secret")
+
+    def test_build_delta_normal(self):
+        old_zip = game_manifest.UPLOAD_DIR / "g_1.zip"
+        with zipfile.ZipFile(old_zip, "w") as z:
+            z.writestr("game_server.py", "print(1)\n")
+            z.writestr("old.txt", "x")
+        game_manifest.save_manifest("g", "1", old_zip)
+        delta_path, info = game_manifest.build_delta("g", "1", "2", self.zip_path)
+        self.assertTrue(delta_path.is_relative_to(game_manifest.DELTA_DIR.resolve()))
+        self.assertEqual(info["deleted"], ["old.txt"])
+
+    def test_remove_game_stays_inside(self):
+        game_manifest.remove_game("..")
+        self.assertTrue(game_manifest.MANIFEST_DIR.exists())
+        self.assertTrue(self.secret.exists())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,174 @@
+# tests/test_room_registry.py
+"""
+RoomRegistry 的併發壓力測試：很多條 thread 同時對少數幾個房間 join / leave / ready / 開始，
+最後檢查索引（_by_user / _by_game_status / _by_status）和 rooms 一致、沒有房間超過人數上限。
+
+執行（在 repo 根目錄）：
+    python -m unittest tests.test_room_registry
+    GAME_STORE_STRESS_OPS=20000 python -m unittest tests.test_room_registry   # 跑久一點
+"""
+import os
+import random
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+from room_registry import RoomRegistry  # noqa: E402
+
+THREADS = 16
+USERS_PER_THREAD = 3
+OPS_PER_THREAD = int(os.environ.get("GAME_STORE_STRESS_OPS", "3000"))
+GAMES = ["OOXX", "tetris"]
+MAX_PLAYERS = 3
+
+
+class RoomRegistryStressTest(unittest.TestCase):
+    def setUp(self):
+        self.events = []
+        self.events_lock = threading.Lock()
+        self.registry = RoomRegistry(on_event=self._on_event)
+        self.errors = []
+
+    def _on_event(self, event_name, room, **extra):
+        # 事件是在持有房間鎖時送出的，這時候房間不應該超過上限
+        players = room.get("players", [])
+        if len(players) > room.get("max_players", 2):
+            self.errors.append(f"{event_name}: room {room['id']} over capacity {players}")
+        with self.events_lock:
+            self.events.append(event_name)
+
+    # ---------- 跟 lobby_server 一樣的操作（都在房間鎖裡做檢查和修改） ----------
+
+    def _create(self, user, rng):
+        if self.registry.user_room_ids(user):
+            return
+        self.registry.create({
+            "host": user,
+            "game_name": rng.choice(GAMES),
+            "players": [user],
+            "ready_players": [],
+            "max_players": MAX_PLAYERS,
+        })
+
+    def _join(self, user, room_id):
+        with self.registry.locked(room_id) as room:
+            if room is None or user in room["players"]:
+                return
+            if room.get("status") != "waiting":
+                return
+            if len(room["players"]) >= room.get("max_players", 2):
+                return
+            self.registry.add_player(room, user)
+
+    def _leave(self, user, room_id):
+        with self.registry.locked(room_id) as room:
+            if room is None or user not in room["players"]:
+                return
+            self.registry.remove_player(room, user)
+
+    def _ready(self, user, room_id):
+        with self.registry.locked(room_id) as room:
+            if room is None or user not in room["players"]:
+                return
+            self.registry.mark_ready(room, user)
+
+    def _flip_status(self, user, room_id):
+        with self.registry.locked(room_id) as room:
+            if room is None or room.get("host") != user:
+                return
+            if room["status"] == "waiting":
+                self.registry.set_status(room, "playing")
+            else:
+                room["ready_players"] = []
+                self.registry.set_status(room, "waiting")
+
+    def _worker(self, index, barrier):
+        rng = random.Random(index)
+        users = [f"u{index}_{i}" for i in range(USERS_PER_THREAD)]
+        barrier.wait()
+        try:
+            for _ in range(OPS_PER_THREAD):
+                user = rng.choice(users)
+                # 房間 id 只在前面幾個裡挑，讓大家擠在同樣的房間上
+                hi = max(1, self.registry.next_room_id - 1)
+                room_id = rng.randint(max(1, hi - 5), hi)
+                op = rng.random()
+                if op < 0.05:
+                    self._create(user, rng)
+                elif op < 0.45:
+                    self._join(user, room_id)
+                elif op < 0.70:
+                    self._leave(user, room_id)
+                elif op < 0.85:
+                    self._ready(user, room_id)
+                elif op < 0.90:
+                    self._flip_status(user, room_id)
+                else:
+                    self.registry.find("waiting", rng.choice(GAMES))
+                    self.registry.snapshot_all()
+        except Exception as e:  # noqa: BLE001 - 收集起來在主 thread 報
+            self.errors.append(f"worker {index}: {e!r}")
+
+    # ---------- 檢查 ----------
+
+    def _check_consistent(self):
+        reg = self.registry
+        rooms = reg.rooms
+
+        self.assertEqual(set(reg._room_locks), set(rooms))
+
+        expected_by_user = {}
+        expected_by_game_status = {}
+        expected_by_status = {}
+        for room_id, room in rooms.items():
+            players = room["players"]
+            self.assertTrue(players, f"room {room_id} is empty but still registered")
+            self.assertLessEqual(len(players), room["max_players"], f"room {room_id}: {players}")
+            self.assertEqual(len(players), len(set(players)), f"room {room_id}: {players}")
+            self.assertIn(room["host"], players, f"room {room_id}")
+            self.assertLessEqual(set(room["ready_players"]), set(players), f"room {room_id}")
+            for p in players:
+                expected_by_user.setdefault(p, set()).add(room_id)
+            status = room["status"]
+            expected_by_game_status.setdefault((room["game_name"], status), set()).add(room_id)
+            expected_by_status.setdefault(status, set()).add(room_id)
+
+        self.assertEqual(reg._by_user, expected_by_user)
+        self.assertEqual({k: set(v) for k, v in reg._by_game_status.items()}, expected_by_game_status)
+        self.assertEqual({k: set(v) for k, v in reg._by_status.items()}, expected_by_status)
+
+        for game in GAMES:
+            found = [r["id"] for r in reg.find("waiting", game)]
+            self.assertEqual(found, sorted(expected_by_game_status.get((game, "waiting"), ())))
+        self.assertEqual(reg.snapshot_all(), {room_id: {**room} for room_id, room in rooms.items()})
+
+    def test_concurrent_join_leave_ready(self):
+        barrier = threading.Barrier(THREADS)
+        threads = [threading.Thread(target=self._worker, args=(i, barrier)) for i in range(THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(self.errors, [])
+        self._check_consistent()
+        # 確認真的有跑到各種操作，不是一直在空房間上 no-op
+        for name in ("room_updated", "player_joined", "player_left", "room_started", "room_closed"):
+            self.assertIn(name, self.events)
+
+    def test_start_waiters_woken_on_delete(self):
+        room = self.registry.create({"host": "a", "game_name": "OOXX", "players": ["a"], "max_players": 2})
+        fut = self.registry.add_start_waiter(room["id"])
+        with self.registry.locked(room["id"]) as r:
+            self.assertTrue(self.registry.remove_player(r, "a"))
+        self.assertIsNone(fut.result(timeout=1))
+        self.assertEqual(self.registry.rooms, {})
+        self.assertEqual(self.registry._by_user, {})
+        self._check_consistent()
+
+
+if __name__ == "__main__":
+    unittest.main()